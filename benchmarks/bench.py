@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+## authors: Tim
+"""
+This program times the hot spots of the programs and modules of this repository on synthetic data of production sizes (see synthetic.py), so that a slowdown is noticed before the programs reach the cluster.
+1. Usage: 'python bench.py' writes the synthetic files into '/tmp/pyf-bench-production' (once; they are reused by the next runs) and prints the best and median time of each benchmark.
+2. Options:
+	* '--scale small': 100 times smaller files, for a quick check;
+	* '-k select': only the benchmarks whose names contain 'select';
+	* '-r 5': repeats each benchmark 5 times;
+	* '--save base.json': writes the results;
+	* '--compare base.json': marks (and exits with 1) the benchmarks whose best time is more than '--threshold' (1.2) times the best time in base.json.
+3. Benchmarks: thermal_ph.cv_int, normbandos.normbands/normdos, check_maxmin.maxmin, phdisp.read, Parser global edits on 1000 inputs, transbasis.transbasis and Job.select_node. Those which need a missing package (e.g. numpy) are reported as skipped.
+"""
+import os, json, time, argparse, statistics, tempfile
+from sys import path; path[:0] = ["../modules", "../data_processing"] # /home/twchang/bin
+import synthetic
+
+def _lines(filename):
+	fin = open(filename, "r"); lines = fin.readlines(); fin.close(); return lines
+
+def setup_cv_int(data, size):
+	"""cv_int of the phonon DOS at T = 10 K (the conversions of thermal_ph.py)."""
+	from thermal_ph import cv_int
+	from decimal import Decimal
+	import math
+	rows = [line.split() for line in _lines(os.path.join(data, "X.phonon.dos")) if line.strip() and not line.strip().startswith("#")]
+	w_data = [float(row[0]) * 2*math.pi / 33.356 * 10**12 for row in rows]
+	y_data = [float(row[1]) / (2*math.pi / 33.356 * 10**12) for row in rows]
+	return lambda: cv_int(w_data, y_data, Decimal(10))
+
+def setup_normbands(data, size):
+	"""normbands of every line of bands.dat.gnu (10^6 lines)."""
+	from normbandos import make_knorm, normbands
+	lines = _lines(os.path.join(data, "bands.dat.gnu"))
+	kpoints_norm, kpoints_line_norm = make_knorm(_lines(os.path.join(data, "kdist.dat")))
+	return lambda: [normbands(line, 17.4819, kpoints_norm) for line in lines]
+
+def setup_normdos(data, size):
+	"""normdos of every line of S.dos (10^5 points)."""
+	from normbandos import normdos
+	lines = _lines(os.path.join(data, "S.dos"))
+	return lambda: [normdos(line, 17.4819) for line in lines]
+
+def setup_maxmin(data, size):
+	"""maxmin of bands.dat.gnu (10^6 lines)."""
+	from check_maxmin import maxmin
+	return lambda: maxmin(os.path.join(data, "bands.dat.gnu"))
+
+def setup_phdisp(data, size):
+	"""phdisp.read and the analysis of bands.dat.gnu as a 'freq.plot' (10^6 lines)."""
+	from phdisp import read, imaginary, extrema
+	def run():
+		x, q, freqs = read(os.path.join(data, "bands.dat.gnu"))
+		imaginary(x, q, freqs); extrema(freqs)
+	return run
+
+def setup_parser(data, size):
+	"""Parser() of 1000 inputs and a few global edits, like modparam.py (the files are not written)."""
+	from parse import Parser
+	def run():
+		cwd = os.getcwd(); os.chdir(os.path.join(data, "inputs"))
+		try:
+			P = Parser()
+			P.add_ctrl("ecutwfc", "70.0"); P.add_ctrl("degauss", "0.02")
+			P.replace_single_line(r"A\s*=", "  A = 3.0000")
+			P.del_line(r"tstress"); P.find_ctrl("prefix")
+		finally: os.chdir(cwd)
+	return run
+
+def setup_transbasis(data, size):
+	"""transbasis of 10^4 k-vectors from the vasp to the qe basis of fcc."""
+	import numpy as np
+	from transbasis import transbasis
+	from crystalbase import Crystal
+	i_basis = Crystal("k", "fcc", "vasp").basis(); f_basis = Crystal("k", "fcc", "qe").basis()
+	vectors = np.random.default_rng(0).random((size["points"] // 10, 3))
+	return lambda: [transbasis(k, i_basis, f_basis) for k in vectors]
+
+def setup_select_node(data, size):
+	"""Job.select_node of 1, 16, 64 and 256 cores on a synthetic cluster (2000 nodes)."""
+	from multibatch import Job
+	nodes = synthetic.nodes(size["n_nodes"])
+	job = Job("job.sh-scf", 16, 10, {}, None, None, [])
+	return lambda: [job.select_node(ppn, nodes) for ppn in [1, 16, 64, 256]]
+
+benchmarks = {
+	"thermal_ph.cv_int"       : setup_cv_int,
+	"normbandos.normbands"    : setup_normbands,
+	"normbandos.normdos"      : setup_normdos,
+	"check_maxmin.maxmin"     : setup_maxmin,
+	"phdisp.read"             : setup_phdisp,
+	"parse.Parser.global"     : setup_parser,
+	"transbasis.transbasis"   : setup_transbasis,
+	"multibatch.select_node"  : setup_select_node,
+}
+
+def run(names, data, size, repeat):
+	"""Returns {name: {"best": s, "median": s} or {"skipped": reason}}."""
+	results = {}
+	for name in names:
+		try: function = benchmarks[name](data, size)
+		except ImportError as e: results[name] = {"skipped": str(e)}; continue
+		times = []
+		for i in range(repeat):
+			start = time.perf_counter(); function(); times.append(time.perf_counter() - start)
+		results[name] = {"best": min(times), "median": statistics.median(times)}
+	return results
+
+def report(results, base=None, threshold=1.2):
+	"""Prints the results (and the ratio to base); returns the names of the regressions."""
+	regressions = []
+	print("{:<26}{:>12}{:>12}{:>10}".format("benchmark", "best (ms)", "median (ms)", "vs base"))
+	for name, result in results.items():
+		if "skipped" in result: print("{:<26}  skipped: {}".format(name, result["skipped"])); continue
+		ratio = result["best"] / base[name]["best"] if base and "best" in base.get(name, {}) else None
+		slow = ratio is not None and ratio > threshold; regressions += [name] if slow else []
+		print("{:<26}{:>12.1f}{:>12.1f}{:>10}{}".format(name, result["best"]*1000, result["median"]*1000, f"{ratio:.2f}x" if ratio else "", "  <- slower" if slow else ""))
+	return regressions
+
+if __name__ == "__main__":
+	agps = argparse.ArgumentParser(description='benchmarks on synthetic QE data')
+	agps.add_argument('--scale', choices=list(synthetic.sizes), default="production", help='size of the synthetic files')
+	agps.add_argument('--data', default="", help='dir of the synthetic files (default: /tmp/pyf-bench-<scale>)')
+	agps.add_argument('-k', '--select', default="", help='only the benchmarks whose names contain this')
+	agps.add_argument('-r', '--repeat', type=int, default=3, help='runs of each benchmark')
+	agps.add_argument('--save', default="", help='write the results into this json file')
+	agps.add_argument('--compare', default="", help='compare with the results in this json file')
+	agps.add_argument('--threshold', type=float, default=1.2, help='a best time above threshold * base is a regression')
+	args = agps.parse_args()
+	data = args.data or os.path.join(tempfile.gettempdir(), f"pyf-bench-{args.scale}")
+	start = time.perf_counter(); synthetic.generate(data, args.scale)
+	print(f"synthetic data in {data} ({time.perf_counter() - start:.1f} s)")
+	base = json.load(open(args.compare, "r")) if args.compare else None
+	if base and base["scale"] != args.scale: print(f"{args.compare} is of the '{base['scale']}' scale; use '--scale {base['scale']}'."); exit(1)
+	names = [name for name in benchmarks if args.select in name]
+	results = run(names, data, synthetic.sizes[args.scale], args.repeat)
+	regressions = report(results, base and base["results"], args.threshold)
+	if args.save:
+		fout = open(args.save, "w"); json.dump({"scale": args.scale, "results": results}, fout, indent=1); fout.close()
+	if regressions: print(f"{len(regressions)} benchmarks slower than {args.threshold}x the base: {', '.join(regressions)}"); exit(1)
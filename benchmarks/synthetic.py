@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+## authors: Tim
+"""
+This program scales the sample files of this repository up to production sizes for the benchmarks (see bench.py).
+1. Usage: 'python synthetic.py dir' writes into dir:
+	* 'bands.dat.gnu': the bands of 'data_processing/sample files/normbandos' on a finer k-grid and repeated (shifted by 0.01 eV) up to 10^6 lines;
+	* 'kdist.dat': the k-distances of the sample;
+	* 'S.dos': an electron DOS of 10^5 points ('E dos idos', like dos.x);
+	* 'X.phonon.dos': the phonon DOS of 'data_processing/sample files/thermal_ph' interpolated on 10^5 points;
+	* 'inputs/': 1000 QE inputs made from 'input_manipulation/sample files/H3S.*.in'.
+2. Type '--scale small' for files 100 times smaller, e.g. for a quick check of the benchmarks.
+3. The functions can be used by other programs: band_file(filename, lines), dos_file(filename, points), phonon_dos_file(filename, points), input_dir(dirname, files), nodes(n_nodes).
+"""
+import os, math, random, shutil, argparse
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+samples = {
+	"bands": os.path.join(root, "data_processing", "sample files", "normbandos", "bands.dat.gnu"),
+	"kdist": os.path.join(root, "data_processing", "sample files", "normbandos", "kdist.dat"),
+	"phdos": os.path.join(root, "data_processing", "sample files", "thermal_ph", "FeSe.phonon.dos"),
+	"inputs": os.path.join(root, "input_manipulation", "sample files"),
+}
+sizes = {                #band lines  dos points  input files  nodes
+	"production" : dict(lines=10**6, points=10**5, files=1000, n_nodes=2000),
+	"small"      : dict(lines=10**4, points=10**3, files=10,   n_nodes=20),
+}
+
+def _read_bands(filename):
+	"""Returns the bands [[(k, E), ...], ...] of a 'bands.dat.gnu' (bands separated by blank lines)."""
+	bands = [[]]
+	for line in open(filename, "r"):
+		ls = line.split()
+		if len(ls) == 2: bands[-1].append((float(ls[0]), float(ls[1])))
+		elif bands[-1]: bands.append([])
+	return [band for band in bands if band]
+
+def _refine(points, factor):
+	"""Inserts factor-1 linearly interpolated points between each pair of points [(x, y), ...]."""
+	fine = []
+	for (x1, y1), (x2, y2) in zip(points[:-1], points[1:]):
+		fine += [(x1 + (x2 - x1) * i / factor, y1 + (y2 - y1) * i / factor) for i in range(factor)]
+	return fine + [points[-1]]
+
+def band_file(filename: str, lines: int=10**6, sample: str=samples["bands"]):
+	"""Writes a 'bands.dat.gnu' of about lines lines: the k-grid of the sample is refined and its bands are repeated with a shift of 0.01 eV."""
+	bands = _read_bands(sample)
+	factor = max(1, round(math.sqrt(lines / sum(len(band) for band in bands))))
+	bands = [_refine(band, factor) for band in bands]
+	repeat = max(1, round(lines / sum(len(band) + 1 for band in bands)))
+	fout = open(filename, "w")
+	for r in range(repeat):
+		for band in bands:
+			fout.write("".join("    {:.4f}  {: 8.4f}\n".format(k, E + 0.01 * r) for k, E in band) + "\n")
+	fout.close()
+
+def dos_file(filename: str, points: int=10**5, E_fermi: float=17.4819, seed: int=0):
+	"""Writes an electron DOS ('S.dos' of dos.x: E, dos, integrated dos) of points points, a sum of random Gaussian peaks from E_fermi-80 to E_fermi+20 eV."""
+	rng = random.Random(seed)
+	peaks = [(rng.uniform(E_fermi - 80, E_fermi + 20), rng.uniform(0.2, 3), rng.uniform(0.1, 2)) for i in range(60)]
+	fout = open(filename, "w"); fout.write(f"#  E (eV)   dos(E)     Int dos(E) EFermi =   {E_fermi:.3f} eV\n")
+	idos = 0; dE = 100 / points
+	for i in range(points):
+		E = E_fermi - 80 + i * dE
+		dos = sum(h * math.exp(-((E - c) / w) ** 2) for c, w, h in peaks if abs(E - c) < 5 * w)
+		idos += dos * dE
+		fout.write("{:8.3f}  {:.4E}  {:.4E}\n".format(E, dos, idos))
+	fout.close()
+
+def phonon_dos_file(filename: str, points: int=10**5, sample: str=samples["phdos"]):
+	"""Writes a phonon DOS ('*.phonon.dos' of matdyn.x) of about points points, interpolated from the sample."""
+	fin = open(sample, "r"); lines = fin.readlines(); fin.close()
+	header = [line for line in lines if line.strip().startswith("#")]
+	rows = [[float(x) for x in line.split()] for line in lines if line.strip() and not line.strip().startswith("#")]
+	factor = max(1, round(points / len(rows)))
+	fout = open(filename, "w"); fout.write("".join(header))
+	for row1, row2 in zip(rows[:-1], rows[1:]):
+		for i in range(factor):
+			row = [a + (b - a) * i / factor for a, b in zip(row1, row2)]
+			fout.write("  " + "  ".join("{: .10E}".format(x) for x in row) + "\n")
+	fout.write("  " + "  ".join("{: .10E}".format(x) for x in rows[-1]) + "\n"); fout.close()
+
+def input_dir(dirname: str, files: int=1000, sample: str=samples["inputs"]):
+	"""Writes files QE inputs into dirname, copied in turn from the '*.in' of the sample dir with the atoms renamed ('H3S' -> 'H3S0001')."""
+	os.makedirs(dirname, exist_ok=True)
+	templates = sorted(f for f in os.listdir(sample) if f.endswith(".in"))
+	texts = {f: open(os.path.join(sample, f), "r").read() for f in templates}
+	for i in range(files):
+		template = templates[i % len(templates)]; atoms = f"H3S{i // len(templates):04d}"
+		fout = open(os.path.join(dirname, template.replace("H3S", atoms)), "w"); fout.write(texts[template].replace("H3S", atoms)); fout.close()
+
+def nodes(n_nodes: int=2000, np: int=32, seed: int=0):
+	"""Returns [[node_name, free cores], ...] of a synthetic cluster, sorted by free cores like Job.modify_cores (see pbsnodes.synthetic_dump)."""
+	from sys import path; path.insert(0, os.path.join(root, "modules"))
+	from pbsnodes import parse, synthetic_dump
+	free = [[name, node.free] for name, node in parse(synthetic_dump(n_nodes, np, seed)).items() if not node.down and node.free]
+	return sorted(free, key=lambda s: s[1])
+
+def generate(dirname: str, scale: str="production"):
+	"""Writes all the synthetic files of scale into dirname (skipping those already there)."""
+	size = sizes[scale]; os.makedirs(dirname, exist_ok=True)
+	jobs = [
+		("bands.dat.gnu", lambda f: band_file(f, size["lines"])),
+		("kdist.dat",     lambda f: shutil.copy(samples["kdist"], f)),
+		("S.dos",         lambda f: dos_file(f, size["points"])),
+		("X.phonon.dos",  lambda f: phonon_dos_file(f, size["points"])),
+		("inputs",        lambda f: input_dir(f, size["files"])),
+	]
+	for name, write in jobs:
+		if not os.path.exists(os.path.join(dirname, name)): write(os.path.join(dirname, name))
+
+if __name__ == "__main__":
+	agps = argparse.ArgumentParser(description='writes synthetic QE data of production sizes')
+	agps.add_argument('dir', help='the dir of the synthetic files')
+	agps.add_argument('--scale', choices=list(sizes), default="production", help='size of the files')
+	args = agps.parse_args()
+	generate(args.dir, args.scale)
+	for name in sorted(os.listdir(args.dir)):
+		path = os.path.join(args.dir, name)
+		print(f"{name}: " + (f"{len(os.listdir(path))} files" if os.path.isdir(path) else f"{sum(1 for line in open(path))} lines"))
@@ -2,30 +2,35 @@
 """
 This program finds the maximum and minimum of y data in a file. It prints warning if there are multiple y data or the minimum of the y data < 0.
 It will print only the maximum and the minimum of the data if everything goes right.
+Other programs (e.g. normbandos.py) call maxmin(filename) instead of running this program.
 """
 import sys, re
 
-in_cmd = sys.argv
-if len(in_cmd) != 2:
-	print("usage: python check_maxmin.py filename")
-	exit(0)
+def maxmin(f):
+	"""Returns (maximum, minimum, multiple) of the y data in the file f; multiple is True if some lines have more than one y data."""
+	fin = open(f, "r")
+	num = []
+	count = 0
+	for data in fin:
+		if not re.search(r"[^eE\s\d\.\-+]", data):
+			datalist = data.split()
+			count = count+1 if len(datalist) > 2 else count
+			num.append(float(datalist[1])) if len(datalist) > 1 else 0
+	fin.close()
+	return max(num), min(num), count > 0
 
-f = in_cmd[1]  # file name
-fin = open(f, "r")
-num = []
-count = 0
+if __name__ == "__main__":
+	in_cmd = sys.argv
+	if len(in_cmd) != 2:
+		print("usage: python check_maxmin.py filename")
+		exit(0)
 
-for data in fin:
-	if not re.search(r"[^eE\s\d\.\-+]", data):
-		datalist = data.split()
-		count = count+1 if len(datalist) > 2 else count
-		num.append(float(datalist[1])) if len(datalist) > 1 else 0
-print("Warning, multiple y data, please check your file to confirm the max & min.") if count > 0 else 0
+	f = in_cmd[1]  # file name
+	num_large, num_little, multiple = maxmin(f)
+	print("Warning, multiple y data, please check your file to confirm the max & min.") if multiple else 0
 
-num_large, num_little = max(num), min(num)
-print("Maximum : {}".format(num_large))
-print("Minimum : {}".format(num_little))
-
-if (num_little < 0 and "band" not in f):
-	print("Warning, negative value in {}!".format(f))
+	print("Maximum : {}".format(num_large))
+	print("Minimum : {}".format(num_little))
 
+	if (num_little < 0 and "band" not in f):
+		print("Warning, negative value in {}!".format(f))
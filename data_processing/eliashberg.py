@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+## authors: Tim
+"""
+This program calculates the electron-phonon coupling lambda, omega_log, omega_2 and the Tc of McMillan and Allen-Dynes from the Eliashberg functions a2F(w) of all the broadenings at once, for a grid of mu*.
+1. Usage: 'eliashberg.py' reads 'a2F.dos1', 'a2F.dos2', ... (matdyn.x with la2F=.true., one file per broadening, w in Ry) in this directory, or 'alpha2F.dat' (lambda.x, a column per broadening, w in THz); or type the files: 'eliashberg.py H3S/a2F.dos*'.
+2. The formulas (w > 0 only):
+	* lambda = 2 int[a2F(w) / w dw]; omega_log = exp(2/lambda int[a2F(w) ln(w) / w dw]); omega_2 = sqrt(2/lambda int[a2F(w) w dw]);
+	* McMillan (Allen-Dynes form): Tc = omega_log / 1.2 * exp(-1.04 (1 + lambda) / (lambda - mu* (1 + 0.62 lambda)));
+	* Allen-Dynes: Tc = f1 * f2 * Tc(McMillan), f1 = (1 + (lambda / 2.46 (1 + 3.8 mu*))^1.5)^(1/3), f2 = 1 + (omega_2 / omega_log - 1) lambda^2 / (lambda^2 + (1.82 (1 + 6.3 mu*) omega_2 / omega_log)^2).
+3. Options:
+	* '--mu 0.10 0.13 0.16': the mu* grid (default), or '--mu 0.08:0.20:0.01' for a range;
+	* '--unit thz': the unit of w in the files (default: ry for a2F.dos*, thz for alpha2F.dat; also mev, cm);
+	* '-o elph.dat': also writes all the rows (broadening, lambda, omega_log, omega_2, mu*, Tc) into one table.
+4. Other programs can call read_a2F(filenames) -> (w, a2F (broadenings x w), broadenings), moments(w, a2F) -> (lambda, omega_log, omega_2) and tc(lambda, omega_log, omega_2, mu) -> (Tc McMillan, Tc Allen-Dynes) as arrays of broadenings x mu*.
+"""
+import re, os, glob, argparse
+import numpy as np
+
+to_K = {"ry": 157887.51, "thz": 47.992430, "mev": 11.604518, "cm": 1.4387769} ## one unit of w in K
+
+def _numbers(lines):
+	"""Returns the rows of numbers in lines as an array."""
+	rows = [line for line in lines if line.strip() and not line.lstrip().startswith("#") and not re.search(r"[a-df-zA-DF-Z]", line)]
+	return np.array(" ".join(rows).split(), dtype=float).reshape(len(rows), -1)
+
+def dos_index(filename):
+	"""The N at the end of 'a2F.dosN' (0 if none); the '2' of 'a2F' is not part of it."""
+	match = re.search(r"(\d+)$", os.path.basename(filename))
+	return int(match.group(1)) if match else 0
+
+def read_dos(filename):
+	"""Reads an 'a2F.dosN' of matdyn.x; returns w, a2F (total) and the broadening (from its last line 'lambda ... Broadening ...', else N)."""
+	fin = open(filename, "r"); lines = fin.readlines(); fin.close()
+	data = _numbers(lines)
+	broadening = re.search(r"Broadening\s+([-+\d.EeDd]+)", "".join(lines[-3:]))
+	label = float(broadening.group(1).replace("D", "E")) if broadening else float(dos_index(filename))
+	return data[:, 0], data[:, 1], label
+
+def read_alpha2F(filename):
+	"""Reads the 'alpha2F.dat' of lambda.x ('# E(THz)  broadening1 broadening2 ...' and a column of a2F per broadening); returns w, a2F (broadenings x w) and the broadenings."""
+	fin = open(filename, "r"); lines = fin.readlines(); fin.close()
+	data = _numbers(lines)
+	header = next((line for line in lines if line.lstrip().startswith("#")), "")
+	broadenings = [float(x) for x in re.findall(r"[-+]?\d*\.\d+", header.split(")")[-1])]
+	if len(broadenings) != data.shape[1] - 1: broadenings = list(range(1, data.shape[1]))
+	return data[:, 0], data[:, 1:].T, np.array(broadenings)
+
+def read_a2F(filenames):
+	"""Returns w, a2F (broadenings x w) and the broadenings of an 'alpha2F.dat' or of 'a2F.dos*' files (interpolated on the w of the first if their grids differ)."""
+	if len(filenames) == 1 and "a2F.dos" not in os.path.basename(filenames[0]): return read_alpha2F(filenames[0])
+	sets = [read_dos(filename) for filename in filenames]
+	w = sets[0][0]
+	a2F = np.array([a if len(x) == len(w) and np.allclose(x, w) else np.interp(w, x, a, left=0, right=0) for x, a, label in sets])
+	return w, a2F, np.array([label for x, a, label in sets])
+
+def _integrate(w, y):
+	"""Trapezoidal integrals of the rows of y over w."""
+	return ((y[..., 1:] + y[..., :-1]) / 2 * np.diff(w)).sum(axis=-1)
+
+def moments(w, a2F):
+	"""Returns lambda, omega_log and omega_2 (in the unit of w) of every row of a2F (broadenings x w)."""
+	positive = w > 0; w, a2F = w[positive], a2F[:, positive]
+	lam = 2 * _integrate(w, a2F / w)
+	omega_log = np.exp(2 / lam * _integrate(w, a2F * np.log(w) / w))
+	omega_2 = np.sqrt(2 / lam * _integrate(w, a2F * w))
+	return lam, omega_log, omega_2
+
+def tc(lam, omega_log, omega_2, mu):
+	"""Returns the Tc of McMillan (Allen-Dynes form) and of Allen-Dynes (in the unit of omega_log) as arrays of broadenings x mu*; 0 where lambda is too small for mu*."""
+	lam, omega_log, omega_2 = [np.asarray(a, dtype=float)[:, None] for a in [lam, omega_log, omega_2]]
+	mu = np.asarray(mu, dtype=float)[None, :]
+	denominator = lam - mu * (1 + 0.62 * lam)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		mcmillan = np.where(denominator > 0, omega_log / 1.2 * np.exp(-1.04 * (1 + lam) / denominator), 0.0)
+	f1 = np.cbrt(1 + (lam / (2.46 * (1 + 3.8 * mu))) ** 1.5)
+	f2 = 1 + (omega_2 / omega_log - 1) * lam**2 / (lam**2 + (1.82 * (1 + 6.3 * mu) * omega_2 / omega_log) ** 2)
+	return mcmillan, f1 * f2 * mcmillan
+
+def mu_grid(values):
+	"""Returns the mu* of '--mu': numbers, or 'start:stop:step' (stop included)."""
+	grid = []
+	for value in values:
+		if ":" in value:
+			start, stop, step = [float(x) for x in value.split(":")]
+			grid += list(np.round(np.arange(start, stop + step / 2, step), 10))
+		else: grid.append(float(value))
+	return np.array(grid)
+
+if __name__ == "__main__":
+	agps = argparse.ArgumentParser(description='lambda, omega_log and Tc (McMillan, Allen-Dynes) from a2F of all broadenings')
+	agps.add_argument('files', nargs='*', help='a2F.dos* of matdyn.x or alpha2F.dat of lambda.x (default: those in this directory)')
+	agps.add_argument('--mu', nargs='+', default=["0.10", "0.13", "0.16"], help='mu* values, or start:stop:step')
+	agps.add_argument('--unit', choices=list(to_K), default="", help='unit of w in the files (default: ry for a2F.dos*, thz for alpha2F.dat)')
+	agps.add_argument('-o', '--output', default="", help='also write all the rows into this file')
+	args = agps.parse_args()
+	files = args.files or sorted(glob.glob("a2F.dos*"), key=dos_index) or glob.glob("alpha2F.dat")
+	if not files: print("No 'a2F.dos*' or 'alpha2F.dat' in this directory; type the files."); exit(1)
+	unit = args.unit or ("ry" if "a2F.dos" in os.path.basename(files[0]) else "thz")
+	mu = mu_grid(args.mu)
+	## all broadenings and mu* at once
+	w, a2F, broadenings = read_a2F(files)
+	lam, omega_log, omega_2 = moments(w, a2F)
+	omega_log, omega_2 = omega_log * to_K[unit], omega_2 * to_K[unit]
+	mcmillan, allen_dynes = tc(lam, omega_log, omega_2, mu)
+	## a table for every broadening
+	print(f"{len(broadenings)} broadenings from {', '.join(files) if len(files) < 4 else f'{files[0]} ... {files[-1]}'} (w in {unit})")
+	for i, broadening in enumerate(broadenings):
+		print(f"\nBroadening {broadening:g}: lambda = {lam[i]:.4f}, omega_log = {omega_log[i]:.2f} K, omega_2 = {omega_2[i]:.2f} K")
+		print("{:>8}{:>18}{:>20}".format("mu*", "Tc McMillan (K)", "Tc Allen-Dynes (K)"))
+		for j, m in enumerate(mu): print("{:>8.3f}{:>18.2f}{:>20.2f}".format(m, mcmillan[i, j], allen_dynes[i, j]))
+	if args.output:
+		rows = np.column_stack([np.repeat(broadenings, len(mu)), np.repeat(lam, len(mu)), np.repeat(omega_log, len(mu)), np.repeat(omega_2, len(mu)), np.tile(mu, len(broadenings)), mcmillan.ravel(), allen_dynes.ravel()])
+		np.savetxt(args.output, rows, fmt=["%10.5f", "%10.5f", "%12.3f", "%12.3f", "%8.3f", "%12.3f", "%12.3f"], header="broadening  lambda  omega_log(K)  omega_2(K)  mu*  Tc_McMillan(K)  Tc_Allen-Dynes(K)")
+		print(f"\nAll the rows written into {args.output}.")
@@ -5,9 +5,10 @@ This program normalizes the output data regarding electrons (electron bands/dens
 1. This program is written specifically for QE users and files which have "/qe" as their parent directory. It can process a file each time.
 2. Usage: prepare the output file (band, dos, phonon dispersion) and execute this program, follow the instructions and yuor file will be normalized as you wish.
 """
-import re, sys, os, argparse, math
-import subprocess as sub
-import numpy as np
+import re, os, argparse, math
+from sys import path; path.insert(0, "../modules") # /home/twchang/bin
+from check_maxmin import maxmin
+from profiling import span
 
 def get_atoms(choice_qe: bool):
 	"""Checks if the files are from QE calculations and returns the string (atoms). If choice_qe == False and 'qe/' is not the parent dir of current dir, exits the program."""
@@ -63,15 +64,14 @@ def stretch(number, scale):
 		return scale * math.floor(number / scale)
 
 def findmaxmin(input_file):
-	"""Checks the maximum and minimum of the file by executing check_maxmin.py; returns them as Emax, Emin."""
-	E_list = sub.check_output("check_maxmin.py {}".format(input_file), shell=True).decode("utf-8")
-	Emax = float(re.search(r"Maximum\s*:\s*(([+-]|\s)\d*\.\d+)", E_list).group(1))
-	Emin = float(re.search(r"Minimum\s*:\s*(([+-]|\s)\d*\.\d+)", E_list).group(1))
+	"""Checks the maximum and minimum of the file by check_maxmin.maxmin (in this process); returns them as Emax, Emin."""
+	Emax, Emin, multiple = maxmin(input_file)
 	return Emax, Emin
 
 def grep_fermi(atoms):
 	"""Gets the Fermi energy from the file *.scf.out in this directory; returns it as E_fermi."""
-	lfermi = sub.check_output("grep Fermi {}.scf.out".format(atoms), shell=True).decode("utf-8") # the Fermi energy is    17.4819 ev
+	fin = open("{}.scf.out".format(atoms), "r")
+	lfermi = "".join(line for line in fin if "Fermi" in line); fin.close() # the Fermi energy is    17.4819 ev
 	E_fermi_re = re.search(r".*Fermi energy is\s*([+-]?\d*\.?\d*).*", lfermi)
 	E_fermi = float(E_fermi_re.group(1))
 	return E_fermi
@@ -142,14 +142,16 @@ if __name__ == "__main__":
 		print("This program cannot normalize band-files without 'kdist.dat'."); exit(1)
 	input_file = get_files(file_list, mode)
 	## check if fermi energy is needed or not
-	E_fermi = 0 if mode == "phband" else grep_fermi(atoms)
+	with span("parse"):
+		E_fermi = 0 if mode == "phband" else grep_fermi(atoms)
+		fin = open(input_file, "r"); lines = fin.readlines(); fin.close()
+		fmax, fmin = findmaxmin(input_file)
+		if "band" in mode:
+			fin_dist = open("kdist.dat", 'r').readlines()
+			kpoints_norm, kpoints_line_norm = make_knorm(fin_dist)
 	## Start the work in different modes:
-	fin = open(input_file, "r")
-	fmax, fmin = findmaxmin(input_file)
 	fout = open("{}-qe_{}.dat".format(atoms, mode), "w")
 	if "band" in mode:
-		fin_dist = open("kdist.dat", 'r').readlines()
-		kpoints_norm, kpoints_line_norm = make_knorm(fin_dist)
 		Emax_norm, Emin_norm = fmax-E_fermi, fmin-E_fermi
 		# Emax_ceil, Emin_floor = stretch(Emax_norm, 50), stretch(Emin_norm, 50) if "ph" in mode else stretch(Emax_norm, 10), stretch(Emin_norm, 10)
 		if "ph" in mode:
@@ -161,15 +163,12 @@ if __name__ == "__main__":
 				fout.write("    {:.4f}  {: 8.4f}\n".format(k_norm, E_stretch))
 			fout.write("\n")
 		fout.write("    0.0000  0.0000\n    1.0000  0.0000\n\n")
-		for line in fin:
-			line = normbands(line, E_fermi, kpoints_norm)
-			fout.write(line)
+		with span("transform"): lines = [normbands(line, E_fermi, kpoints_norm) for line in lines]
 	if mode == "dos":
 		##  writing fermi line into file
 		f_ceil, f_floor = stretch(fmax, 5), stretch(fmin, 1)
 		for dos_stretch in [f_floor, f_ceil]:
 			fout.write("   0.000  {: .4f}\n".format(dos_stretch))
 		fout.write("\n")
-		for line in fin:
-			line = normdos(line, E_fermi)
-			fout.write(line)
+		with span("transform"): lines = [normdos(line, E_fermi) for line in lines]
+	with span("write"): fout.writelines(lines); fout.close()
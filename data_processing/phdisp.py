@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+## authors: Tim
+"""
+This program analyzes a phonon dispersion from matdyn.x: it flags the imaginary (negative) frequencies with their q-points, checks the acoustic sum rule at Gamma, prints the extrema of every branch and writes the dispersion normalized like 'normbandos.py' (phband).
+1. Usage: 'phdisp.py H3S.freq' (the 'flfrq' file of matdyn.x: '&plot nbnd=, nks= /' and, for each q-point, its coordinates and frequencies), or 'phdisp.py freq.plot' (plotband.x: one block 'x freq' per branch; also the columns 'x f1 f2 ...' of '*.freq.gp'). The file is read at once into an (nq x nmodes) array of cm^-1.
+2. Options:
+	* '--tol 1.0': frequencies below -tol (cm^-1) are imaginary; the 3 acoustic modes at Gamma should be within tol of 0;
+	* '-k kdist.dat': the k-distances of the path (from transbasis.py); x is divided by their sum and their lines are drawn, like 'normbandos.py'. Without it (only for '*.freq') x is the length of the path in 2pi/a, divided by its total;
+	* '-o H3S-qe_phband.dat': the normalized output (default: '<prefix>-qe_phband.dat'); '-n' only prints the analysis.
+3. A branch is the n-th lowest mode of every q-point (matdyn.x sorts the modes), so crossing branches are not followed.
+4. Other programs can call read(filename) -> (x, q, freqs), imaginary(x, q, freqs, tol), acoustic(q, freqs, tol), extrema(freqs) and write(filename, x_norm, freqs, kpoints_line_norm).
+"""
+import re, os, argparse
+import numpy as np
+from sys import path; path.insert(0, "../modules") # /home/twchang/bin
+from normbandos import make_knorm, stretch
+
+def read_freq(filename):
+	"""Reads the 'flfrq' file of matdyn.x; returns q (nq x 3, 2pi/a) and freqs (nq x nmodes, cm^-1)."""
+	fin = open(filename, "r"); text = fin.read(); fin.close()
+	header = re.search(r"&plot\s+nbnd\s*=\s*(\d+)\s*,\s*nks\s*=\s*(\d+)\s*/", text)
+	if not header: raise ValueError(f"{filename} has no '&plot nbnd=, nks= /' header.")
+	nmodes, nq = int(header.group(1)), int(header.group(2))
+	## the fixed-width fields of large negative frequencies may touch ('-1234.5678-123.4567')
+	data = np.array(re.findall(r"[-+]?\d*\.\d+(?:[eEdD][-+]?\d+)?", text[header.end():].replace("D", "E")), dtype=float)
+	if data.size != nq * (3 + nmodes): raise ValueError(f"{filename}: {data.size} numbers instead of nks * (3 + nbnd) = {nq * (3 + nmodes)}.")
+	data = data.reshape(nq, 3 + nmodes)
+	return data[:, :3], data[:, 3:]
+
+def read_plot(filename):
+	"""Reads a 'freq.plot'/'bands.dat.gnu' (one block 'x freq' per branch) or the columns 'x f1 f2 ...' of '*.freq.gp'; returns x (nq) and freqs (nq x nmodes)."""
+	fin = open(filename, "r"); text = fin.read(); fin.close()
+	first = next(line for line in text.split("\n") if line.strip())
+	columns = len(first.split())
+	data = np.array(text.split(), dtype=float).reshape(-1, columns)
+	if columns > 2: return data[:, 0], data[:, 1:]
+	starts = np.flatnonzero(np.diff(data[:, 0]) < 0) + 1 # x starts again at each branch
+	nq = starts[0] if starts.size else len(data)
+	if len(data) % nq: raise ValueError(f"{filename}: the branches do not have the same number of points.")
+	return data[:nq, 0], data[:, 1].reshape(-1, nq).T
+
+def path_distance(q):
+	"""Returns the length of the path through the q-points (nq x 3) up to each of them."""
+	return np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(q, axis=0), axis=1))])
+
+def read(filename):
+	"""Returns (x, q, freqs) of a matdyn.x 'flfrq' file or of a 'freq.plot'; q is None for the latter."""
+	fin = open(filename, "r"); head = fin.read(200); fin.close()
+	if "&plot" in head:
+		q, freqs = read_freq(filename)
+		return path_distance(q), q, freqs
+	x, freqs = read_plot(filename)
+	return x, None, freqs
+
+def imaginary(x, q, freqs, tol=1.0):
+	"""Returns [(iq, x, q or None, modes, lowest frequency), ...] of the q-points with frequencies below -tol."""
+	mask = freqs < -tol
+	rows = np.flatnonzero(mask.any(axis=1))
+	return [(i, x[i], None if q is None else q[i], np.flatnonzero(mask[i]), freqs[i].min()) for i in rows]
+
+def acoustic(q, freqs, tol=1.0):
+	"""Returns [(iq, the 3 frequencies closest to 0), ...] of the Gamma points whose acoustic modes are not within tol of 0 (the acoustic sum rule)."""
+	if q is None: return []
+	gamma = np.flatnonzero(np.linalg.norm(q, axis=1) < 1e-6)
+	lowest = np.take_along_axis(freqs[gamma], np.argsort(np.abs(freqs[gamma]), axis=1)[:, :3], axis=1)
+	return [(i, w) for i, w in zip(gamma, lowest) if np.abs(w).max() > tol]
+
+def extrema(freqs):
+	"""Returns (maximum, iq of maximum, minimum, iq of minimum) of every branch, as arrays of nmodes."""
+	return freqs.max(axis=0), freqs.argmax(axis=0), freqs.min(axis=0), freqs.argmin(axis=0)
+
+def write(filename, x_norm, freqs, kpoints_line_norm):
+	"""Writes the dispersion in the format of 'normbandos.py' (phband): the lines of kpoints_line_norm (stretched to 50 cm^-1), the line of 0, and one block per branch."""
+	fmax, fmin = stretch(freqs.max(), 50), stretch(freqs.min(), 50)
+	fout = open(filename, "w")
+	fout.write("".join("    {:.4f}  {: 8.4f}\n    {:.4f}  {: 8.4f}\n\n".format(k, fmin, k, fmax) for k in kpoints_line_norm))
+	fout.write("    0.0000  0.0000\n    1.0000  0.0000\n\n")
+	for branch in freqs.T:
+		np.savetxt(fout, np.column_stack([x_norm, branch]), fmt="    %.4f  % 8.4f"); fout.write("\n")
+	fout.close()
+
+def _q_str(x, q):
+	return "x = {:.4f}".format(x) + ("" if q is None else "  q = ({: .4f}, {: .4f}, {: .4f})".format(*q))
+
+if __name__ == "__main__":
+	agps = argparse.ArgumentParser(description='imaginary modes, extrema and normalization of a phonon dispersion (matdyn.x)')
+	agps.add_argument('file', help='the flfrq file of matdyn.x (*.freq), or freq.plot')
+	agps.add_argument('--tol', type=float, default=1.0, help='frequencies below -tol (cm^-1) are imaginary')
+	agps.add_argument('-k', '--kdist', default="kdist.dat", help='the k-distances of the path (default: kdist.dat)')
+	agps.add_argument('-o', '--output', default="", help='the normalized output (default: <prefix>-qe_phband.dat)')
+	agps.add_argument('-n', '--no-write', action='store_true', help='only print the analysis')
+	args = agps.parse_args()
+	x, q, freqs = read(args.file)
+	print(f"{args.file}: {freqs.shape[0]} q-points x {freqs.shape[1]} modes (cm^-1)")
+	## imaginary modes and acoustic sum rule
+	flagged = imaginary(x, q, freqs, args.tol)
+	print(f"Imaginary frequencies (< -{args.tol} cm^-1) at {len(flagged)} q-points" + (":" if flagged else "."))
+	for i, xi, qi, modes, lowest in flagged:
+		print(f"  {i:>5}  {_q_str(xi, qi)}  modes {', '.join(str(m + 1) for m in modes)}  lowest {lowest:.4f}")
+	for i, w in acoustic(q, freqs, args.tol):
+		print(f"  Warning, the acoustic modes at Gamma (q-point {i}) are {', '.join(f'{f:.4f}' for f in w)}; check the acoustic sum rule (asr).")
+	## extrema of the branches
+	fmax, imax, fmin, imin = extrema(freqs)
+	print("{:>6}{:>12}{:>10}{:>12}{:>10}".format("branch", "min", "at x", "max", "at x"))
+	for n in range(freqs.shape[1]):
+		print("{:>6}{:>12.4f}{:>10.4f}{:>12.4f}{:>10.4f}".format(n + 1, fmin[n], x[imin[n]], fmax[n], x[imax[n]]))
+	if args.no_write: exit(0)
+	## normalization by kdist
+	if os.path.isfile(args.kdist):
+		fin = open(args.kdist, "r"); kpoints_norm, kpoints_line_norm = make_knorm(fin.readlines()); fin.close()
+	elif q is not None: kpoints_norm, kpoints_line_norm = x[-1], [0.0, 1.0]
+	else: print(f"A 'freq.plot' cannot be normalized without '{args.kdist}'."); exit(1)
+	output = args.output or "{}-qe_phband.dat".format(os.path.basename(args.file).split(".")[0])
+	write(output, x / kpoints_norm, freqs, kpoints_line_norm)
+	print(f"Normalized dispersion written into {output}.")
@@ -6,7 +6,6 @@ This file reads the parameters from 'atoms.json' and transforms the coordinates
 2. Usage: prepare 'atoms.json', execute this program, and you'll get what you need.
 """
 import numpy as np
-import jstyleson as json # pip install jstyleson
 import os
 from sys import path; path.insert(0, "../modules") # /home/twchang/bin
 from crystalbase import Crystal
@@ -98,6 +97,7 @@ def process_kgrid(structure, A, kgridinfo_dict):
 
 if __name__ == "__main__":
 	## load json file
+	import jstyleson as json # pip install jstyleson
 	print("This program needs an input file 'atoms.json', please make sure the file is ready.")
 	if not "atoms.json" in os.listdir(): print("There's no 'atom.json'! Please prepare one."); exit(1)
 	atoms_json_file = open("atoms.json", "r")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+## authors: Tim
+"""
+This program compresses the large outputs of finished calculations (e.g. '*.out', '*.dyn*', '_ph0', '*.save') to free the space of '/data*', and reports the space reclaimed in each calculation directory.
+1. Usage: 'archive.py /data2/twchang/qe/H3S' (or several dirs) finds the calculation directories (those with 'job.sh-*') under the given dirs and selects them by policy:
+	* finished: the QE output of every stage has 'JOB DONE.' and no job of '.qebatch.db' is submitted, running or failed ('--any' to skip this check);
+	* '--age 30': nothing in the directory was modified in the last 30 days;
+	* '--min-size 10M': only the files (or dirs) bigger than 10 MB are compressed.
+2. Files matching '-f' (default: '*.out' '*.dyn*') become 'X.out.gz'; dirs matching '-t' (default: '_ph0' '*.save') become 'X.save.tar.gz'. Type '--zstd' to write '.zst' instead (pip install zstandard).
+3. Each file is compressed as a stream (a few MB of memory for files of any size), and '-j 8' compresses 8 files/dirs at a time in separate processes. Every archive is read back and compared (sha256) with the original before the original is removed; an archive which fails the check is deleted and the original kept.
+4. Type '-n' for a dry run, which only lists the selected directories and what would be compressed.
+5. The archives (and the dirs holding them) keep the modification times of the originals, so the directories still look as old as before.
+"""
+import os, re, shutil, tarfile, hashlib, gzip, argparse, time
+from sys import path; path.insert(0, "../modules") # /home/twchang/bin
+from clean import name_regex, find_name, outermost, tree_size, human
+from workspace import read_stages, read_state
+try: import zstandard # pip install zstandard
+except ImportError: zstandard = None
+
+chunk = 1 << 20 ## bytes read at a time
+suffix = {"gzip": ".gz", "zstd": ".zst"}
+
+def parse_size(size: str):
+	"""Returns the bytes of '10M', '2G', '500k' or '1024'."""
+	match = re.fullmatch(r"\s*([\d.]+)\s*([kKmMgGtT]?)[bB]?\s*", size)
+	if not match: raise argparse.ArgumentTypeError(f"invalid size: '{size}'")
+	return int(float(match.group(1)) * 1024 ** " KMGT".index(match.group(2).upper() or " "))
+
+def calc_dirs(roots, skip=()):
+	"""Returns the directories under roots with at least one 'job.sh-*'; the dirs whose names match a regex of skip (e.g. '*.save') are not searched."""
+	found = []; stack = [os.path.normpath(root) for root in roots][::-1]
+	while stack:
+		directory = stack.pop()
+		try: entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+		except OSError: continue
+		if any(entry.name.startswith("job.sh-") and entry.is_file() for entry in entries): found.append(directory)
+		stack += [entry.path for entry in entries if entry.is_dir(follow_symlinks=False) and not any(regex.match(entry.name) for regex in skip)][::-1]
+	return found
+
+def is_finished(workdir: str):
+	"""Whether every stage of workdir has finished: the QE output of each 'job.sh-*' has 'JOB DONE.' (the output of plotband.x exists), and no job in '.qebatch.db' is submitted, running or failed (see workspace.read_state)."""
+	stages = sorted(job for job in os.listdir(workdir) if job.startswith("job.sh-"))
+	atoms, files = read_stages(workdir, stages)
+	return read_state(workdir, [stage for stage in stages if stage in files], files)[0] == "done" and bool(files)
+
+def last_modified(workdir: str):
+	"""The latest modification time of workdir and the files/dirs in it."""
+	latest = os.stat(workdir).st_mtime
+	with os.scandir(workdir) as entries:
+		for entry in entries:
+			try: latest = max(latest, entry.stat(follow_symlinks=False).st_mtime)
+			except OSError: pass
+	return latest
+
+def targets(workdir: str, files=(), trees=(), min_size: int=0):
+	"""Returns [(path, bytes on disk)] of the files matching files and the dirs matching trees under workdir, bigger than min_size; the archives themselves and the paths inside a chosen dir are left out."""
+	paths = []
+	for pattern in files:
+		paths += [p for p in find_name(pattern, workdir) if os.path.isfile(p) and not os.path.islink(p) and not p.endswith(tuple(suffix.values()))]
+	for pattern in trees:
+		paths += [p for p in find_name(pattern, workdir) if os.path.isdir(p) and not os.path.islink(p) and p != workdir]
+	chosen = [(p, tree_size(p)) for p in outermost(paths)]
+	return [(p, size) for p, size in chosen if size >= min_size]
+
+def _writer(filename, codec, level):
+	"""A binary file object which compresses what is written into filename."""
+	if codec == "zstd": return zstandard.ZstdCompressor(level=level).stream_writer(open(filename, "wb"), closefd=True)
+	return gzip.open(filename, "wb", compresslevel=level)
+
+def _reader(filename, codec):
+	"""A binary file object which decompresses filename."""
+	if codec == "zstd": return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True)
+	return gzip.open(filename, "rb")
+
+def _copy(fin, fout, sha):
+	"""Copies fin into fout (None: only reads) a chunk at a time and updates sha."""
+	while True:
+		data = fin.read(chunk)
+		if not data: return
+		sha.update(data)
+		if fout is not None: fout.write(data)
+
+def _archive_file(path, archive, codec, level):
+	with open(path, "rb") as fin, _writer(archive, codec, level) as fout:
+		sha = hashlib.sha256(); _copy(fin, fout, sha)
+	with _reader(archive, codec) as fin:
+		check = hashlib.sha256(); _copy(fin, None, check)
+	return sha.hexdigest() == check.hexdigest()
+
+def _archive_tree(path, archive, codec, level):
+	"""Writes the dir into a tar stream; the sha256 of each file is compared with the same member read back from the archive."""
+	hashes = {}; base = os.path.dirname(path)
+	with _writer(archive, codec, level) as fout, tarfile.open(fileobj=fout, mode="w|") as tar:
+		for directory, dirnames, filenames in os.walk(path):
+			dirnames.sort()
+			tar.add(directory, arcname=os.path.relpath(directory, base), recursive=False)
+			for filename in sorted(filenames):
+				filepath = os.path.join(directory, filename); arcname = os.path.relpath(filepath, base)
+				info = tar.gettarinfo(filepath, arcname)
+				if not info.isreg(): tar.addfile(info); hashes[arcname] = None; continue
+				with open(filepath, "rb") as fin:
+					data = _Hashing(fin); tar.addfile(info, data); hashes[arcname] = data.sha.hexdigest()
+	found = {}
+	with _reader(archive, codec) as fin, tarfile.open(fileobj=fin, mode="r|") as tar:
+		for member in tar:
+			if member.isdir(): continue
+			if not member.isreg(): found[member.name] = None; continue
+			sha = hashlib.sha256(); _copy(tar.extractfile(member), None, sha); found[member.name] = sha.hexdigest()
+	return found == hashes
+
+class _Hashing:
+	"""A file object which hashes what is read from it."""
+	def __init__(self, fin):
+		self.fin = fin
+		self.sha = hashlib.sha256()
+	def read(self, size=-1):
+		data = self.fin.read(size); self.sha.update(data); return data
+
+def archive(path: str, codec: str="gzip", level: int=6):
+	"""Compresses a file into 'path.gz' (or a dir into 'path.tar.gz'), checks the archive, and removes the original. Returns (path, archive, bytes before, bytes after, error message or None)."""
+	is_dir = os.path.isdir(path)
+	archive = path + (".tar" if is_dir else "") + suffix[codec]; temp = archive + ".part"
+	before = tree_size(path)
+	if os.path.exists(archive): return path, archive, before, 0, f"{archive} already exists"
+	try:
+		mtime = os.stat(path).st_mtime
+		good = (_archive_tree if is_dir else _archive_file)(path, temp, codec, level)
+		if not good: os.remove(temp); return path, archive, before, 0, "the archive differs from the original"
+		os.utime(temp, (mtime, mtime)); os.replace(temp, archive)
+		shutil.rmtree(path) if is_dir else os.remove(path)
+	except (OSError, tarfile.TarError, EOFError) as e:
+		if os.path.exists(temp): os.remove(temp)
+		return path, archive, before, 0, str(e)
+	return path, archive, before, tree_size(archive), None
+
+def report(results, workdirs):
+	"""workdirs: [(directory, {its paths})]. Prints the space reclaimed in each directory and in total."""
+	print("{:<50}{:>7}{:>10}{:>10}{:>10}".format("directory", "files", "before", "after", "freed"))
+	total = [0, 0, 0]
+	for workdir, paths in workdirs:
+		done = [r for r in results if r[0] in paths and not r[4]]
+		before = sum(r[2] for r in done); after = sum(r[3] for r in done)
+		total = [total[0] + len(done), total[1] + before, total[2] + after]
+		print("{:<50}{:>7}{:>10}{:>10}{:>10}".format(workdir[-50:], len(done), human(before), human(after), human(before - after)))
+	print("{:<50}{:>7}{:>10}{:>10}{:>10}".format("total", total[0], human(total[1]), human(total[2]), human(total[1] - total[2])))
+
+if __name__ == "__main__":
+	## arg process
+	agps = argparse.ArgumentParser(description='compresses the large outputs of finished calculations')
+	agps.add_argument('dirs', nargs='*', default=["."], help='dirs to search for calculation directories')
+	agps.add_argument('-f', '--files', nargs='+', default=["*.out", "*.dyn*"], help='names of the files to compress (glob, like find -name)')
+	agps.add_argument('-t', '--trees', nargs='+', default=["_ph0", "*.save"], help='names of the dirs to archive (glob)')
+	agps.add_argument('--age', type=float, default=30, help='only the directories not modified for this many days')
+	agps.add_argument('--min-size', type=parse_size, default="10M", help='only the files/dirs bigger than this, e.g. 500k, 10M, 1G')
+	agps.add_argument('--any', action='store_true', help='do not require that every stage has finished')
+	agps.add_argument('--zstd', action='store_true', help='compress with zstd instead of gzip')
+	agps.add_argument('-l', '--level', type=int, default=None, help='compression level (default: 6 for gzip, 3 for zstd)')
+	agps.add_argument('-j', '--jobs', type=int, default=8, help='number of files/dirs compressed at a time')
+	agps.add_argument('-n', '--dry-run', action='store_true', help='only show what would be compressed')
+	args = agps.parse_args()
+	codec = "zstd" if args.zstd else "gzip"
+	if codec == "zstd" and zstandard is None: print("zstd needs the package 'zstandard' (pip install zstandard)."); exit(1)
+	level = args.level if args.level is not None else {"gzip": 6, "zstd": 3}[codec]
+	## select the calculation directories
+	now = time.time(); selected = []
+	for workdir in calc_dirs(args.dirs, [name_regex(pattern) for pattern in args.trees]):
+		if now - last_modified(workdir) < args.age * 86400: continue
+		if not args.any and not is_finished(workdir): continue
+		selected.append(workdir)
+	jobs = {workdir: targets(workdir, args.files, args.trees, args.min_size) for workdir in selected}
+	seen = set() # a calculation directory inside another one keeps its own files
+	for workdir in sorted(jobs, key=lambda d: -d.count("/")):
+		jobs[workdir] = [(p, size) for p, size in jobs[workdir] if p not in seen]; seen.update(p for p, _ in jobs[workdir])
+	jobs = [(workdir, paths) for workdir, paths in jobs.items() if paths]
+	if not jobs: print("No files to compress."); exit(0)
+	for workdir, paths in jobs:
+		print(f"{workdir}: " + ", ".join(f"{os.path.relpath(p, workdir)} ({human(size)})" for p, size in paths))
+	if args.dry_run:
+		print(f"Dry run: {sum(len(paths) for _, paths in jobs)} files/dirs, {human(sum(size for _, paths in jobs for _, size in paths))} would be compressed."); exit(0)
+	## compress
+	from concurrent.futures import ProcessPoolExecutor
+	parents = {os.path.dirname(p) for _, paths in jobs for p, _ in paths}
+	parents = {parent: os.stat(parent) for parent in parents}
+	with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+		futures = [pool.submit(archive, p, codec, level) for _, paths in jobs for p, _ in paths]
+		results = [future.result() for future in futures]
+	for parent, info in parents.items(): os.utime(parent, (info.st_atime, info.st_mtime))
+	for path, archive_name, before, after, error in results:
+		if error: print(f"Cannot compress {path}: {error}")
+	report(results, [(workdir, {p for p, _ in paths}) for workdir, paths in jobs])
@@ -6,16 +6,94 @@ This program finds and displays the specified files/dirs that users want to dele
 2. Name of files/dirs can be written in glob; the program will express all the related files and directories in detail.
 3. You can choose three options (y/n/c) to decide how to clean the files/dirs. 'y' -> the program will delete all the listed files/dirs after the countdown. 'n' -> the program will stop, no files will be deleted. 'c' (choose by oneself) -> The program will ask you to enter what you want to delete (please enter the whole name this time), and then delete them after the countdown.
 4. Please be aware that all the sub-directories of the chosen dirs will be removed after the 3-second countdown. You can press 'ctrl+z' to stop it.
+5. Options: 'clean.py -n tmp' (dry run) goes through the same steps but only shows what would be removed; 'clean.py -r "*.wfc*"' only reports the size of every match, biggest first; '-j 8' removes 8 files/dirs at a time.
+6. Files/dirs are matched like 'find -name': the pattern is matched with the name (not the path) of every file/dir under the working directory, '*' also matches a leading '.', and the matched dirs are searched as well.
 """
-import subprocess as sub
+import os, re, stat, shutil, argparse
 from time import sleep
-import sys
+from concurrent.futures import ThreadPoolExecutor
 
-def arg_process(in_cmd) -> bool:
-	"""Reads the sys.argv as in_cmd. Exits when sys.argv is wrong. Returns True or False for different conditions."""
-	if len(in_cmd) > 2: print("Usage: clean.py (file/dir)"); exit(1)
-	elif len(in_cmd) == 2: return True # have arg
-	else: return False # no arg
+def name_regex(pattern: str):
+	"""Compiles a 'find -name' pattern: '*', '?', '[...]' (negated by '!' or '^'), and '\\' escaping the next character; '/' and a leading '.' are not special."""
+	regex = ""; i = 0
+	while i < len(pattern):
+		c = pattern[i]
+		if c == "\\" and i+1 < len(pattern): regex += re.escape(pattern[i+1]); i += 2; continue
+		if c == "*": regex += ".*"
+		elif c == "?": regex += "."
+		elif c == "[":
+			j = i + 1
+			if j < len(pattern) and pattern[j] in "!^": j += 1
+			if j < len(pattern) and pattern[j] == "]": j += 1 # ']' first in the set is literal
+			while j < len(pattern) and pattern[j] != "]": j += 1
+			if j >= len(pattern): regex += re.escape(c) # no closing ']': a literal '['
+			else:
+				body = pattern[i+1:j]; negate = body[:1] in ("!", "^")
+				body = body[1:] if negate else body
+				regex += "[" + ("^" if negate else "") + body.replace("\\", "\\\\").replace("[", "\\[") + "]"; i = j
+		else: regex += re.escape(c)
+		i += 1
+	try: return re.compile(regex + r"\Z", re.S)
+	except re.error: return re.compile(r"(?!)") # e.g. an invalid range '[b-a]', which 'find' matches with nothing
+
+def find_name(pattern: str, root: str="."):
+	"""Returns the paths under root whose names match pattern, in the same order as 'find root -name pattern' (symlinks are not followed)."""
+	regex = name_regex(pattern); matches = []
+	def visit(directory):
+		try: entries = list(os.scandir(directory))
+		except OSError: return
+		for entry in entries:
+			if regex.match(entry.name): matches.append(entry.path)
+			try: is_dir = entry.is_dir(follow_symlinks=False)
+			except OSError: is_dir = False
+			if is_dir: visit(entry.path)
+	if regex.match(os.path.basename(os.path.normpath(root)) if root not in (".", "..") else root): matches.append(root)
+	visit(root)
+	return matches
+
+def tree_size(path: str):
+	"""Returns the bytes on disk (st_blocks) of a file, or of a dir and everything under it."""
+	try: info = os.lstat(path)
+	except OSError: return 0
+	size = info.st_blocks * 512
+	if stat.S_ISDIR(info.st_mode):
+		stack = [path]
+		while stack:
+			try: entries = os.scandir(stack.pop())
+			except OSError: continue
+			with entries:
+				for entry in entries:
+					try:
+						size += entry.stat(follow_symlinks=False).st_blocks * 512
+						if entry.is_dir(follow_symlinks=False): stack.append(entry.path)
+					except OSError: pass
+	return size
+
+def human(size: float):
+	"""Returns size in the units of 'ls -h'."""
+	for unit in ["", "K", "M", "G", "T"]:
+		if size < 1024 or unit == "T": return f"{size:.0f}{unit}" if unit == "" else f"{size:.1f}{unit}"
+		size /= 1024
+
+def outermost(paths):
+	"""Drops the paths inside another path of the list (removed together with it)."""
+	chosen = []; container = None
+	for path in sorted(dict.fromkeys(paths), key=os.path.normpath):
+		norm = os.path.normpath(path)
+		if container and (norm == container or norm.startswith(container + "/")): continue
+		chosen.append(path); container = norm
+	return chosen
+
+def total_size(paths, sizes):
+	"""The bytes freed by removing all the paths ('.' and '..' are never removed)."""
+	return sum(sizes[path] for path in outermost([path for path in paths if os.path.basename(os.path.normpath(path)) not in (".", "..")]))
+
+def remove(path: str):
+	"""Removes a file, a symlink, or a dir with everything in it. Returns the error message, or None."""
+	try:
+		if os.path.isdir(path) and not os.path.islink(path): shutil.rmtree(path)
+		else: os.remove(path)
+	except OSError as e: return str(e)
 
 def countdown():
 	"""Countdowns for three seconds."""
@@ -24,41 +102,71 @@ def countdown():
 		sleep(1)
 	print("")
 	
-def process_rmlist(rm_list):
-	"""Removes the files/dirs from rm_list"""
+def process_rmlist(rm_list, sizes: dict=None, dry_run: bool=False, workers: int=8):
+	"""Removes the files/dirs from rm_list (a few at a time) and prints the bytes freed."""
+	refused = [path for path in rm_list if os.path.basename(os.path.normpath(path)) in (".", "..")]
+	if refused: print("Refusing to remove '.' or '..'; skipped.")
+	rm_list = outermost([path for path in rm_list if path not in refused])
+	sizes = {path: (sizes or {}).get(path, None) for path in rm_list}
+	sizes = {path: tree_size(path) if size is None else size for path, size in sizes.items()}
+	if dry_run:
+		[print(f"would remove {path} ({human(sizes[path])})") for path in rm_list]
+		print(f"Dry run: {len(rm_list)} files/dirs, {human(sum(sizes.values()))} would be freed."); return
 	print("Processing", end = " ")
 	countdown()
-	for file in rm_list:
-		sub.run("rm -r {}".format(file), shell=True)
-	print("Done.")
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		errors = dict(zip(rm_list, pool.map(remove, rm_list)))
+	for path, error in errors.items():
+		if error: print(f"Cannot remove {path}: {error}")
+	freed = sum(sizes[path] for path in rm_list if not errors[path])
+	print(f"Done. {sum(not error for error in errors.values())}/{len(rm_list)} files/dirs removed, {human(freed)} freed.")
+
+def show(remove_list, sizes):
+	"""Lists the matches like 'ls -lhd': type, size on disk (with everything inside), modification time, path."""
+	from datetime import datetime
+	for path in remove_list:
+		try: info = os.lstat(path)
+		except OSError: continue
+		kind = "d" if stat.S_ISDIR(info.st_mode) else "l" if stat.S_ISLNK(info.st_mode) else "-"
+		print("{} {:>7} {} {}".format(kind, human(sizes[path]), datetime.fromtimestamp(info.st_mtime).strftime("%b %d %H:%M"), path))
 
 if __name__ == "__main__":
 	## arg process
-	in_cmd = sys.argv
-	if arg_process(in_cmd): # argv
-		filename = in_cmd[1]
+	agps = argparse.ArgumentParser(description='removes the files/dirs with the given name in ALL sub directories')
+	agps.add_argument('filename', nargs='?', help='name of the files/dirs (glob, like find -name)')
+	agps.add_argument('-n', '--dry-run', action='store_true', help='only show what would be removed')
+	agps.add_argument('-r', '--report', action='store_true', help='only report the size of every match, biggest first')
+	agps.add_argument('-j', '--jobs', type=int, default=8, help='number of files/dirs removed at a time')
+	args = agps.parse_args()
+	if args.filename: # argv
+		filename = args.filename
 		print("This program helps you to remove the '{}'s (file/dir) in ALL sub directories.".format(filename))
 	else: # input interaction
 		filename = input("Please enter the file/dir you want to remove in ALL sub directories: ") # "WAVECAR", "WAV*", "tmp"
-	## list the files 
-	remove_list = sub.check_output(f"find -name {filename}", shell=True).decode("utf-8").split("\n")
-	remove_list.pop(-1) if remove_list[-1] == '' else 0
+	## list the files
+	remove_list = find_name(filename, ".")
+	with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+		sizes = dict(zip(remove_list, pool.map(tree_size, remove_list)))
+	if args.report:
+		show(sorted(remove_list, key=lambda path: -sizes[path]), sizes)
+		print(f"{len(remove_list)} matches, {human(total_size(remove_list, sizes))} in total."); exit(0)
 	print(remove_list)
-	[sub.run("ls -lhd {}".format(x), shell=True) for x in remove_list]
+	show(remove_list, sizes)
+	print(f"{human(total_size(remove_list, sizes))} in total.")
 	## remove files with different choices
 	print(f"Remove ALL '{filename}'s? (y/n/c) (enter c to choose specifically): ", end="")
 	while True:
 		choice = input()
 		if choice == "y":
 			rm_list = remove_list
-			process_rmlist(rm_list); exit(0)
+			process_rmlist(rm_list, sizes, args.dry_run, args.jobs); exit(0)
 		elif choice == "c":
 			print("Please list what you want to remove according to the above (seperate by space)")
 			str_rmlist = input()
-			rm_list = str_rmlist.split(" ")
+			rm_list = str_rmlist.split()
 			print(rm_list)
-			process_rmlist(rm_list); exit(0)
+			process_rmlist(rm_list, sizes, args.dry_run, args.jobs); exit(0)
 		elif choice == "n":
 			print("You choose to keep the files; exiting.."); exit(0)
 		else:
-			print("Please type 'y' or 'n' or 'c': ",  end="")
\ No newline at end of file
+			print("Please type 'y' or 'n' or 'c': ",  end="")
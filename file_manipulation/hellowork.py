@@ -4,38 +4,58 @@
 This program shows the sub directories of each working directory, provides options for more detail informations like used storage.
 1. This program is written specifically for 'twchang'. It cannot be used in other systems or computers.
 2. Press '-h' for instruction and help. Press '-v' to show only the files/dirs under 'twchang/vasp'. Press -q to show only the files/dirs under 'twchang/qe'. Press '-s' to show the used storage of 'twchang/vasp' or 'twchang/qe'.
+3. With '-s', the storage is taken from an index ('~/.hellowork_du.db'; see modules/duindex.py): only the directories whose mtime changed since the last run are listed again. Press '--full' to recount everything (files growing in place do not change the mtime of their directory). Press '-b 10' to show the 10 biggest calculation directories from the index.
+4. Press '-c' to update the workspace index ('~/.qe_workspace.db'; see modules/workspace.py) and show the number of calculation directories (those with 'job.sh-*') in each state, and the unfinished ones. workparam.py and 'qebatch.py -w' read the same index.
+5. Without '-s', counting the storage of a directory stops once it reaches the limit ('-l', 0.5 GB by default), which is enough to tell whether it has work files. Press '-j' to set the number of parallel walkers (16 by default).
 """
-import os, re, argparse
-from sys import argv
-import subprocess as sub
-from pprint import pprint
+import os, re, argparse, glob
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, wait
+from sys import path; path.insert(0, "../modules") # /home/twchang/bin
+from duindex import DiskIndex
+from workspace import Workspace
 
-def cd(max_limit, directory: str="./"):
-	""" This function recursively checks the sub directories from their parent directory, calculating the sum of the used storage of each file inside them if the user wants to check the storage.
-	"""
-	global current_total # total used storage
-	dir_list = os.listdir(directory) # list sub-dirs/files of current dir (dir path)
-	dir_path_list = [directory + f"/{m}" for m in dir_list] # list of paths of sub-dirs/files
-	files = list(filter(lambda x: os.path.isfile(x), dir_path_list)) # filter -> list of 'files'
-	dirs = list(filter(lambda x: os.path.isdir(x), dir_path_list)) # filter -> list of 'sub-dirs'
+class Usage:
+	"""The bytes counted in one working directory by several walkers; they stop early once limit (bytes) is reached. limit=None counts everything."""
+	def __init__(self, limit=None):
+		self.total = 0
+		self.limit = limit
+		self.lock = Lock()
 
-	if choice_storage:
-		for file in files:
-			current_total += os.path.getsize(file)
-	else:
-		for file in files:
-			# print("{}: {}".format(file, os.path.getsize(file)))
-			current_total += os.path.getsize(file)
-		if current_total >= max_limit:  # There are many files in the directory; no need to check further
-			# print("over limit!! exiting...")
-			return False
+	def add(self, size: int):
+		"""Adds size; returns False if the walkers should stop."""
+		with self.lock:
+			self.total += size
+			return self.limit is None or self.total < self.limit
 
-	if not dir_path_list: # no files
-		return True
-	else:
-		for nextdir in dirs:
-			if not cd(max_limit, nextdir + "/"): return False
-		return True
+def walk(directory: str, usage: Usage):
+	"""Adds the sizes of all the files under directory to usage, by os.scandir (the type of each entry comes with it, one stat per file; symlinks are not followed). Returns False if stopped by the limit of usage."""
+	stack = [directory]
+	while stack:
+		path = stack.pop(); size = 0
+		try: entries = os.scandir(path)
+		except OSError: continue # permission denied, removed meanwhile, ...
+		with entries:
+			for entry in entries:
+				try:
+					if entry.is_dir(follow_symlinks=False): stack.append(entry.path)
+					elif entry.is_file(follow_symlinks=False): size += entry.stat(follow_symlinks=False).st_size
+				except OSError: pass
+		if not usage.add(size): return False
+	return True
+
+def disk_usage(dirpaths: list, limit=None, workers: int=16):
+	"""Returns {dirpath: bytes} of the files under each dirpath. The top-level sub-directories of all the dirpaths (on different mounts) are walked at the same time by a thread pool. With limit (bytes), the walk of a dirpath stops once it has at least limit bytes."""
+	usages = {dirpath: Usage(limit) for dirpath in dirpaths}
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		futures = []
+		for dirpath in dirpaths:
+			try: entries = list(os.scandir(dirpath))
+			except OSError: continue
+			usages[dirpath].add(sum(entry.stat(follow_symlinks=False).st_size for entry in entries if entry.is_file(follow_symlinks=False)))
+			futures += [pool.submit(walk, entry.path, usages[dirpath]) for entry in entries if entry.is_dir(follow_symlinks=False)]
+		wait(futures)
+	return {dirpath: usage.total for dirpath, usage in usages.items()}
 
 def sort_twdirlist(tw_dirlist):
 	twdir_numlist = [int(re.search(r"\d+", tw_dir).group(0)) for tw_dir in tw_dirlist]
@@ -49,12 +69,17 @@ if __name__ == "__main__":
 	agps.add_argument('-q', '--qe', action='store_true', help='show informations for /qe')
 	agps.add_argument('-v', '--vasp', action='store_true', help='show informations for /vasp')
 	agps.add_argument('-s', '--storage', action='store_true', help='show used storage for chosen dirs')
+	agps.add_argument('-l', '--limit', type=float, default=0.5, help='without -s, stop counting the storage of a dir at this many GB')
+	agps.add_argument('-j', '--jobs', type=int, default=16, help='number of parallel walkers')
+	agps.add_argument('--full', action='store_true', help='with -s/-c, recount/reread every directory instead of only the changed ones')
+	agps.add_argument('-c', '--calcs', action='store_true', help='update the workspace index and show the calculation directories and their states')
+	agps.add_argument('-b', '--biggest', type=int, default=0, help='show this many biggest directories (from the index of -s)')
 	# agps.add_argument('-t', '--tk', type=str, choices=['y','Y'], help='type -t y/Y for tk.py') #, required=True
 	args = agps.parse_args()
 	choice_qe = args.qe; choice_vasp = args.vasp
 	choice_storage = args.storage
 
-	tw_dirlist = sub.check_output("find /data*/ -maxdepth 1 -name twchang", shell=True).decode("utf-8").split() # data*/twchang
+	tw_dirlist = [d for d in glob.glob("/data*/twchang") if os.path.isdir(d)] # data*/twchang
 	tw_dirlist = sort_twdirlist(tw_dirlist)
 
 	## establish work_dirdict
@@ -62,29 +87,47 @@ if __name__ == "__main__":
 	if choice_qe ^ choice_vasp:
 		worklist.append("vasp") if choice_vasp else worklist.append("qe")
 	else: worklist = ["vasp", "qe"]
-	work_dirdict = {tw_dir : {calc : sub.check_output(f"find {tw_dir} -maxdepth 1 -name {calc}", shell=True).decode("utf-8").strip() for calc in worklist} for tw_dir in tw_dirlist}
+	work_dirdict = {tw_dir : {calc : os.path.join(tw_dir, calc) if os.path.isdir(os.path.join(tw_dir, calc)) else "" for calc in worklist} for tw_dir in tw_dirlist}
 	# pprint(work_dirdict) # two level dict
 
-	max_limit = 0.5 * 10**9 # 0.5 GB
+	max_limit = None if choice_storage else args.limit * 10**9 # 0.5 GB
+	dirpaths = [dirpath for tw_dir in work_dirdict for dirpath in work_dirdict[tw_dir].values() if dirpath]
+	if choice_storage or args.biggest:
+		index = DiskIndex()
+		totals = {dirpath: index.scan(dirpath, full=args.full, workers=args.jobs) if choice_storage else index.total(dirpath) or 0 for dirpath in dirpaths}
+	else: totals = disk_usage(dirpaths, max_limit, args.jobs)
+	if args.calcs:
+		workspace = Workspace()
+		[workspace.update(dirpath, full=args.full, workers=args.jobs) for dirpath in dirpaths]
 	for tw_dir in work_dirdict:
 		tw_dir_colour = re.sub(r"(data\d*)", r"\033[34m\g<1>\033[0m", tw_dir)
 		print(f"{tw_dir_colour}:")
 		for calc in work_dirdict[tw_dir]:
 			dirpath = work_dirdict[tw_dir][calc]
-			current_total = 0
 			if dirpath == '':
 				print(f"  \033[31mNo\033[0m '\033[34m{calc}\033[0m' in {tw_dir}"); continue
 			else:
-				flag = cd(max_limit, dirpath) # T or F
+				current_total = totals[dirpath]
 				if current_total < 1000:
 					print(f"  \033[31mNo\033[0m work files in {dirpath}")
 				else:
-					ls_dirs = [f for f in os.listdir(dirpath) if os.path.isdir("/".join([dirpath, f]))]
+					ls_dirs = sorted(entry.name for entry in os.scandir(dirpath) if entry.is_dir())
 					ls_str = ", ".join([f"\033[34m{file}\033[0m" for file in ls_dirs])
 					print("  \033[32mWorking dirs\033[0m in {}: {}".format(dirpath, ls_str))
 					if choice_storage:
 						print("  \033[32mUsed storage\033[0m in {}: {:.2f} GB".format(dirpath, current_total/10**9))
+			if args.calcs:
+				records = workspace.calcs(dirpath); states = {}
+				[states.setdefault(record["state"], []).append(record) for record in records]
+				print("  \033[32mCalculations\033[0m in {}: {}".format(dirpath, len(records)) + (" (" + ", ".join(f"{state} {len(states[state])}" for state in sorted(states)) + ")" if records else ""))
+				for record in sorted(records, key=lambda record: (record["state"], record["path"])):
+					if record["state"] != "done": print("    {:<8}{:>3}/{:<3} {}".format(record["state"], record["done"], len(record["stages"]), record["path"]))
 			if choice_storage and (calc == "vasp" and len(work_dirdict[tw_dir]) == 2):
 				print("  --------------------")
 		# print(list(work_dirdict)[-1])
 		print("-------------------------------------------------------")  if tw_dir != list(work_dirdict)[-1] else 0
+	if args.biggest:
+		biggest = sorted([row for dirpath in dirpaths for row in index.biggest(dirpath, args.biggest, depth=1)], key=lambda row: -row[1])[:args.biggest]
+		print("-------------------------------------------------------")
+		print("\033[32mBiggest dirs\033[0m" + ("" if choice_storage else " (at the last 'hellowork.py -s')") + ":")
+		for dirpath, size in biggest: print("  {:8.2f} GB  {}".format(size/10**9, dirpath))
@@ -4,9 +4,12 @@
 This program finds and opens/executes the file 'modparam.py' for further processing.
 1. Usage: Type "python workparam.py w/x" in command line; w -> edit 'modparam.py'; x -> execute 'modparam.py'.
 2. This program is written specifically for 'twchang'. It cannot be used in other systems or computers.
+3. 'modparam.py' is looked up in the workspace index ('~/.qe_workspace.db'; see modules/workspace.py, updated by 'hellowork.py -c'), and the dirs between the pwd and the one found are checked for a newer 'modparam.py'. Without an index entry, the parent dirs are checked one by one.
 """
-import sys, os, re, argparse
+import sys, os, re, argparse, sqlite3
 import subprocess as sub
+from sys import path; path.insert(0, "../modules") # /home/twchang/bin
+from workspace import Workspace
 
 def get_option():
 	"""This function reads the option from sys.argv[1] (should be w/x) and return the option."""
@@ -20,23 +23,32 @@ def get_option():
 		print("plz choose your option(w/x)"); exit(1)
 	return option
 
-def find_modparam(pwd_recursor):
-	"""This function finds if the file 'modparam.py' in current directory. If not, the function checks its parent directories recursively until the file is found."""
-	find_tag = sub.check_output(f"find {pwd_recursor} -maxdepth 1 -name modparam.py", shell=True).decode("utf-8")
+def find_modparam(pwd_recursor, stop=None):
+	"""This function finds if the file 'modparam.py' in current directory. If not, the function checks its parent directories recursively until the file is found (or the dir stop is reached)."""
+	find_tag = os.path.isfile(os.path.join(pwd_recursor, "modparam.py"))
 	parent_pwd_tag = re.search(r"(.*twchang.*)/.*", pwd_recursor)
 	if find_tag: return pwd_recursor
+	elif pwd_recursor == stop: return False
 	elif parent_pwd_tag:
 		parent_pwd_recursor = parent_pwd_tag.group(1)
-		return find_modparam(parent_pwd_recursor) # go to parent dir and find again
+		return find_modparam(parent_pwd_recursor, stop) # go to parent dir and find again
 	else: return False # /data2/twchang (the 'ancestor' dir) --> dead (cannot find it even in this dir)
 
+def lookup_modparam(pwd):
+	"""Finds the dir of 'modparam.py' from the workspace index, and checks the dirs between pwd and it (a 'modparam.py' may have been added since the index was updated); falls back to find_modparam."""
+	try: indexed = Workspace().modparam(pwd)
+	except (sqlite3.Error, OSError): indexed = None # no index (e.g. read-only home)
+	if indexed and os.path.isfile(indexed):
+		return find_modparam(pwd, os.path.dirname(indexed)) or os.path.dirname(indexed)
+	return find_modparam(pwd)
+
 
 if __name__ == "__main__":
 	## get option(w/x) and pwd
 	option = get_option()
 	pwd = os.getcwd(); pwd_recursor = pwd
 	## find modparam.py from pwd and parents of pwd
-	workingdir = find_modparam(pwd_recursor)
+	workingdir = lookup_modparam(pwd_recursor)
 	if not workingdir:
 		# print(pwd, pwd_recursor)
 		print("Cannot find 'modparam.py' in all parent dirs from the pwd. Exiting..."); exit(1)
@@ -9,6 +9,7 @@ Usage:
 import os
 from sys import path; path.insert(0, "../modules") # ~/bin
 from parse import Parser
+from profiling import span
 
 ## parameters ######################################################
 atoms = "H3S"
@@ -131,25 +132,27 @@ def format_title(P):
 if __name__ == '__main__':
 	pwd = os.getcwd(); ls = os.listdir(".")
 
-	P = Parser()
+	with span("parse"):
+		P = Parser()
+		## grep values in original files
+		ntyp_old = int(P.find_ctrl("ntyp", one=True))
+		nat_old = int(P.find_ctrl("nat", one=True))
 	print(P)
-	## grep values in original files
-	ntyp_old = int(P.find_ctrl("ntyp", one=True))
-	nat_old = int(P.find_ctrl("nat", one=True))
 	## define new param
 	ntyp = param_dict["ntyp"]
 	kpoint_dict = param_dict["KPOINTS"]
 	## format parameters with param_dict
-	for param in param_dict:
-		P.add_ctrl(param, str(param_dict[param]))
-	format_crystal(P)
-	format_amass(P, ntyp_old, ntyp)
-	format_pot(P, ntyp_old)
-	format_atompos(P, nat_old)
-	format_dos(P, pwd)
-	format_occupation(P, ls)
-	format_scf(P, kpoint_dict, ls)
-	format_atoms(P)
-	format_title(P)
+	with span("transform"):
+		for param in param_dict:
+			P.add_ctrl(param, str(param_dict[param]))
+		format_crystal(P)
+		format_amass(P, ntyp_old, ntyp)
+		format_pot(P, ntyp_old)
+		format_atompos(P, nat_old)
+		format_dos(P, pwd)
+		format_occupation(P, ls)
+		format_scf(P, kpoint_dict, ls)
+		format_atoms(P)
+		format_title(P)
 	## constructs new files with new params
-	P.reconstruct_files() # test=True  to test_file
+	with span("write"): P.reconstruct_files() # test=True  to test_file
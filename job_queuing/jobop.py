@@ -4,11 +4,18 @@
 This program determines the CPU 'cores' and 'nodes' of job submission file 'job.sh-*'. It searches the job files and sorts them in the specific order. After that, it asks the user to enter 'nodes', 'cores', and 'batch name' for this series of jobs.
 1. This program is written specifically for linux evnironments and the jobscript files with patterns similar to `./sample files/job.sh`. Please make sure your system supports the same job scripting.
 2. Usage: Enter the parameters of jobs by the instructions.
+3. Bulk mode: 'jobop.py -c policy.json' reconfigures every job script under a root directory without asking, e.g. after a cluster change. Add '-d' to only print the diffs. policy.json:
+	{"root": "/data2/twchang/qe", "nodes": [5, 6], "ppn": {"default": 16, "job.sh-dos": 1}, "cores_per_node": 16, "batch_name": "{atoms}-{dir}", "qe_switch": true, "atoms": null}
+	root: searched recursively for job.sh, job.sh-*; nodes: No. of nodes (like the interactive input); ppn: cores of each job, allocated into the nodes in order;
+	cores_per_node: optional, cores of each node ('np' of 'pbsnodes -a' if not given); batch_name: {old}: current batch name, {atoms}, {dir}: name of the directory, {parent}: name of its parent;
+	atoms: null to keep the atoms in the scripts, or a name like batch_name.
 """
 ### authors : Jake, Tim
-import os, re
+import os, re, json, argparse
 import subprocess as sub
-from pprint import pprint
+from functools import lru_cache
+from sys import path; path.insert(0, "../modules") # /home/twchang/bin
+from pbsnodes import parse
 
 class Job:
 	## the pattern of each job script
@@ -36,10 +43,20 @@ cd $PBS_O_WORKDIR
 # Use mpirun to run MPI program.
 /opt/openmpi-1.4.4/bin/mpirun -machinefile $PBS_NODEFILE'''
 
+	## job_head with placeholders for the batch name and the nodes; compiled once
+	head_template = re.sub(r"(#PBS\s+-l\s+nodes=).*", r"\g<1>{node_str}", re.sub(r"(#PBS\s+-N\s+).*", r"\g<1>{batch_name}", job_head.replace("{", "{{").replace("}", "}}")))
+
 	def __init__(self, jobname: str, order: int, runtime: int):
 		self.jobname = jobname
 		self.order = order
 		self.runtime = runtime
+
+	@staticmethod
+	@lru_cache(maxsize=None)
+	def render_head(batch_name: str, node_str: str):
+		"""Returns job_head with the batch name and the '#PBS -l nodes=' string; rendered once for each pair."""
+		return Job.head_template.format(batch_name=batch_name, node_str=node_str)
+
 job_dict = {
 	"job.sh-scf"        : Job("job.sh-scf"       , 10, 10),
 	"job.sh-scffit"     : Job("job.sh-scffit"    ,  9, 60),
@@ -58,22 +75,10 @@ job_dict = {
 }
 
 def preprocess(nodes_info_str):
-	"""Creates the nodesdict from nodes_info_str.
+	"""Creates the nodesdict from nodes_info_str (see pbsnodes.Node.to_dict).
 	nodes_info_str: the outcome string of 'pbsnodes -a'.
 	"""
-	nodeslist = re.findall(r"node\d+.*\n(?:     \w+\s*=\s*.*\n)*", nodes_info_str)
-	nodesdict = {}
-	for node in nodeslist:
-		name = re.match(r"(node\d+).*", node).group(1)
-		total = int(re.search(r"np = (\d+)", node).group(1))
-		search = re.search(r"     jobs = (.*)", node)
-		if not search: remain = total; users = set()
-		else: 
-			remain = total - (search.group(1).count(",") + 1)
-			users = set(re.findall(r"\d+/(\d+).*?[,$]", search.group(0)))
-		if re.search(r"state\s*=\s*down", node): remain = "--"
-		nodesdict[name] = {"total": total, "remain": remain, "users": users}
-	return nodesdict
+	return {name: node.to_dict() for name, node in parse(nodes_info_str).items()}
 
 def print_nodes(nodesdict):
 	"""Finds and prints the remaining cores of each node from nodesdict."""
@@ -140,26 +145,29 @@ def get_ppn(nodesdict, node_choice):
 		except ValueError:
 			print("Please enter a number!", end= " ")
 			continue
-		## allocate ppn into chosen nodes
-		ppn_list = []
-		ppn_left = ppn
-		valid = True
-		for i in range(len(node_choice)):
-			ppn_available = nodesdict["node{:02d}".format(node_choice[i])]["remain"]
-			if i == len(node_choice)-1:
-				if ppn_left <= 0:
-					break
-				if not ppn_left <= ppn_available:
-					print("Assigned cores > remaining cores, gelingbo :)")
-					valid = False; break
-				ppn_list.append(ppn_left)
+		ppn_list = allocate_ppn(nodesdict, node_choice, ppn)
+		if ppn_list: return ppn_list
+		print("Assigned cores > remaining cores, gelingbo :)")
+
+def allocate_ppn(nodesdict, node_choice, ppn, key="remain"):
+	"""Allocates ppn into the chosen nodes in order (each node up to its nodesdict[node][key] cores) and returns the assigned cores as ppn_list. Returns False if ppn exceeds the cores of the nodes."""
+	ppn_list = []
+	ppn_left = ppn
+	for i in range(len(node_choice)):
+		ppn_available = nodesdict["node{:02d}".format(node_choice[i])][key]
+		if i == len(node_choice)-1:
+			if ppn_left <= 0:
+				break
+			if not ppn_left <= ppn_available:
+				return False
+			ppn_list.append(ppn_left)
+		else:
+			if ppn_left <= ppn_available:
+				ppn_list.append(ppn_left); break
 			else:
-				if ppn_left <= ppn_available:
-					ppn_list.append(ppn_left); break
-				else:
-					ppn_list.append(ppn_available)
-					ppn_left -= ppn_available
-		if valid: return ppn_list
+				ppn_list.append(ppn_available)
+				ppn_left -= ppn_available
+	return ppn_list
 
 def get_qe_atoms(pwd, qe_switch: bool):
 	"""This function reads qe_switch and finds suitable atom_name, returning it as 'atoms'."""
@@ -187,6 +195,18 @@ def get_batch_name(joblist):
 	batch_name = batch_name_input if batch_name_input != "" else batch_name
 	return batch_name
 
+def render_job(file, batch_name, node_str, qe_switch, atoms):
+	"""Returns the new content of a job-script (file: str, its old content) with the rendered Job.job_head; please refer to modify_job() for the parameters."""
+	tail = re.search(r".*(\s*-np.*)", file, re.S).group(1).strip()
+	tail = re.sub(r"\s*>>\s*out", r"", tail)
+	if qe_switch:
+		tail = re.sub(r"(NPROCS\s*).*(/bin/)", r"\g<1>/data2/twchang/opt/q-e-qe-6.4.1\g<2>", tail, re.S)
+	else: # vasp mode
+		tail = re.sub(r"(NPROCS\s*).*(/bin/).*(\n)", r"\g<1>/home/twchang\g<2>vasp_noncol \g<3>", tail, re.S)
+	tail = re.sub(r"(-np\s+\$NPROCS\s+.*\s+<).*?(\..*>\s+).*?(\..*)", r"\g<1>{}\g<2>{}\g<3>".format(atoms, atoms), tail) if atoms else tail
+	tail = re.sub(r"/data2/twchang/q-e-qe-6\.1\.0/bin", r"/data2/twchang/opt/q-e-qe-6.4.1/bin", tail)# if qe_switch else file
+	return Job.render_head(batch_name, node_str) + " " + tail
+
 def modify_job(filename, batch_name, node_choice, ppn_list, qe_switch, atoms):
 	"""Modifies each job for all the parameters entered by the user.
 	Parameters
@@ -199,24 +219,74 @@ def modify_job(filename, batch_name, node_choice, ppn_list, qe_switch, atoms):
 	atoms: str, along with qe_switch (True); the program modifies the jobs regarding qe with this parameter.
 	"""
 	fin = open(filename, "r"); file = fin.read(); fin.close()
-	# fin_head = open("/home/twchang/bin/others/job.sh-mod", 'r').read()
-	fin_head = Job.job_head
 	node_str = "+".join(["node{:02d}:ppn={}".format(node_choice[i], ppn_list[i]) for i in range(len(ppn_list))])
-	tail = re.search(r".*(\s*-np.*)", file, re.S).group(1).strip()
-	tail = re.sub(r"\s*>>\s*out", r"", tail)
-	if qe_switch:
-		tail = re.sub(r"(NPROCS\s*).*(/bin/)", r"\g<1>/data2/twchang/opt/q-e-qe-6.4.1\g<2>", tail, re.S)
-	else: # vasp mode
-		tail = re.sub(r"(NPROCS\s*).*(/bin/).*(\n)", r"\g<1>/home/twchang\g<2>vasp_noncol \g<3>", tail, re.S)
-	file = fin_head + " " + tail
-	file = re.sub(r"(#PBS\s+-N\s+).*", r"\g<1>{}".format(batch_name), file) # if batch_name != "" else file # modify batch_name
-	file = re.sub(r"(#PBS\s+-l\s+nodes=).*", r"\g<1>{}".format(node_str), file) # modify ppn
-	file = re.sub(r"(-np\s+\$NPROCS\s+.*\s+<).*?(\..*>\s+).*?(\..*)", r"\g<1>{}\g<2>{}\g<3>".format(atoms, atoms), file) if atoms else file
-	file = re.sub(r"/data2/twchang/q-e-qe-6\.1\.0/bin", r"/data2/twchang/opt/q-e-qe-6.4.1/bin", file)# if qe_switch else file
+	file = render_job(file, batch_name, node_str, qe_switch, atoms)
 	fout = open(filename, "w"); fout.write(file)
 
+def find_job_scripts(root):
+	"""Finds all the job-scripts (job.sh, job.sh-*) under root; returns {directory: [job-scripts sorted by Job.order]}."""
+	dirdict = {}
+	for dirpath, dirnames, filenames in os.walk(root):
+		dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+		jobs = [f for f in filenames if f in job_dict or f.startswith("job.sh-")]
+		if jobs: dirdict[dirpath] = sorted(jobs, key=lambda s: job_dict[s].order if s in job_dict else 100)
+	return dirdict
+
+def _format_rule(rule, directory, old, atoms):
+	return rule.format(old=old, atoms=atoms or "", dir=os.path.basename(os.path.abspath(directory)), parent=os.path.basename(os.path.dirname(os.path.abspath(directory))))
+
+def reconfigure_dir(directory, jobs, policy, nodesdict, dry_run):
+	"""Applies the policy to the job-scripts of a directory. Returns the list of (filename, diff) of changed scripts; the scripts are written unless dry_run."""
+	import difflib
+	changes = []
+	for job in jobs:
+		filename = os.path.join(directory, job)
+		fin = open(filename, "r"); file = fin.read(); fin.close()
+		if not re.search(r"-np", file): continue
+		old = re.search(r"#PBS\s+-N\s+(.*)", file); old = old.group(1).strip() if old else ""
+		atoms_old = re.search(r"-np\s+\$NPROCS\s+.*\s+<(.*?)\..*>", file); atoms_old = atoms_old.group(1) if atoms_old else ""
+		atoms = _format_rule(policy["atoms"], directory, old, atoms_old) if policy.get("atoms") else False
+		batch_name = _format_rule(policy.get("batch_name", "{old}"), directory, old, atoms or atoms_old)
+		ppn = policy["ppn"].get(job, policy["ppn"].get("default", 16))
+		ppn_list = allocate_ppn(nodesdict, policy["nodes"], ppn, key="total")
+		if not ppn_list: raise ValueError(f"{filename}: ppn={ppn} exceeds the cores of nodes {policy['nodes']}")
+		node_str = "+".join(["node{:02d}:ppn={}".format(policy["nodes"][i], ppn_list[i]) for i in range(len(ppn_list))])
+		new = render_job(file, batch_name, node_str, policy.get("qe_switch", True), atoms)
+		if new == file: continue
+		changes.append((filename, "".join(difflib.unified_diff(file.splitlines(True), new.splitlines(True), filename, filename + " (new)"))))
+		if not dry_run:
+			tempname = filename + ".jobop"; fout = open(tempname, "w"); fout.write(new); fout.close()
+			os.replace(tempname, filename)
+	return changes
+
+def bulk_reconfigure(policy, dry_run=False, workers=None):
+	"""Reconfigures every job-script under policy["root"] in parallel (one directory per task); prints the diffs (dry_run) or the changed files."""
+	if "cores_per_node" in policy:
+		nodesdict = {"node{:02d}".format(n): {"total": policy["cores_per_node"]} for n in policy["nodes"]}
+	else:
+		nodesdict = preprocess(sub.check_output("pbsnodes -a", shell=True).decode("utf-8"))
+	from concurrent.futures import ProcessPoolExecutor
+	dirdict = find_job_scripts(policy["root"])
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		results = pool.map(reconfigure_dir, list(dirdict), list(dirdict.values()), [policy]*len(dirdict), [nodesdict]*len(dirdict), [dry_run]*len(dirdict))
+		count = 0
+		for changes in results:
+			for filename, diff in changes:
+				print(diff if dry_run else f"modified: {filename}", end="" if dry_run else "\n"); count += 1
+	print("{} job-scripts in {} directories {}.".format(count, len(dirdict), "would be modified" if dry_run else "modified"))
+
 ### main function
 if __name__ == "__main__":
+	agps = argparse.ArgumentParser(description='jobop options')
+	agps.add_argument('-c', '--config', type=str, help='policy file (json) for the non-interactive bulk mode')
+	agps.add_argument('-r', '--root', type=str, help='root directory of the bulk mode (overrides "root" in the policy)')
+	agps.add_argument('-d', '--dry-run', action='store_true', help='only print the diffs in the bulk mode')
+	agps.add_argument('-j', '--jobs', type=int, default=None, help='number of parallel workers in the bulk mode')
+	args = agps.parse_args()
+	if args.config:
+		fin = open(args.config, "r"); policy = json.load(fin); fin.close()
+		if args.root: policy["root"] = args.root
+		bulk_reconfigure(policy, args.dry_run, args.jobs); exit(0)
 ## get job_node information
 	nodes_info_str = sub.check_output("pbsnodes -a", shell=True).decode("utf-8")
 	nodesdict = preprocess(nodes_info_str)
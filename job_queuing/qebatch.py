@@ -4,63 +4,252 @@
 This program automatically submits jobs in order and checks for error messages routinely.
 1. This program is written specifically for linux evnironments and the jobscript files with patterns similar to `./sample files/job.sh-*`. Please make sure your system supports the same job scripting.
 2. Usage: just type 'qebatch.py' and wait for results; if you type 'qebatch.py -t', a small window will pop up once the job batch is done and show "SUCCESS" OR "FAIL".
+3. Jobs are run by their dependencies (Job_info.parents), so independent branches (e.g. 'bands', 'nscf -> dos/pdos', 'ph -> q2r -> matdyn') run at the same time. 1-core jobs which become ready at the same time (e.g. 'dos' and 'pdos') are submitted as one job. Type 'qebatch.py -s' to run them strictly in order instead.
+	Stages which write the same err file ('#PBS -e'), or use the same outdir and prefix while one of them is pw.x (which rewrites 'prefix.save'), are run one after the other in the order of job_dict. To run the branches at the same time, give each jobscript its own err file (e.g. '#PBS -e err.bands') and 'nscf'/'bands' their own outdir.
+4. Every state change of the jobs is written in '.qebatch.db'. If qebatch.py is stopped and started again, the finished jobs are skipped and the running jobs are reattached; type 'qebatch.py -n' to start over.
+5. At the end, the queue wait, run time, poll overhead and submission gap of each stage are printed and written into 'qebatch_metrics.json'; 'qebatch.py -p file.prom' also writes them for Prometheus.
+6. Stages whose outputs are up to date are skipped: the output has 'JOB DONE.', the files it writes (e.g. '*.save' of pw.x, dynamical matrices of ph.x, '*.fc' of q2r.x, '*.freq' of matdyn.x) exist, and all of them are newer than its input and the outputs of its parents. The batch starts from the first stale stage; type 'qebatch.py -a' to run all the stages.
+7. Campaign: 'qebatch.py -c H3S/150GPa H3S/200GPa LaH10/* --max-cores 128 --max-jobs 10' runs the jobs of many directories at once, at most 128 cores and 10 jobs at a time and never more than the free cores of the cluster, sharing the cores fairly between the directories. The progress of each directory is printed in one table. Each directory keeps its own '.qebatch.db'.
+8. 'qebatch.py -w /data2/twchang/qe/H3S' adds to the campaign every calculation directory under the given dir which is not done or running, according to the workspace index ('~/.qe_workspace.db'; see modules/workspace.py), which is updated first.
+9. 'qebatch.py --check' runs a small pipeline twice on a simulated cluster (modules/backend.py) and checks that the rerun finds every stage up to date.
 """
 import subprocess as sub
 import os, re, datetime, argparse
-from time import sleep
 from sys import path; path.insert(0, "../modules") # /home/twchang/bin
-from multibatch import Job, Batch
+from profiling import span # before the imports of sleep and system, so that PYF_PROFILE records them
+from time import sleep
+from multibatch import Job, Batch, DagBatch, Campaign
+from backend import read_err_file
+from journal import Journal
+from metrics import metrics
+from workspace import Workspace, archived, job_done
 
 class Job_info:
-	def __init__(self, jobname: str, order: int, runtime: int, cores: int):
+	def __init__(self, jobname: str, order: int, runtime: int, cores: int, parents: tuple=()):
 		self.jobname = jobname
 		self.order = order
 		self.runtime = runtime
 		self.cores = cores
+		self.parents = parents ## default dependencies of the job
 
-job_dict = {                       #jobname           #ord #time #core
-	"job.sh-scf"        : Job_info("job.sh-scf"       , 10,  10,  16),
+job_dict = {                       #jobname           #ord #time #core #parents
+	"job.sh-scf"        : Job_info("job.sh-scf"       , 10,  10,  16, ("job.sh-scffit",)),
 	"job.sh-scffit"     : Job_info("job.sh-scffit"    ,  9,  60,  16),
-	"job.sh-nscf"       : Job_info("job.sh-nscf"      , 12,  16,  16),
-	"job.sh-ph"         : Job_info("job.sh-ph"        , 14, 900,  16),
-	"job.sh-elph"       : Job_info("job.sh-elph"      , 16, 900,  16),
-	"job.sh-q2r"        : Job_info("job.sh-q2r"       , 18,   6,  16),
-	"job.sh-matdyn"     : Job_info("job.sh-matdyn"    , 22,   8,  16),
-	"job.sh-matdyn.dos" : Job_info("job.sh-matdyn.dos", 24,   8,  16),
-	"job.sh-bands"      : Job_info("job.sh-bands"     , 32,  10,  16),
-	"job.sh-dos"        : Job_info("job.sh-dos"       , 34,   4,   1),
-	"job.sh-pdos"       : Job_info("job.sh-pdos"      , 36,   4,   1),
-	"job.sh-lambda"     : Job_info("job.sh-lambda"    , 50,   4,   1),
-	"job.sh-plot"       : Job_info("job.sh-plot"      , 60,   2,   1),
+	"job.sh-nscf"       : Job_info("job.sh-nscf"      , 12,  16,  16, ("job.sh-scf",)),
+	"job.sh-ph"         : Job_info("job.sh-ph"        , 14, 900,  16, ("job.sh-scf",)),
+	"job.sh-elph"       : Job_info("job.sh-elph"      , 16, 900,  16, ("job.sh-ph",)),
+	"job.sh-q2r"        : Job_info("job.sh-q2r"       , 18,   6,  16, ("job.sh-ph", "job.sh-elph")),
+	"job.sh-matdyn"     : Job_info("job.sh-matdyn"    , 22,   8,  16, ("job.sh-q2r",)),
+	"job.sh-matdyn.dos" : Job_info("job.sh-matdyn.dos", 24,   8,  16, ("job.sh-q2r",)),
+	"job.sh-bands"      : Job_info("job.sh-bands"     , 32,  10,  16, ("job.sh-scf",)),
+	"job.sh-dos"        : Job_info("job.sh-dos"       , 34,   4,   1, ("job.sh-nscf",)),
+	"job.sh-pdos"       : Job_info("job.sh-pdos"      , 36,   4,   1, ("job.sh-nscf",)),
+	"job.sh-lambda"     : Job_info("job.sh-lambda"    , 50,   4,   1, ("job.sh-elph", "job.sh-matdyn.dos")),
+	"job.sh-plot"       : Job_info("job.sh-plot"      , 60,   2,   1, ("job.sh-matdyn",)),
 }
 
-def get_joblist():
-	"""Gets jobs from the working directory and sorts them according to Job.order in job_dict."""
-	dirlist = os.listdir(".")
-	joblist = [job for job in dirlist if "job.sh-" in job]
+def get_joblist(workdir="."):
+	"""Gets jobs from workdir and sorts them according to Job.order in job_dict."""
+	dirlist = os.listdir(workdir)
+	joblist = [job for job in dirlist if job.startswith("job.sh-")] # not the sentinels, epilogues and status files ('.job.sh-*') of the last run
 	joblist.sort(key=lambda s: job_dict[s].order) # sort joblist
-	if len(joblist) == 0:
-		print("No 'qe'-jobs in this directory; exiting..."); exit(1)
 	return joblist
+
+def _read(filename):
+	fin = open(filename, "r"); file = fin.read(); fin.close(); return file
+
+def _ctrl(text, key):
+	"""Returns the value of key = 'value' in a QE input, or None."""
+	match = re.search(r"\b{}\s*=\s*'(.*?)'".format(key), text)
+	return match.group(1) if match else None
+
+def get_stage_files(workdir, jobname):
+	"""Returns (program, input, [outputs]) of a stage from the mpirun line of its jobscript ('... pw.x <H3S.scf.in> H3S.scf.out'): the QE output, plus the files the program writes according to its input. Returns (None, None, []) if the line is not found."""
+	match = re.search(r"(\w+\.x)[^<\n]*<\s*(\S+)\s*>\s*(\S+)", _read(os.path.join(workdir, jobname)))
+	if not match: return None, None, []
+	program, infile, outfile = match.groups(); outputs = [outfile]
+	text = _read(os.path.join(workdir, infile)) if os.path.isfile(os.path.join(workdir, infile)) else ""
+	if program == "pw.x" and _ctrl(text, "prefix"):
+		outputs.append(os.path.join(_ctrl(text, "outdir") or ".", _ctrl(text, "prefix") + ".save"))
+	elif program == "ph.x" and _ctrl(text, "fildyn"):
+		outputs.append(_ctrl(text, "fildyn") + ("0" if re.search(r"ldisp\s*=\s*\.true\.", text) else "")) # the list of q-points written at the end
+	elif program == "plotband.x":
+		lines = [line for line in text.split("\n") if line.strip()]
+		outputs.append(lines[2].strip()) if len(lines) > 2 else 0
+	for key in {"q2r.x": ["flfrc"], "matdyn.x": ["flfrq"], "dos.x": ["fildos"], "projwfc.x": ["filpdos"]}.get(program, []):
+		if _ctrl(text, key): outputs.append(_ctrl(text, key))
+	return program, infile, outputs
+
+def get_finished(workdir, joblist, journal=None):
+	"""Returns the stages of joblist whose outputs are up to date. A stage without detectable outputs (no mpirun line, see get_stage_files) is up to date if its parents are and the journal says it is done; the time of that record stands for its outputs. Otherwise a stage is up to date if its QE output has 'JOB DONE.' (plotband.x writes none), all its outputs exist (the QE output may be archived by archive.py, see workspace.archived; the data read by the children, e.g. 'prefix.save', '*.fc', '*.dyn*', must not be, so an archived stage runs again when a child is stale), the oldest of them is newer than its input and the outputs of its parents, and all its parents are up to date."""
+	finished = []; newest = {} # jobname -> mtime of its newest output
+	for jobname in joblist: # joblist is sorted, so the parents come first
+		program, infile, outputs = get_stage_files(workdir, jobname)
+		parents = get_parents(jobname, joblist)
+		if not outputs:
+			record = journal.last(workdir, jobname) if journal else None
+			if record and record["state"] == "done" and all(parent in finished for parent in parents):
+				finished.append(jobname); newest[jobname] = record["time"]
+			continue
+		paths = [os.path.join(workdir, f) for f in outputs]
+		paths = [archived(paths[0])] + [f if os.path.exists(f) else None for f in paths[1:]] # only the log may be archived
+		if not all(paths): continue
+		if program != "plotband.x" and not job_done(paths[0]): continue
+		oldest = min(os.path.getmtime(f) for f in paths)
+		if not all(parent in finished for parent in parents): continue
+		inputs = [os.path.getmtime(os.path.join(workdir, infile))] + [newest[parent] for parent in parents]
+		if oldest < max(inputs): continue
+		finished.append(jobname); newest[jobname] = max(os.path.getmtime(f) for f in paths)
+	return finished
+
+def get_stale(workdir, joblist):
+	"""Returns the stages of joblist (those not up to date) whose outputs are known from their jobscripts: they are run again even if the journal says they are done (see journal.Journal.invalidate). A stage without detectable outputs keeps the "done" of its journal."""
+	return [jobname for jobname in joblist if get_stage_files(workdir, jobname)[2]]
+
+def get_resources(workdir, jobname):
+	"""Returns (err file, outdir/prefix or None, whether the stage rewrites it) of a stage: the '#PBS -e' file of its jobscript, and the outdir and prefix of its QE input; pw.x rewrites 'prefix.save', the other programs only read it."""
+	err = os.path.normpath(os.path.join(workdir, read_err_file(os.path.join(workdir, jobname))))
+	program, infile, outputs = get_stage_files(workdir, jobname)
+	text = _read(os.path.join(workdir, infile)) if infile and os.path.isfile(os.path.join(workdir, infile)) else ""
+	outdir = os.path.join(os.path.normpath(os.path.join(workdir, _ctrl(text, "outdir") or ".")), _ctrl(text, "prefix")) if _ctrl(text, "prefix") else None
+	return err, outdir, program == "pw.x"
+
+def serialize(batchlist):
+	"""Makes the stages which would clash if run at the same time wait for each other in the order of batchlist: the stages writing the same err file, and the stages using the same outdir/prefix when one of them is pw.x. Returns [(job, waits for, reason), ...]."""
+	resources = {job: get_resources(job.workdir, job.jobname) for job in batchlist}
+	def ancestors(job):
+		found = set(); stack = list(job.parents)
+		while stack:
+			parent = stack.pop()
+			if parent not in found: found.add(parent); stack.extend(parent.parents)
+		return found
+	added = []
+	for i, job in enumerate(batchlist):
+		err, outdir, writes = resources[job]
+		for earlier in reversed(batchlist[:i]): # the nearest first, so that a chain is enough
+			if earlier in ancestors(job) or job in ancestors(earlier): continue
+			err_earlier, outdir_earlier, writes_earlier = resources[earlier]
+			if err == err_earlier: reason = f"same err file '{os.path.basename(err)}'"
+			elif outdir and outdir == outdir_earlier and (writes or writes_earlier): reason = f"same outdir '{os.path.relpath(outdir, job.workdir)}'"
+			else: continue
+			job.after(earlier); added.append((job, earlier, reason))
+	return added
+
+def get_dag(workdir, joblist, journal):
+	"""Creates the jobs of workdir with their parents (see get_parents and serialize); truncates their err files unless some jobs are still running from the last run."""
+	batchlist = [Job(jobname, job_dict[jobname].cores, job_dict[jobname].runtime, {}, _empty, _empty, [], workdir=workdir, journal=journal) for jobname in joblist]
+	records = [journal.last(workdir, jobname) for jobname in joblist]
+	if not any(record and record["state"] in ["submitted", "running"] for record in records):
+		for err in dict.fromkeys(job._err() for job in batchlist):
+			fout = open(os.path.join(workdir, err), 'w'); fout.close()
+	jobs = {job.jobname: job for job in batchlist}
+	[job.after(*[jobs[parent] for parent in get_parents(job.jobname, joblist)]) for job in batchlist]
+	for job, earlier, reason in serialize(batchlist):
+		print(f"{workdir}: {job.jobname} waits for {earlier.jobname} ({reason}).")
+	return batchlist
+
+def get_parents(jobname, joblist):
+	"""Returns the parents of jobname in joblist by the rules of job_dict. A parent that is not in joblist is replaced by its own parents, so the chain is kept when some jobs are absent (e.g. 'q2r' still waits for 'scf' without 'ph')."""
+	parents = []
+	for parent in job_dict[jobname].parents:
+		if parent in joblist: parents.append(parent)
+		else: parents.extend(get_parents(parent, joblist))
+	return list(dict.fromkeys(parents))
+
 def _empty():
 	pass
 
+def check():
+	"""Runs a small pipeline (scf -> nscf -> dos) on a simulated cluster (backend.SimBackend) in a temporary directory: the rerun must find every stage up to date, although the first run left its sentinels, epilogues and status files ('.job.sh-*') there; after the input of nscf is touched, nscf and dos must run again although the journal says they are done, while 'plot' (no mpirun line, so no detectable outputs) stays done by the journal. Returns true if all goes as expected."""
+	import tempfile, shutil
+	import multibatch
+	from backend import SimBackend
+	from runtimes import RuntimeHistory
+	workdir = tempfile.mkdtemp(prefix="qebatch-check-")
+	multibatch.history = RuntimeHistory(os.path.join(workdir, "runtimes.json"))
+	backend = SimBackend({"node01": 16}, default_duration=30, queue_delay=1, speedup=1000)
+	for stage, program, cores in [("scf", "pw.x", 16), ("nscf", "pw.x", 16), ("dos", "dos.x", 1)]:
+		fout = open(os.path.join(workdir, f"H3S.{stage}.in"), "w"); fout.write(f"&control\n calculation = '{stage}'\n/\n"); fout.close()
+		fout = open(os.path.join(workdir, f"job.sh-{stage}"), "w")
+		fout.write(f"#!/bin/sh\n#PBS -e err\n#PBS -l nodes=node01:ppn={cores}\ncd $PBS_O_WORKDIR\nmpirun -np $NPROCS {program} <H3S.{stage}.in> H3S.{stage}.out\n"); fout.close()
+	fout = open(os.path.join(workdir, "job.sh-plot"), "w"); fout.write("#!/bin/sh\n#PBS -e err\n#PBS -l nodes=node01:ppn=1\ncd $PBS_O_WORKDIR\nsh plot.sh\n"); fout.close()
+	journal = Journal(os.path.join(workdir, ".qebatch.db")); stages = ["job.sh-scf", "job.sh-nscf", "job.sh-dos", "job.sh-plot"]
+	for run, expected in enumerate([[], stages, [stages[0], stages[3]], stages], 1): # the stages up to date before each run
+		if run == 3: os.utime(os.path.join(workdir, "H3S.nscf.in")) # as if edited
+		joblist = get_joblist(workdir); finished = get_finished(workdir, joblist, journal)
+		print(f"Run {run}: {', '.join(joblist)}; {', '.join(finished) or 'none'} up to date.")
+		passed = finished == expected
+		joblist = [jobname for jobname in joblist if jobname not in finished]
+		if not passed: break
+		if not joblist: continue
+		journal.invalidate(workdir, get_stale(workdir, joblist), "outputs out of date")
+		batchlist = get_dag(workdir, joblist, journal)
+		for job in batchlist: job.backend = backend
+		passed = DagBatch(batchlist, max_workers=len(batchlist), bundle_cores=1).run()
+		if not passed: break
+	backend.close()
+	print("Check passed." if passed else f"Check failed; the files are kept in {workdir}.")
+	if passed: shutil.rmtree(workdir)
+	return passed
+
 if __name__ == "__main__":
 	## argparse param
 	agps = argparse.ArgumentParser(description='tk.py launcher')
 	agps.add_argument('-t', '--tk', action='store_true', help='type -t for tk.py')
+	agps.add_argument('-s', '--serial', action='store_true', help='run the jobs strictly in order')
+	agps.add_argument('-n', '--new', action='store_true', help='ignore the journal of the last run and start over')
+	agps.add_argument('-p', '--prom', type=str, default="", help='also write the metrics in Prometheus text format into this file (e.g. for node_exporter\'s textfile collector)')
+	agps.add_argument('-a', '--all', action='store_true', help='run all the stages, even those whose outputs are up to date')
+	agps.add_argument('-c', '--campaign', nargs='+', default=[], help='run the jobs of all these directories as one campaign')
+	agps.add_argument('-w', '--workspace', nargs='+', default=[], help='campaign: add the unfinished calculation directories under these dirs (from the workspace index)')
+	agps.add_argument('--max-cores', type=int, default=0, help='campaign: at most this many cores at a time (0: no limit)')
+	agps.add_argument('--check', action='store_true', help='run a small pipeline twice on a simulated cluster; the rerun must find it up to date')
+	agps.add_argument('--max-jobs', type=int, default=0, help='campaign: at most this many jobs at a time (0: no limit)')
+	agps.add_argument('--bundle-ppn', type=int, default=16, help='cores of the one-node allocation shared by the 1-core jobs ready together')
 	args = agps.parse_args(); choice = args.tk
-	## get joblist
-	joblist = get_joblist()
-	batchlist = [Job(jobname, job_dict[jobname].cores, job_dict[jobname].runtime, {}, _empty, _empty, []) for jobname in joblist]
-	## initialize err file; get starting time
+	if args.check: exit(0 if check() else 1)
+	if args.workspace:
+		workspace = Workspace()
+		for root in args.workspace:
+			workspace.update(root)
+			args.campaign += [record["path"] for record in workspace.calcs(root) if record["state"] in ["new", "partial", "failed"] and record["path"] not in args.campaign]
+		if not args.campaign: print("No unfinished calculations in the workspace; exiting..."); exit(0)
+	## get joblist of each directory
+	joblists = {}; journals = {}; found = False
+	for workdir in args.campaign or ["."]:
+		if not os.path.isdir(workdir): print(f"{workdir} is not a directory; skipped."); continue
+		with span("parse"):
+			joblists[workdir] = get_joblist(workdir); found = found or bool(joblists[workdir])
+			journals[workdir] = journal = Journal(os.path.join(workdir, ".qebatch.db")) if joblists[workdir] else None
+			if journal and args.new: journal.clear(workdir)
+			finished = [] if args.all else get_finished(workdir, joblists[workdir], journal)
+		if finished:
+			joblists[workdir] = [jobname for jobname in joblists[workdir] if jobname not in finished]
+			print(f"{workdir}: {', '.join(finished)} up to date; skipped" + (f", starting from {joblists[workdir][0]}." if joblists[workdir] else "."))
+		if not joblists[workdir]: print(f"No 'qe'-jobs to run in {workdir}; skipped."); del joblists[workdir]
+	if not joblists:
+		if found: print("All the stages are up to date; type 'qebatch.py -a' to run them again."); exit(0)
+		print("No 'qe'-jobs in this directory; exiting..."); exit(1)
+	## jobs and their journals; err files are initialized (kept if some jobs are still running from the last run)
 	time_start = datetime.datetime.now(); print(f"Batch started at {time_start}")
-	fout = open("err", 'w'); fout.close()
+	batchlist = []
+	for workdir, joblist in joblists.items():
+		journal = journals[workdir]
+		if args.all: journal.invalidate(workdir, joblist, "run again by -a")
+		else: journal.invalidate(workdir, get_stale(workdir, joblist), "outputs out of date") # the outputs decide where they are known
+		with span("parse"): batchlist += get_dag(workdir, joblist, journal)
 	## run batch; get the batch_flag from the B.run() func.
-	B = Batch(batchlist)
-	batch_flag = "FAILED" if not B.run() else "SUCCESS"
+	if args.campaign: B = Campaign(batchlist, max_cores=args.max_cores, max_jobs=args.max_jobs, max_workers=len(batchlist), bundle_cores=1, bundle_max_cores=args.bundle_ppn)
+	elif args.serial: B = Batch(batchlist)
+	else: B = DagBatch(batchlist, max_workers=len(batchlist), bundle_cores=1, bundle_max_cores=args.bundle_ppn) # 1-core jobs ready together (e.g. dos, pdos) share one allocation
+	with span("run"): batch_flag = "FAILED" if not B.run() else "SUCCESS"
 	## run tk.py or not
 	time_end = datetime.datetime.now(); print(f"Batch ended at {time_end}")
 	time_processing = time_end - time_start; print(f"This batch-process lasted for '{time_processing}'")
+	## time breakdown of each stage
+	metrics.print_stages()
+	with span("write"):
+		metrics.write_json("qebatch_metrics.json")
+		if args.prom: metrics.write_prom(args.prom)
 	if choice:
 		sub.run(f"tk.py {batch_flag}", shell=True)
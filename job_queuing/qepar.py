@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+## authors: Tim
+"""
+This program recommends the cores and the pool flags (-nk: k-point pools, -nd: processors of the parallel diagonalization) of the pw.x/ph.x jobs in the working directory, and writes the flags into their jobscripts.
+1. It reads the k-points, cutoffs and cell of the QE inputs (by parse.Parser); the number of k-points, FFT grid, bands and wall time of past outputs (if any) replace the estimates, and the runtime history of multibatch is used when there is no past output.
+2. Usage: 'qepar.py' prints the advice for every job.sh-* running pw.x or ph.x; 'qepar.py -w' also writes -nk/-nd into the jobscripts (for the cores already in their '#PBS -l nodes=' lines). 'qepar.py -n 16 -m 4 job.sh-scf' for 16 cores per node and up to 4 nodes.
+3. Model: k-point pools scale almost ideally but each pool handles ceil(nks/npool) k-points; inside a pool, the plane-wave (R & G) parallelization stops scaling when the processors exceed the FFT planes (nr3), and pays a communication cost growing with log2(processors); a small serial part (I/O, symmetrization) does not scale at all.
+"""
+import os, re, math, argparse
+from sys import path; path.insert(0, "../modules") # /home/twchang/bin
+from parse import Parser
+from backend import read_nodes_line
+from runtimes import RuntimeHistory
+
+pool_programs = ("pw.x", "ph.x")
+comm_cost = 0.1 ## R & G communication per log2(processors) of a pool, relative to the work of one k-point
+serial_cost = 0.005 ## unparallelized work (I/O, symmetrization, ...) per k-point, relative to the work of one k-point
+sym_ops = {1: 48, 2: 48, 3: 48, 4: 24, 5: 12, -5: 12, 6: 16, 7: 16, 8: 8, 9: 4, -9: 4, 10: 8, 11: 8, 12: 4, -12: 4, 13: 4, 14: 2} ## point group order of each ibrav (upper bound)
+
+def parse_wall(text):
+	"""Returns the seconds of a QE time string like '1h23m', '2m17.12s' or '45.3s'."""
+	seconds = 0.0
+	for value, unit in re.findall(r"([\d.]+)\s*([hms])", text):
+		seconds += float(value) * {"h": 3600, "m": 60, "s": 1}[unit]
+	return seconds
+
+def read_output(filename):
+	"""Reads the past QE output filename; returns {"nks", "fft", "nbnd", "np", "npool", "wall"} (only the keys found)."""
+	info = {}
+	if not os.path.isfile(filename): return info
+	fin = open(filename, "r"); file = fin.read(); fin.close()
+	for key, pattern in [("nks", r"number of k points=\s*(\d+)"), ("nbnd", r"number of Kohn-Sham states=\s*(\d+)"), ("np", r"Number of MPI processes:\s*(\d+)"), ("npool", r"K-points division:\s*npool\s*=\s*(\d+)")]:
+		match = re.search(pattern, file)
+		if match: info[key] = int(match.group(1))
+	match = re.search(r"Dense\s+grid:.*FFT dimensions:\s*\(\s*(\d+),\s*(\d+),\s*(\d+)\)", file) or re.search(r"FFT dimensions:\s*\(\s*(\d+),\s*(\d+),\s*(\d+)\)", file)
+	if match: info["fft"] = tuple(int(n) for n in match.groups())
+	match = re.search(r"(?:PWSCF|PHONON)\s*:.*?CPU\s+(.*?)\s*WALL", file)
+	if match and "JOB DONE." in file: info["wall"] = parse_wall(match.group(1))
+	if "np" in info: info.setdefault("npool", 1)
+	return info
+
+def good_fft(n):
+	"""Returns the smallest n' >= n with only the factors 2, 3, 5 (the FFT dimensions chosen by QE)."""
+	while True:
+		m = n
+		for p in (2, 3, 5):
+			while m % p == 0: m //= p
+		if m == 1: return n
+		n += 1
+
+class Calculation:
+	"""The parameters of a pw.x/ph.x job which decide its parallelization, from its input (and the scf input for ph.x) and past output."""
+	def __init__(self, P: Parser, program: str, infile: str, outfile: str):
+		self.program = program
+		self.infile = infile
+		self.outfile = outfile
+		self.source = {} ## where each parameter comes from: "output" or "estimate"
+		scf = infile if program == "pw.x" else self._scf_input(P)
+		past = read_output(outfile)
+		if program == "ph.x" and "nks" not in past and scf: # ph.x has at least the k-points of scf, usually twice (k and k+q)
+			past_scf = read_output(re.sub(r"\.in$", ".out", scf))
+			for key in ("nks", "fft", "nbnd"):
+				if key in past_scf: past[key] = past_scf[key] * (2 if key == "nks" else 1); self.source[key] = "scf output"
+		self.past = past
+		self.nks = self._get("nks", lambda: self._estimate_nks(P, scf) * (2 if program == "ph.x" else 1))
+		self.fft = self._get("fft", lambda: self._estimate_fft(P, scf))
+		self.nbnd = self._get("nbnd", lambda: self._estimate_nbnd(P, scf))
+
+	def _get(self, key, estimate):
+		if key in self.past: self.source.setdefault(key, "output"); return self.past[key]
+		self.source[key] = "estimate"; return estimate()
+
+	def _scf_input(self, P):
+		"""Returns the pw.x input with calculation='scf' (the ground state of ph.x), or None."""
+		for file in sorted(P.fdict):
+			if re.search(r"calculation\s*=\s*'scf'", P.fdict[file]): return file
+		return None
+
+	def _estimate_nks(self, P, file):
+		"""Estimates the irreducible k-points: the listed ones, or the automatic grid divided by the symmetry operations of ibrav."""
+		if not file: return 1
+		text = P.fdict[file]
+		auto = re.search(r"K_POINTS\s*\{?\(?\s*automatic.*\n\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d)\s+(\d)\s+(\d)", text, re.I)
+		if auto:
+			nk = [int(n) for n in auto.groups()]
+			ibrav = int(P.find_ctrl_l(file, "ibrav", one=True) or 0)
+			return max(1, math.ceil(nk[0]*nk[1]*nk[2] / sym_ops.get(ibrav, 2)))
+		listed = re.search(r"K_POINTS.*\n\s*(\d+)", text)
+		return int(listed.group(1)) if listed else 1
+
+	def _estimate_fft(self, P, file):
+		"""Estimates the dense FFT grid: n_i ~ sqrt(ecutrho) |a_i| / pi (a_i in bohr)."""
+		if not file: return (1, 1, 1)
+		ecutwfc = float((P.find_ctrl_l(file, "ecutwfc", one=True) or "30").replace("d", "e"))
+		ecutrho = float((P.find_ctrl_l(file, "ecutrho", one=True) or str(4*ecutwfc)).replace("d", "e"))
+		A = P.find_ctrl_l(file, r"\bA", one=True); celldm = P.find_ctrl_l(file, r"celldm\(1\)", one=True)
+		alat = float(A) / 0.529177 if A else float(celldm.replace("d", "e")) if celldm else 10.0
+		ibrav = int(P.find_ctrl_l(file, "ibrav", one=True) or 0)
+		scale = {2: math.sqrt(2)/2, 3: math.sqrt(3)/2, -3: math.sqrt(3)/2}.get(ibrav, 1.0) # fcc, bcc primitive vectors
+		return tuple([good_fft(math.ceil(math.sqrt(ecutrho) * alat * scale / math.pi))] * 3)
+
+	def _estimate_nbnd(self, P, file):
+		"""Estimates the bands: 'nbnd' of the input, or 20% more than 4 electrons per atom fill."""
+		if not file: return 8
+		nbnd = P.find_ctrl_l(file, "nbnd", one=True)
+		if nbnd: return int(nbnd)
+		nat = int(P.find_ctrl_l(file, "nat", one=True) or 1)
+		return max(8, math.ceil(1.2 * 2 * nat))
+
+	def model(self, np, npool):
+		"""Relative wall time with np processors in npool pools (1 for a k-point on one processor)."""
+		p = np // npool
+		return math.ceil(self.nks / npool) * (1 + comm_cost * math.log2(p)) / min(p, self.fft[2]) + serial_cost * self.nks
+
+	def best_pool(self, np):
+		"""Returns the npool (a divisor of np, at most nks) with the shortest modeled time; the larger one if tied."""
+		pools = [n for n in range(1, np+1) if np % n == 0 and n <= self.nks]
+		return min(pools, key=lambda n: (round(self.model(np, n), 12), -n))
+
+	def ndiag(self, np, npool):
+		"""Serial diagonalization (-nd 1) for small problems; otherwise the largest square grid in a pool."""
+		p = np // npool
+		return 1 if self.nbnd < 100 or p < 4 else int(math.sqrt(p))**2
+
+	def scale(self, history_seconds=None, history_np=None, history_npool=1):
+		"""Returns the seconds per unit of model(), from the past output or else the runtime history; None if neither exists."""
+		if "wall" in self.past and "np" in self.past:
+			return self.past["wall"] / self.model(self.past["np"], self.past["npool"])
+		if history_seconds and history_np:
+			return history_seconds / self.model(history_np, min(history_npool, history_np))
+		return None
+
+def read_flags(line):
+	"""Returns the npool of the flags '-nk'/'-npool' in a jobscript (1 if none)."""
+	match = re.search(r"\s-(?:nk|npool|nks|npools)\s+(\d+)", line)
+	return int(match.group(1)) if match else 1
+
+def write_flags(filename, program, npool, ndiag):
+	"""Replaces the -nk/-nd flags of program in the jobscript filename."""
+	fin = open(filename, "r"); file = fin.read(); fin.close()
+	def replace(match):
+		args = re.sub(r"\s+-(?:nk|npool|nks|npools|nd|ndiag|northo)\s+\d+", "", match.group(2))
+		return f"{match.group(1)} -nk {npool} -nd {ndiag}{args.rstrip()} " # keep a space before '<' ('1<' would redirect stdout)
+	file = re.sub(r"(\S*/{}|\b{})([^<\n]*)".format(re.escape(program), re.escape(program)), replace, file, count=1)
+	fout = open(filename, "w"); fout.write(file); fout.close()
+
+def find_jobs(jobnames):
+	"""Returns [(jobname, program, input, output)] of the jobscripts running pw.x/ph.x."""
+	jobs = []
+	for jobname in jobnames:
+		fin = open(jobname, "r"); file = fin.read(); fin.close()
+		match = re.search(r"/?(\w+\.x)([^<\n]*)<\s*(\S+)\s*>\s*(\S+)", file)
+		if match and match.group(1) in pool_programs: jobs.append((jobname, match.group(1), match.group(3), match.group(4)))
+	return jobs
+
+def advise(calc, cores_per_node, max_nodes, history_seconds=None, history_np=None, history_npool=1):
+	"""Returns the rows [(np, nodes, npool, ndiag, seconds or relative time, core-hours or relative, efficiency)] for np = half a node, 1, 2, .. max_nodes nodes."""
+	unit = calc.scale(history_seconds, history_np, history_npool)
+	rows = []
+	for np in sorted(set([max(1, cores_per_node // 2)] + [cores_per_node * n for n in range(1, max_nodes+1)])):
+		npool = calc.best_pool(np); t = calc.model(np, npool) * (unit or 1)
+		rows.append([np, math.ceil(np / cores_per_node), npool, calc.ndiag(np, npool), t, t * np / (3600 if unit else 1)])
+	cheapest = min(row[5] for row in rows)
+	for row in rows: row.append(cheapest / row[5])
+	return rows, unit is not None
+
+def recommend(rows, min_efficiency=0.7):
+	"""The fastest row whose core-hours are within 1/min_efficiency of the cheapest one."""
+	return min([row for row in rows if row[6] >= min_efficiency], key=lambda row: (row[4], row[0]))
+
+### main function
+if __name__ == "__main__":
+	agps = argparse.ArgumentParser(description='recommends cores and -nk/-nd flags of pw.x/ph.x jobs')
+	agps.add_argument('jobs', nargs='*', help='jobscripts (default: job.sh-* in the working directory)')
+	agps.add_argument('-n', '--cores-per-node', type=int, default=16)
+	agps.add_argument('-m', '--max-nodes', type=int, default=4)
+	agps.add_argument('-e', '--efficiency', type=float, default=0.7, help='lowest parallel efficiency of the recommendation')
+	agps.add_argument('-w', '--write', action='store_true', help='write -nk/-nd into the jobscripts for their current cores')
+	args = agps.parse_args()
+	jobnames = args.jobs or sorted(f for f in os.listdir(".") if f.startswith("job.sh"))
+	P = Parser(); history = RuntimeHistory()
+	for jobname, program, infile, outfile in find_jobs(jobnames):
+		calc = Calculation(P, program, infile, outfile)
+		material = outfile.split(".")[0]; jobtype = re.sub(r"^job\.sh-?", "", jobname) or "job"
+		fin = open(jobname, "r"); current_npool = read_flags(fin.read()); fin.close()
+		cores = sum(c for _, c in read_nodes_line(jobname)) or args.cores_per_node
+		history_seconds = history.predict(jobtype, material, cores)
+		rows, timed = advise(calc, args.cores_per_node, args.max_nodes, history_seconds, cores, current_npool)
+		print(f"{jobname} ({program} <{infile}): k-points {calc.nks} ({calc.source['nks']}), FFT {'x'.join(map(str, calc.fft))} ({calc.source['fft']}), bands {calc.nbnd} ({calc.source['nbnd']})")
+		print("{:>7}{:>7}{:>5}{:>5}{:>12}{:>12}{:>6}".format("cores", "nodes", "-nk", "-nd", "time (s)" if timed else "time (rel)", "core-h" if timed else "cost (rel)", "eff"))
+		for row in rows:
+			print("{:>7}{:>7}{:>5}{:>5}{:>12.4g}{:>12.4g}{:>6.2f}".format(*row))
+		best = recommend(rows, args.efficiency)
+		print(f"recommended: {best[0]} cores ({best[1]} node(s) x {min(best[0], args.cores_per_node)}), -nk {best[2]} -nd {best[3]}")
+		npool = calc.best_pool(cores); ndiag = calc.ndiag(cores, npool)
+		if args.write:
+			write_flags(jobname, program, npool, ndiag)
+		print(f"{jobname} has {cores} cores: -nk {npool} -nd {ndiag}" + (" (written)" if args.write else "") + ("; run jobop.py to change the cores" if cores != best[0] else ""))
+		print()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module contains the scheduler backends used by multibatch. A backend submits jobscripts, reports the status of jobs and nodes, deletes jobs, and keeps the clock (time/sleep) of the batch.
+Usage:
+
+from backend import PBSBackend, SimBackend
+
+1. PBSBackend(): the real cluster; 'qsub', 'qstat -f', 'pbsnodes -a' and 'qdel' (the default backend of multibatch).
+2. SimBackend(nodes, durations, ...): a simulated PBS in this process, for testing and benchmarking off the cluster.
+	nodes: dict, {node_name: total cores}
+	durations: dict or function, the runtime (simulated seconds) of a job; {jobname: seconds} or f(jobname, workdir, cores) -> seconds.
+	queue_delay: float, simulated seconds between the submission and the earliest start of a job.
+	fail: list of jobnames which write an error into their err file ('#PBS -e') when they end.
+	speedup: float, simulated seconds per real second; sleep() is shortened accordingly.
+	close() stops the thread which ends the jobs in the background; call it when the simulation is over.
+3. Give the backend to the jobs: Job(..., backend=SimBackend({"node01": 16, "node02": 16}, {"job.sh-scf": 600}, speedup=1000))
+4. Type 'python backend.py' to replay a synthetic campaign of many QE pipelines on the simulated cluster and print its throughput and core usage.
+"""
+from threading import Lock, Thread, Event
+import subprocess as sub
+import time as _time
+import re, os, random
+from metrics import metrics
+from pbsnodes import Snapshot
+
+def read_nodes_line(filename):
+	"""Returns [(node_name, cores), ...] from the '#PBS -l nodes=' line of a jobscript."""
+	fin = open(filename, "r"); file = fin.read(); fin.close()
+	line = re.search(r"#PBS\s+-l\s+nodes=(.*)", file)
+	return [(f"node{index}", int(cores)) for index, cores in re.findall(r"node(\d+).*?:ppn=(\d+)", line.group(1))] if line else []
+
+def read_err_file(filename):
+	"""Returns the err file of a jobscript (the '#PBS -e' line), 'err' if none."""
+	fin = open(filename, "r"); file = fin.read(); fin.close()
+	line = re.search(r"#PBS\s+-e\s+(\S+)", file)
+	return line.group(1) if line else "err"
+
+class Backend:
+	"""The interface of a scheduler backend."""
+	speedup = 1.0 ## seconds of the backend's clock per real second
+	def submit(self, jobname: str, workdir: str, epilogue: str=None) -> str:
+		"""Submits the jobscript jobname in workdir and returns the jobid. epilogue: the absolute path of a script run when the job ends, with the arguments of a PBS epilogue."""
+		raise NotImplementedError
+	def status(self, jobid: str) -> str:
+		"""Returns "queued", "running", or "done"."""
+		raise NotImplementedError
+	def nodes(self) -> dict:
+		"""Returns nodesdict: {node_name: {"total": cores, "remain": free cores or "--" (down), "users": set of jobids}}."""
+		raise NotImplementedError
+	def delete(self, jobid: str):
+		raise NotImplementedError
+	def finish_time(self, jobid: str):
+		"""Returns the time the job ended, or None if the backend does not know."""
+		return None
+	def time(self) -> float:
+		return _time.time()
+	def sleep(self, seconds: float):
+		_time.sleep(seconds)
+
+def _pbsnodes(command):
+	with metrics.call("pbsnodes"):
+		return sub.check_output(command, shell=True).decode("utf-8")
+
+def _qstat(jobid):
+	"""Returns the output (stdout and stderr) of 'qstat -f jobid'."""
+	with metrics.call("qstat"):
+		run = sub.run(f"qstat -f {jobid}", shell=True, stdout=sub.PIPE, stderr=sub.STDOUT)
+	return run.stdout.decode("utf-8", "replace")
+
+job_states = {"Q": "queued", "H": "queued", "W": "queued", "T": "queued", "S": "queued", "R": "running", "E": "running", "C": "done", "F": "done"} ## job_state of 'qstat -f' -> status
+
+class PBSBackend(Backend):
+	def __init__(self, ttl: float=5.0):
+		self.snapshot = Snapshot(ttl=ttl, run=_pbsnodes) ## 'pbsnodes -a', shared by the jobs polled within ttl seconds
+
+	def submit(self, jobname, workdir=".", epilogue=None):
+		with metrics.call("qsub"):
+			job_echo = sub.check_output("qsub {}{}".format(f"-l epilogue={epilogue} " if epilogue else "", jobname), shell=True, cwd=workdir).decode("utf-8")
+		self.snapshot.invalidate()
+		return re.search(r"(\d+)", job_echo).group(1)
+
+	def status(self, jobid):
+		"""Reads the job_state of 'qstat -f jobid' (see job_states): queued/held/waiting (Q, H, W, T, S) are "queued", running/exiting (R, E; err is staged out while exiting) are "running", completed (C, F) or unknown to the server ('Unknown Job Id', 'Job has finished') are "done". If qstat fails otherwise, the job is taken as "queued" and asked again at the next poll."""
+		text = _qstat(jobid)
+		state = re.search(r"job_state\s*=\s*(\w)", text)
+		if state: return job_states.get(state.group(1), "queued")
+		return "done" if re.search(r"Unknown Job Id|Job has finished", text, re.I) else "queued"
+
+	def nodes(self):
+		"""Gets the general nodes usage information from the system by the command 'pbsnodes -a' (see pbsnodes.Node.to_dict). Calls within ttl seconds share one snapshot."""
+		return self.snapshot.nodesdict()
+
+	def delete(self, jobid):
+		with metrics.call("qdel"):
+			sub.run(f"qdel {jobid}", shell=True)
+		self.snapshot.invalidate()
+
+class SimBackend(Backend):
+	def __init__(self, nodes: dict, durations=None, default_duration: float=60, queue_delay: float=5, fail: list=None, speedup: float=1.0):
+		self.totals = dict(nodes)
+		self.durations = durations or {}
+		self.default_duration = default_duration
+		self.queue_delay = queue_delay
+		self.fail = set(fail or [])
+		self.speedup = speedup
+		self.lock = Lock()
+		self.start_real = _time.time()
+		self.jobs = {} ## {jobid: {"jobname", "workdir", "alloc", "cores", "submit", "start", "end", "state", "epilogue"}}
+		self.count = 0
+		self.busy_core_seconds = 0.0
+		self.closed = Event()
+		Thread(target=self._tick, daemon=True).start() # ends jobs (writes their outputs) even if nobody asks
+
+	def _tick(self):
+		while not self.closed.wait(max(0.01, 1.0 / self.speedup)):
+			with self.lock: self._update()
+
+	def close(self):
+		"""Stops the background thread; the jobs still end when the backend is asked (status, nodes, ...)."""
+		self.closed.set()
+
+	def time(self):
+		return (_time.time() - self.start_real) * self.speedup
+
+	def sleep(self, seconds):
+		_time.sleep(seconds / self.speedup)
+
+	def _duration(self, jobname, workdir, cores):
+		if callable(self.durations): return self.durations(jobname, workdir, cores)
+		return self.durations.get(jobname, self.default_duration)
+
+	def _free(self):
+		free = dict(self.totals)
+		for job in self.jobs.values():
+			if job["state"] == "running":
+				for name, cores in job["alloc"]: free[name] -= cores
+		return free
+
+	def _finish(self, jobid):
+		"""Ends a job: writes 'JOB DONE.' into its QE output, and an error into its err file if it is set to fail; then runs its epilogue with the arguments of Torque."""
+		job = self.jobs[jobid]; job["state"] = "done"
+		self.busy_core_seconds += job["cores"] * (job["end"] - job["start"])
+		fin = open(os.path.join(job["workdir"], job["jobname"]), "r"); file = fin.read(); fin.close()
+		output = re.search(r"-np\s+\$NPROCS\s+.*>\s*(\S+)\s*$", file, re.M)
+		if output:
+			fout = open(os.path.join(job["workdir"], output.group(1)), "a"); fout.write("     JOB DONE.\n"); fout.close()
+		for workdir, jobname in re.findall(r"#BUNDLE-TASK[ \t]+(.+)[ \t]+(\S+)[ \t]*$", file, re.M): # tasks of a multibatch.Bundle
+			fout = open(os.path.join(workdir, f".{jobname}.status"), "w"); fout.write("1\n" if jobname in self.fail else "0\n"); fout.close()
+		if job["jobname"] in self.fail:
+			fout = open(os.path.join(job["workdir"], read_err_file(os.path.join(job["workdir"], job["jobname"]))), "a"); fout.write(f"Error in routine simulated ({job['jobname']})\n"); fout.close()
+		if job["epilogue"]:
+			walltime = int(job["end"] - job["start"])
+			resources = "cput={0},mem=0kb,vmem=0kb,walltime={0}".format(f"{walltime // 3600:02d}:{walltime // 60 % 60:02d}:{walltime % 60:02d}")
+			sub.run([job["epilogue"], jobid, "user", "group", job["jobname"], "0", "", resources, "batch", "", "1" if job["jobname"] in self.fail else "0"], cwd=job["workdir"])
+
+	def _start_queued(self, now):
+		"""Starts the queued jobs in submission order whenever their nodes have enough free cores."""
+		free = self._free()
+		for jobid in sorted([jobid for jobid in self.jobs if self.jobs[jobid]["state"] == "queued"], key=int):
+			job = self.jobs[jobid]
+			if job["submit"] + self.queue_delay > now: continue
+			if all(free.get(name, 0) >= cores for name, cores in job["alloc"]):
+				for name, cores in job["alloc"]: free[name] -= cores
+				job["state"] = "running"; job["start"] = max(now, job["submit"] + self.queue_delay)
+				job["end"] = job["start"] + self._duration(job["jobname"], job["workdir"], job["cores"])
+
+	def _update(self):
+		"""Replays the ends and starts of the jobs in time order up to now."""
+		now = self.time()
+		while True:
+			ending = [job["end"] for job in self.jobs.values() if job["state"] == "running" and job["end"] <= now]
+			if not ending: break
+			t = min(ending)
+			for jobid, job in self.jobs.items():
+				if job["state"] == "running" and job["end"] == t: self._finish(jobid)
+			self._start_queued(t)
+		self._start_queued(now)
+
+	def submit(self, jobname, workdir=".", epilogue=None):
+		with self.lock, metrics.call("sim.submit"):
+			self._update()
+			alloc = read_nodes_line(os.path.join(workdir, jobname))
+			for name, cores in alloc:
+				if name not in self.totals: raise ValueError(f"Unknown node '{name}' in {jobname}")
+			self.count += 1; jobid = str(self.count)
+			self.jobs[jobid] = {"jobname": jobname, "workdir": workdir, "alloc": alloc, "cores": sum(cores for _, cores in alloc), "submit": self.time(), "start": None, "end": None, "state": "queued", "epilogue": epilogue}
+			self._start_queued(self.time())
+			return jobid
+
+	def status(self, jobid):
+		with self.lock, metrics.call("sim.status"):
+			self._update(); return self.jobs[jobid]["state"]
+
+	def finish_time(self, jobid):
+		with self.lock: return self.jobs[jobid]["end"]
+
+	def nodes(self):
+		with self.lock, metrics.call("sim.nodes"):
+			self._update()
+			nodesdict = {name: {"total": total, "remain": total, "users": set()} for name, total in self.totals.items()}
+			for jobid, job in self.jobs.items():
+				if job["state"] == "running":
+					for name, cores in job["alloc"]:
+						nodesdict[name]["remain"] -= cores; nodesdict[name]["users"].add(jobid)
+			return nodesdict
+
+	def delete(self, jobid):
+		with self.lock:
+			self._update(); job = self.jobs[jobid]
+			if job["state"] == "running":
+				job["end"] = self.time(); self.busy_core_seconds += job["cores"] * (job["end"] - job["start"])
+			job["state"] = "done"
+
+	def stats(self):
+		"""Returns the summary of the simulation: jobs done, makespan, mean queue wait, and the fraction of core-time used."""
+		with self.lock:
+			self._update()
+			started = [job for job in self.jobs.values() if job["start"] is not None]
+			makespan = max([job["end"] for job in started if job["end"]] + [0.0])
+			waits = [job["start"] - job["submit"] for job in started]
+			return {"jobs": len(self.jobs), "done": sum(1 for job in self.jobs.values() if job["state"] == "done"),
+				"makespan": makespan, "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+				"utilization": self.busy_core_seconds / (makespan * sum(self.totals.values())) if makespan else 0.0}
+
+def replay(n_dirs: int=50, n_nodes: int=12, speedup: float=2000, seed: int=0, campaign: bool=False, max_cores: int=0):
+	"""Replays a campaign of n_dirs QE pipelines (scf -> ph -> q2r -> matdyn, scf -> nscf -> dos, scf -> bands) on a simulated cluster with the DAG scheduler and prints the result. campaign: one multibatch.Campaign (fair share, at most max_cores) instead of a DagBatch for each directory."""
+	import tempfile
+	import multibatch
+	from multibatch import Job, DagBatch, MultiBatch, Campaign
+	from runtimes import RuntimeHistory
+	rng = random.Random(seed)
+	root = tempfile.mkdtemp(prefix="simpbs-")
+	multibatch.history = RuntimeHistory(os.path.join(root, "runtimes.json"))
+	nodes = {f"node{i+1:02d}": 16 for i in range(n_nodes)}
+	stages = {"scf": (16, 300, []), "nscf": (16, 400, ["scf"]), "ph": (16, 3000, ["scf"]), "q2r": (16, 20, ["ph"]), "matdyn": (16, 30, ["q2r"]), "bands": (16, 300, ["scf"]), "dos": (1, 10, ["nscf"])}
+	durations = {}
+	batches = []
+	for d in range(n_dirs):
+		workdir = os.path.join(root, f"mat{d:04d}"); os.mkdir(workdir); open(os.path.join(workdir, "err"), "w").close()
+		jobs = {}
+		for stage, (cores, duration, parents) in stages.items():
+			jobname = f"job.sh-{stage}"
+			fout = open(os.path.join(workdir, jobname), "w")
+			fout.write(f"#!/bin/sh\n#PBS -N mat{d}\n#PBS -l nodes=node01:ppn={cores}\nmpirun -np $NPROCS pw.x <mat{d}.{stage}.in> mat{d}.{stage}.out\n"); fout.close()
+			durations[(workdir, jobname)] = duration * rng.uniform(0.7, 1.3)
+			jobs[stage] = Job(jobname, cores, 60, {}, lambda: 0, lambda: 0, [], workdir=workdir)
+			jobs[stage].submit_tries = 1000 # a saturated cluster is expected in a campaign
+		for stage, (cores, duration, parents) in stages.items():
+			jobs[stage].after(*[jobs[parent] for parent in parents])
+		batches.append(DagBatch(list(jobs.values()), max_workers=len(jobs)))
+	backend = SimBackend(nodes, lambda jobname, workdir, cores: durations[(workdir, jobname)], queue_delay=5, speedup=speedup)
+	for batch in batches:
+		for job in batch.jobs: job.backend = backend
+	start = _time.perf_counter()
+	if campaign:
+		C = Campaign([job for batch in batches for job in batch.jobs], max_cores=max_cores, retry=30); C._report = lambda status: None
+		results = [C.run()]
+	else: results = MultiBatch(batches, max_workers=n_dirs).run()
+	elapsed = _time.perf_counter() - start
+	stats = backend.stats(); backend.close()
+	print(f"{'campaign' if campaign else f'{sum(results)}/{len(results)} pipelines'} {'succeeded' if all(results) else 'failed'}; {stats['done']}/{stats['jobs']} jobs done in {elapsed:.1f} s real time")
+	print("simulated makespan {:.0f} s, mean queue wait {:.0f} s, core utilization {:.1%}, {:.1f} jobs per real second".format(stats["makespan"], stats["mean_wait"], stats["utilization"], stats["jobs"] / elapsed))
+	metrics.write_json(os.path.join(root, "metrics.json")); print(f"metrics of each job: {os.path.join(root, 'metrics.json')}")
+
+if __name__ == "__main__":
+	replay()
+	replay(campaign=True)
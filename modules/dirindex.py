@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module contains the incremental directory scanner shared by duindex.DiskIndex and workspace.Workspace: an index (SQLite) of the directories under the scanned roots, updated by directory mtimes, so that only the directories which changed since the last scan are listed again.
+Usage:
+
+from dirindex import DirIndex, subtree
+
+1. A subclass gives the tables (schema, tables), the columns of 'dirs' kept for a directory (columns) and the hooks:
+	_summarize(path, entries) -> info of a listed directory from its os.scandir entries (the sub-directories excluded);
+	_reuse(values) -> the same info from the columns of a directory whose mtime did not change;
+	_inherit(path, info, inherited) -> what its sub-directories inherit (e.g. the nearest 'modparam.py');
+	_row(path, parent, mtime, info, inherited, results, context, out) -> appends the rows of the directory to out[table] after those of its sub-directories (results: their results) and returns its result.
+2. result, out = self._scan(root, full) # result of root, {table: [rows]}; the sub-directories of root are scanned at the same time by a thread pool
+3. self._store(root, {"dirs": (column names, rows)}) replaces the rows of root and everything under it.
+4. subtree(path) -> the WHERE clause (and its parameters) of path and everything under it.
+"""
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from contextlib import contextmanager, closing
+import sqlite3, os
+
+def subtree(path):
+	"""The WHERE clause (and its parameters) of path and everything under it; '0' is the character right after '/'."""
+	path = path.rstrip("/") or "/"
+	return "(path = ? OR (path > ? AND path < ?))", (path, path.rstrip("/") + "/", path.rstrip("/") + "0")
+
+class DirIndex:
+	schema = [] ## the CREATE statements of the tables; 'dirs' has path, parent and mtime
+	columns = () ## the columns of 'dirs' given to _reuse
+	tables = ("dirs",) ## the tables filled by _row
+	prune = () ## dirs which are never searched (fnmatch patterns)
+	counters = ("listed", "reused") ## directories listed again / taken from the index by the last scan, and the counters of the subclass
+
+	def __init__(self, filename: str):
+		self.filename = filename
+		self.lock = Lock()
+		self.stats = dict.fromkeys(self.counters, 0)
+		with self.lock, self._connect() as db:
+			for statement in self.schema: db.execute(statement)
+
+	@contextmanager
+	def _connect(self):
+		"""A new connection for each operation; committed and closed at the end of the 'with' block."""
+		with closing(sqlite3.connect(self.filename, timeout=30)) as db, db: yield db
+
+	def _count(self, key):
+		with self.lock: self.stats[key] += 1
+
+	def _summarize(self, path, entries):
+		raise NotImplementedError
+
+	def _reuse(self, values):
+		raise NotImplementedError
+
+	def _inherit(self, path, info, inherited):
+		return inherited
+
+	def _row(self, path, parent, mtime, info, inherited, results, context, out):
+		raise NotImplementedError
+
+	def _context(self, root, full):
+		"""Returns what the scan of root reads: {"old": {path: (mtime, *columns)}, "children": {parent: [paths]}, "full": full} of the indexed directories under root."""
+		where, params = subtree(root)
+		with self.lock, self._connect() as db:
+			rows = db.execute(f"SELECT path, parent, mtime{''.join(', ' + column for column in self.columns)} FROM dirs WHERE {where}", params).fetchall()
+		old = {}; children = {}
+		for row in rows:
+			old[row[0]] = (row[2],) + tuple(row[3:]); children.setdefault(row[1], []).append(row[0])
+		return {"old": old, "children": children, "full": full}
+
+	def _list(self, path, mtime, context):
+		"""Returns (info, [(sub-directory, mtime or None)]) of path. A directory with the same mtime as in the index keeps its info and sub-directories; otherwise it is listed again by os.scandir."""
+		old = context["old"]
+		if not context["full"] and path in old and old[path][0] == mtime:
+			self._count("reused"); return self._reuse(old[path][1:]), [(child, None) for child in context["children"].get(path, [])]
+		files = []; subdirs = []
+		try:
+			with os.scandir(path) as entries:
+				for entry in entries:
+					try:
+						if entry.is_dir(follow_symlinks=False):
+							if not any(fnmatch(entry.name, pattern) for pattern in self.prune): subdirs.append((entry.path, entry.stat(follow_symlinks=False).st_mtime_ns))
+						else: files.append(entry)
+					except OSError: pass
+		except OSError: pass # permission denied, removed meanwhile, ...
+		self._count("listed"); return self._summarize(path, files), subdirs
+
+	@staticmethod
+	def _subdirs(subdirs):
+		"""Yields (sub-directory, mtime); the mtime of those taken from the index is read, and the directories gone meanwhile are left out."""
+		for child, child_mtime in subdirs:
+			if child_mtime is None:
+				try: child_mtime = os.stat(child, follow_symlinks=False).st_mtime_ns
+				except OSError: continue
+			yield child, child_mtime
+
+	def _scan_dir(self, path, parent, mtime, inherited, context, out):
+		"""Returns the result of path and appends the rows of path and its sub-directories to out."""
+		info, subdirs = self._list(path, mtime, context)
+		inherited = self._inherit(path, info, inherited)
+		results = [self._scan_dir(child, path, child_mtime, inherited, context, out) for child, child_mtime in self._subdirs(subdirs)]
+		return self._row(path, parent, mtime, info, inherited, results, context, out)
+
+	def _scan_subtree(self, path, parent, mtime, inherited, context):
+		out = {table: [] for table in self.tables}; return self._scan_dir(path, parent, mtime, inherited, context, out), out
+
+	def _scan(self, root: str, full: bool=False, workers: int=16, inherited=None):
+		"""Scans root (an absolute path) and returns (result of root, {table: [rows]}). The sub-directories of root are scanned at the same time by a thread pool. full: list every directory again."""
+		context = self._context(root, full)
+		self.stats = dict.fromkeys(self.counters, 0)
+		mtime = os.stat(root).st_mtime_ns
+		info, subdirs = self._list(root, mtime, context)
+		inherited = self._inherit(root, info, inherited)
+		out = {table: [] for table in self.tables}; results = []
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			futures = [pool.submit(self._scan_subtree, child, root, child_mtime, inherited, context) for child, child_mtime in self._subdirs(subdirs)]
+			for future in futures:
+				result, subout = future.result(); results.append(result)
+				for table in out: out[table] += subout[table]
+		return self._row(root, os.path.dirname(root), mtime, info, inherited, results, context, out), out
+
+	def _store(self, root, tables):
+		"""Replaces the rows of root and everything under it; tables: {table: (column names, rows)}."""
+		where, params = subtree(root)
+		with self.lock, self._connect() as db:
+			for table in tables: db.execute(f"DELETE FROM {table} WHERE {where}", params)
+			for table, (names, rows) in tables.items():
+				db.executemany(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", rows)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module keeps a persistent index (SQLite) of the disk usage of every directory under the scanned roots, so that a storage report only rescans the directories which changed since the last one.
+Usage:
+
+from duindex import DiskIndex
+
+1. D = DiskIndex() # the index is kept in '~/.hellowork_du.db'
+2. D.scan("/data2/twchang/qe") -> bytes under the directory; only the directories whose mtime changed are listed again, the others are taken from the index (one stat per directory instead of one per file).
+3. D.total("/data2/twchang/qe/H3S") -> bytes from the index (None if never scanned)
+4. D.biggest("/data2/twchang", n=10, depth=2) -> [(path, bytes), ...], from the index without scanning.
+5. Type 'python duindex.py dir' to compare a full scan with an incremental one.
+
+The mtime of a directory changes when an entry is created, removed or renamed in it, but not when a file in it grows; type D.scan(root, full=True) once in a while (e.g. 'hellowork.py -s --full') to recount the files of every directory.
+"""
+import os, time
+from dirindex import DirIndex, subtree
+
+index_file = os.path.join(os.path.expanduser("~"), ".hellowork_du.db")
+
+class DiskIndex(DirIndex):
+	"""The bytes of every directory (own: its files, total: everything under it); see dirindex.DirIndex for the scan."""
+	schema = ["CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER, own INTEGER, total INTEGER, scanned REAL)",
+		"CREATE INDEX IF NOT EXISTS parent_index ON dirs (parent)"]
+	columns = ("own",)
+
+	def __init__(self, filename: str=index_file):
+		super().__init__(filename)
+
+	def _summarize(self, path, entries):
+		"""The own bytes of a directory: the sum of the sizes of its files."""
+		own = 0
+		for entry in entries:
+			try:
+				if entry.is_file(follow_symlinks=False): own += entry.stat(follow_symlinks=False).st_size
+			except OSError: pass
+		return own
+
+	def _reuse(self, values):
+		return values[0]
+
+	def _row(self, path, parent, mtime, own, inherited, totals, context, out):
+		"""Appends (path, parent, mtime, own, total) and returns the bytes under path."""
+		total = own + sum(totals); out["dirs"].append((path, parent, mtime, own, total)); return total
+
+	def scan(self, root: str, full: bool=False, workers: int=16):
+		"""Updates the index of root and returns the bytes under it. The sub-directories of root are scanned at the same time by a thread pool. full: list every directory again."""
+		root = os.path.abspath(root)
+		total, out = self._scan(root, full, workers); now = time.time()
+		self._store(root, {"dirs": (("path", "parent", "mtime", "own", "total", "scanned"), [row + (now,) for row in out["dirs"]])})
+		return total
+
+	def total(self, path: str):
+		"""Returns the bytes under path from the index, or None."""
+		with self.lock, self._connect() as db:
+			row = db.execute("SELECT total FROM dirs WHERE path = ?", (os.path.abspath(path),)).fetchone()
+		return row[0] if row else None
+
+	def biggest(self, root: str="/", n: int=20, depth: int=None):
+		"""Returns the n biggest directories under root [(path, bytes), ...] from the index; depth: only the directories depth levels below root."""
+		root = os.path.abspath(root); where, params = subtree(root)
+		slashes = "(length(path) - length(replace(path, '/', '')))"
+		if depth is not None:
+			where += f" AND {slashes} = ?"; params += (root.rstrip("/").count("/") + depth,)
+		with self.lock, self._connect() as db:
+			return db.execute(f"SELECT path, total FROM dirs WHERE {where} ORDER BY total DESC LIMIT ?", params + (n,)).fetchall()
+
+if __name__ == "__main__":
+	import sys, tempfile
+	root = sys.argv[1] if len(sys.argv) > 1 else "."
+	D = DiskIndex(os.path.join(tempfile.mkdtemp(), "du.db"))
+	for label, full in [("full scan", True), ("incremental scan", False)]:
+		start = time.perf_counter(); total = D.scan(root, full=full); elapsed = time.perf_counter() - start
+		print(f"{label}: {total/10**9:.3f} GB in {elapsed:.2f} s ({D.stats['listed']} directories listed, {D.stats['reused']} from the index)")
+	for path, size in D.biggest(root, n=10, depth=1):
+		print(f"{size/10**9:10.3f} GB  {path}")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module waits for changes of a few files in a directory (e.g. 'err', the QE output, and the sentinel written by the epilogue of a job), so that multibatch notices the end of a job within seconds without asking the scheduler.
+Usage:
+
+from fswatch import Watcher
+
+1. W = Watcher("/data2/twchang/qe/H3S", ["err", "H3S.scf.out", ".job.sh-scf.done"])
+2. changed = W.wait(300) # returns True as soon as one of the files is created/modified, False after 300 seconds.
+3. W.close()
+
+Linux inotify (through ctypes) is used when available. Since inotify does not see the writes made by other hosts on NFS, the sizes and mtimes of the files are also checked every stat_interval seconds.
+"""
+import ctypes, ctypes.util
+import os, select, struct, time
+
+IN_MODIFY = 0x002; IN_CLOSE_WRITE = 0x008; IN_MOVED_TO = 0x080; IN_CREATE = 0x100
+
+def _inotify():
+	"""Returns libc if it supports inotify, or None."""
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		libc.inotify_init1; libc.inotify_add_watch
+		return libc
+	except (OSError, AttributeError, TypeError):
+		return None
+
+class Watcher:
+	def __init__(self, directory: str, names: list, stat_interval: float=5, scale: float=1.0):
+		self.directory = directory
+		self.names = set(names)
+		self.stat_interval = stat_interval
+		self.scale = scale ## real seconds per second of the caller's clock (1/speedup of a simulated backend)
+		self.fd = -1
+		libc = _inotify()
+		if libc:
+			fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+			if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) >= 0: self.fd = fd
+			elif fd >= 0: os.close(fd)
+		self.stats = self._stat()
+
+	def _stat(self):
+		stats = {}
+		for name in self.names:
+			try: info = os.stat(os.path.join(self.directory, name)); stats[name] = (info.st_size, info.st_mtime)
+			except OSError: stats[name] = None
+		return stats
+
+	def _events(self):
+		"""Reads the pending inotify events and returns True if any of them is about the watched files."""
+		try: data = os.read(self.fd, 65536)
+		except BlockingIOError: return False
+		i = 0; relevant = False
+		while i + 16 <= len(data):
+			wd, mask, cookie, length = struct.unpack_from("iIII", data, i)
+			name = data[i+16:i+16+length].rstrip(b"\0").decode("utf-8", "replace")
+			relevant = relevant or name in self.names
+			i += 16 + length
+		return relevant
+
+	def wait(self, timeout: float):
+		"""Waits until one of the files changes (returns True) or timeout seconds pass (returns False)."""
+		deadline = time.time() + timeout * self.scale
+		while True:
+			left = deadline - time.time()
+			if left <= 0: return False
+			chunk = min(left, self.stat_interval * self.scale)
+			if self.fd >= 0:
+				ready, _, _ = select.select([self.fd], [], [], chunk)
+				if ready and self._events(): self.stats = self._stat(); return True
+			else: time.sleep(chunk)
+			stats = self._stat()
+			if stats != self.stats: self.stats = stats; return True
+
+	def close(self):
+		if self.fd >= 0: os.close(self.fd); self.fd = -1
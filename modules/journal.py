@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module keeps an on-disk journal (SQLite) of every state change of the jobs run by multibatch, so that a batch which is restarted after a crash can skip the finished jobs and reattach to the running ones.
+Usage:
+
+from journal import Journal
+
+1. J = Journal(".qebatch.db")
+2. J.write(workdir, "job.sh-scf", "submitted", jobid="12345")
+3. J.last(workdir, "job.sh-scf") -> {"state": "submitted", "jobid": "12345", "time": 1700000000.0, "detail": ""}; None if the job has no record.
+4. States: "preprocessed", "submitted", "running", "done", "failed", and "stale" (a finished job to be run again).
+5. J.invalidate(workdir, ["job.sh-nscf", "job.sh-dos"]) marks the finished ones "stale", e.g. when their outputs are out of date; multibatch skips only the jobs whose last state is "done".
+"""
+from threading import Lock
+from time import time
+from contextlib import contextmanager, closing
+import sqlite3, os
+
+class Journal:
+	def __init__(self, filename: str=".qebatch.db"):
+		self.filename = filename
+		self.lock = Lock()
+		with self.lock, self._connect() as db:
+			db.execute("CREATE TABLE IF NOT EXISTS journal (id INTEGER PRIMARY KEY, time REAL, workdir TEXT, jobname TEXT, state TEXT, jobid TEXT, detail TEXT)")
+			db.execute("CREATE INDEX IF NOT EXISTS job_index ON journal (workdir, jobname)")
+
+	@contextmanager
+	def _connect(self):
+		"""A new connection for each operation, so the journal can be used from several threads; committed and closed at the end of the 'with' block."""
+		with closing(sqlite3.connect(self.filename, timeout=30)) as db, db: yield db
+
+	def write(self, workdir: str, jobname: str, state: str, jobid: str="", detail: str=""):
+		"""Appends a state change of the job."""
+		with self.lock, self._connect() as db:
+			db.execute("INSERT INTO journal (time, workdir, jobname, state, jobid, detail) VALUES (?, ?, ?, ?, ?, ?)", (time(), os.path.abspath(workdir), jobname, state, jobid, detail))
+
+	def last(self, workdir: str, jobname: str):
+		"""Returns the last record of the job as a dict, or None. 'time' of the record is the time of the last submission if the job is still running."""
+		with self.lock, self._connect() as db:
+			rows = db.execute("SELECT time, state, jobid, detail FROM journal WHERE workdir = ? AND jobname = ? ORDER BY id DESC", (os.path.abspath(workdir), jobname)).fetchall()
+		if not rows: return None
+		record = dict(zip(["time", "state", "jobid", "detail"], rows[0]))
+		if record["state"] == "running":
+			submitted = [row for row in rows if row[1] == "submitted"]
+			if submitted: record["time"] = submitted[0][0]
+		return record
+
+	def invalidate(self, workdir: str, jobnames: list, detail: str=""):
+		"""Marks the jobs among jobnames whose last state is "done" as "stale", so that they are run again instead of skipped. Returns the jobs marked."""
+		stale = [jobname for jobname in jobnames if (self.last(workdir, jobname) or {}).get("state") == "done"]
+		for jobname in stale: self.write(workdir, jobname, "stale", detail=detail)
+		return stale
+
+	def history(self, workdir: str=None):
+		"""Returns all the records (of workdir if given) as a list of (time, workdir, jobname, state, jobid, detail)."""
+		with self.lock, self._connect() as db:
+			if workdir is None: return db.execute("SELECT time, workdir, jobname, state, jobid, detail FROM journal ORDER BY id").fetchall()
+			return db.execute("SELECT time, workdir, jobname, state, jobid, detail FROM journal WHERE workdir = ? ORDER BY id", (os.path.abspath(workdir),)).fetchall()
+
+	def clear(self, workdir: str):
+		"""Forgets all the jobs of workdir (to start the batch from the beginning)."""
+		with self.lock, self._connect() as db:
+			db.execute("DELETE FROM journal WHERE workdir = ?", (os.path.abspath(workdir),))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module records where the time of a batch goes: the timestamps of every phase of each job, and the number and latency of the calls to the scheduler (qsub, pbsnodes, qdel).
+Usage:
+
+from metrics import metrics
+
+1. metrics.mark(key, "submitted") # key: usually "workdir/jobname"
+2. with metrics.call("qsub"): ... # counts the call and its latency
+3. metrics.summary() -> dict; metrics.write_json("qebatch_metrics.json"); metrics.write_prom("/var/lib/node_exporter/qebatch.prom")
+4. metrics.print_stages(): prints queue wait, run time, poll overhead and submission gap of each job.
+
+Phases of a job (each is a timestamp): "ready", "preprocessed", "submitted", "started" (first seen running), "finished" (last change of its outputs), "detected" (seen done by a poll), "postprocessed", "failed".
+"""
+from threading import Lock
+from contextlib import contextmanager
+import time, json, os
+
+class Metrics:
+	def __init__(self):
+		self.lock = Lock()
+		self.jobs = {} ## {key: {"phases": {phase: time}, "polls": int, "sleep": float, "parents": [keys]}}
+		self.calls = {} ## {command: [count, total seconds, max seconds]}
+
+	def _job(self, key):
+		return self.jobs.setdefault(key, {"phases": {}, "polls": 0, "sleep": 0.0, "parents": []})
+
+	def mark(self, key: str, phase: str, t: float=None, overwrite: bool=True):
+		"""Records the time (now if not given) of a phase of the job."""
+		with self.lock:
+			phases = self._job(key)["phases"]
+			if overwrite or phase not in phases: phases[phase] = time.time() if t is None else t
+
+	def poll(self, key: str, seconds: float):
+		"""Counts a poll of the job followed by a sleep of seconds."""
+		with self.lock:
+			job = self._job(key); job["polls"] += 1; job["sleep"] += seconds
+
+	def parents(self, key: str, parent_keys: list):
+		"""Records the parents of the job, used for the gap between a parent ends and the job is submitted."""
+		with self.lock: self._job(key)["parents"] = list(parent_keys)
+
+	@contextmanager
+	def call(self, command: str):
+		"""Counts a call to the scheduler and its latency."""
+		start = time.perf_counter()
+		try: yield
+		finally:
+			elapsed = time.perf_counter() - start
+			with self.lock:
+				count = self.calls.setdefault(command, [0, 0.0, 0.0])
+				count[0] += 1; count[1] += elapsed; count[2] = max(count[2], elapsed)
+
+	def _durations(self, key):
+		"""Returns the derived durations (seconds) of a job; a duration is missing if one of its phases is."""
+		job = self.jobs[key]; p = job["phases"]
+		def diff(a, b): return max(0.0, p[b] - p[a]) if a in p and b in p else None
+		durations = {"preprocess": diff("ready", "preprocessed"), "queue_wait": diff("submitted", "started"), "run": diff("started", "finished"),
+			"poll_overhead": diff("finished", "detected"), "postprocess": diff("detected", "postprocessed"), "total": diff("ready", "postprocessed") or diff("ready", "failed")}
+		ends = [self.jobs[parent]["phases"]["detected"] for parent in job["parents"] if parent in self.jobs and "detected" in self.jobs[parent]["phases"]]
+		durations["submission_gap"] = max(0.0, p["submitted"] - max(ends)) if ends and "submitted" in p else None
+		return durations
+
+	def summary(self):
+		"""Returns the metrics as a dict (for JSON)."""
+		with self.lock:
+			return {"jobs": {key: {"phases": dict(job["phases"]), "durations": self._durations(key), "polls": job["polls"], "sleep": job["sleep"], "success": "failed" not in job["phases"]} for key, job in self.jobs.items()},
+				"calls": {command: {"count": c[0], "seconds": c[1], "max_seconds": c[2]} for command, c in self.calls.items()}}
+
+	def write_json(self, filename: str):
+		fout = open(filename, "w"); json.dump(self.summary(), fout, indent=1); fout.close()
+
+	def write_prom(self, filename: str):
+		"""Writes the metrics in the Prometheus text format. The file is replaced atomically, as required by node_exporter's textfile collector."""
+		summary = self.summary(); lines = []
+		def label(value): return str(value).replace("\\", "\\\\").replace('"', '\\"')
+		lines += ["# HELP multibatch_job_phase_seconds Duration of each phase of a job.", "# TYPE multibatch_job_phase_seconds gauge"]
+		for key, job in summary["jobs"].items():
+			workdir, jobname = os.path.split(key)
+			for phase, seconds in job["durations"].items():
+				if seconds is not None: lines.append(f'multibatch_job_phase_seconds{{workdir="{label(workdir)}",job="{label(jobname)}",phase="{phase}"}} {seconds:.3f}')
+		lines += ["# HELP multibatch_job_polls_total Polls of a job.", "# TYPE multibatch_job_polls_total counter"]
+		lines += [f'multibatch_job_polls_total{{workdir="{label(os.path.split(key)[0])}",job="{label(os.path.split(key)[1])}"}} {job["polls"]}' for key, job in summary["jobs"].items()]
+		lines += ["# HELP multibatch_job_success Whether a job succeeded.", "# TYPE multibatch_job_success gauge"]
+		lines += [f'multibatch_job_success{{workdir="{label(os.path.split(key)[0])}",job="{label(os.path.split(key)[1])}"}} {int(job["success"])}' for key, job in summary["jobs"].items()]
+		lines += ["# HELP multibatch_scheduler_calls_total Calls to the scheduler commands.", "# TYPE multibatch_scheduler_calls_total counter"]
+		lines += [f'multibatch_scheduler_calls_total{{command="{label(command)}"}} {c["count"]}' for command, c in summary["calls"].items()]
+		lines += ["# HELP multibatch_scheduler_call_seconds_total Time spent in the scheduler commands.", "# TYPE multibatch_scheduler_call_seconds_total counter"]
+		lines += [f'multibatch_scheduler_call_seconds_total{{command="{label(command)}"}} {c["seconds"]:.6f}' for command, c in summary["calls"].items()]
+		tempname = filename + ".tmp"; fout = open(tempname, "w"); fout.write("\n".join(lines) + "\n"); fout.close()
+		os.replace(tempname, filename)
+
+	def print_stages(self):
+		"""Prints the time breakdown of each job and of the scheduler calls."""
+		def fmt(seconds): return "{:>9}".format("--" if seconds is None else "{:.0f}s".format(seconds))
+		summary = self.summary()
+		several = len(set(os.path.dirname(key) for key in summary["jobs"])) > 1 # show the directories if there are several
+		def name(key): return os.path.join(os.path.basename(os.path.dirname(key)), os.path.basename(key)) if several else os.path.basename(key)
+		print("{:<24}{:>9}{:>9}{:>9}{:>9}{:>9}{:>9}{:>7}".format("job", "queue", "run", "detect", "gap", "total", "sleep", "polls"))
+		for key, job in summary["jobs"].items():
+			d = job["durations"]
+			print("{:<24}{}{}{}{}{}{}{:>7}".format(name(key) + ("" if job["success"] else " (x)"), fmt(d["queue_wait"]), fmt(d["run"]), fmt(d["poll_overhead"]), fmt(d["submission_gap"]), fmt(d["total"]), fmt(job["sleep"]), job["polls"]))
+		for command, c in summary["calls"].items():
+			print("'{}': {} calls, {:.2f} s in total, {:.3f} s at most".format(command, c["count"], c["seconds"], c["max_seconds"]))
+
+metrics = Metrics() ## shared by multibatch and backend
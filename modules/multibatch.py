@@ -41,18 +41,63 @@ j2 = ...
 j3 = ...
 B = Batch([j1, j2, j3]) # single node
 B.run()
+
+3. Several independent batches (e.g. batches in different working directories) can be run at the same time:
+M = MultiBatch([Batch([j1, j2]), Batch([j3, j4])], max_workers=2)
+results = M.run() # [True, False], one flag for each batch
+
+4. Jobs with dependencies: declare the parents of each job, and every job is submitted as soon as all its parents succeed.
+j2.after(j1); j3.after(j1); j4.after(j2, j3)
+D = DagBatch([j1, j2, j3, j4]) # j2 and j3 run at the same time
+D.run()
+
+5. Crash-safe batches: give the jobs a journal, and a restarted batch skips the finished jobs and reattaches to the running ones.
+J = Journal(".qebatch.db")
+j1 = Job("job.sh-scf", 16, 10, {}, pre, post, [], journal=J)
+
+6. Off the cluster: give the jobs a simulated backend (see backend.SimBackend).
+j1 = Job("job.sh-scf", 16, 10, {}, pre, post, [], backend=SimBackend({"node01": 16, "node02": 16}, {"job.sh-scf": 600}, speedup=1000))
+
+7. Small serial jobs (e.g. dos, pdos, lambda, plot; also from different directories) can share one submitted allocation:
+B = Bundle([j_dos, j_pdos, j_plot], max_cores=4)
+results = B.run() # {j_dos: True, j_pdos: True, j_plot: False}
+DagBatch(jobs, bundle_cores=1) bundles the 1-core jobs that become ready at the same time.
+8. Many directories under one budget: give each job its workdir and put the jobs of all the directories into a Campaign.
+C = Campaign(jobs_of_all_dirs, max_cores=128, max_jobs=10) # fair share between the directories; prints the progress of each one
+C.run()
 """
-from threading import Lock, Thread
-from os import system
-import subprocess as sub
-from time import sleep
-import re, os
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+import re, os, tempfile, shutil
+from nodepack import place_jobs, node_str
+from qemonitor import Monitor
+from runtimes import RuntimeHistory, next_poll
+from journal import Journal
+from backend import PBSBackend, read_nodes_line, read_err_file
+from metrics import metrics
+from fswatch import Watcher
+
+node_lock = Lock() ## serializes node selection and submission among concurrent batches
+default_backend = PBSBackend() ## the real cluster (qsub, pbsnodes, qdel)
+history = RuntimeHistory() ## actual runtimes of finished jobs, used to schedule the polls
 
 class Job:
-	def __init__(self, jobname: str, cores: int, runtime: int, data, preprocess, postprocess, files: list):
+	reserved = {} ## {jobid or ("pending", id(job)): {node_name: cores}}, cores placed/submitted by this process but not yet shown by 'pbsnodes -a'
+
+	def __init__(self, jobname: str, cores: int, runtime: int, data, preprocess, postprocess, files: list, workdir: str=".", monitor_policy: dict=None, journal: Journal=None, backend=None):
 		self.jobname = jobname ## the job.sh file
 		self.cores = 16  ## number of cores needed
+		self.workdir = workdir ## the directory where the job.sh file is and where the job is submitted
 		self.jobid = ""
+		self.time_submit = None
+		self.time_started = None ## when the backend first reported the job running
+		self.submit_tries = 10 ## tries (one minute apart) to find free cores before the job is killed
+		self.monitor_policy = monitor_policy or {} ## keyword arguments of qemonitor.Monitor, e.g. {"abort": False, "scf_patience": 30}
+		self.monitor = None
+		self.backend = backend or default_backend ## submits jobs and reports the cluster (see backend.Backend)
+		self.journal = journal ## records every state change of the job (see journal.Journal)
+		self.parents = [] ## jobs that must succeed before this job starts (used by DagBatch)
 		self.runtime = runtime
 		self.data = data
 		self.preprocess = preprocess
@@ -66,34 +111,97 @@ class Job:
 	def postprocess(self):
 		self.postprocess(self.data)
 
+	def after(self, *jobs):
+		"""Declares that this job starts only after all the jobs succeed. Returns self."""
+		self.parents.extend([job for job in jobs if job not in self.parents]); return self
+
+	def _path(self, filename):
+		"""Returns the path of filename in self.workdir."""
+		return os.path.join(self.workdir, filename)
+
 	def kill(self):
 		print(f"Job {self.jobname} stopped. Exiting..."); return False
 
 	def _grep_job_core(self):
 		"""Gets the job nodes and cores used of each nodes from a jobscript file."""
-		job = self.jobname; # core = self.cores
-		# core = re.search(r"#PBS\s+-l\s+nodes=(.*)", fin).group(1)
-		core = sub.check_output("grep PBS\\ -l {}".format(job), shell=True).decode("utf-8")  #like: #PBS -l nodes=node03:ppn=4
-		match_list = re.findall(r"node(\d+).*?:ppn=(\d+)", core)
-		core_index_list = [match[0] for match in match_list]    # "03"
-		core_count_list = [int(match[1]) for match in match_list]  # 4
+		match_list = read_nodes_line(self._path(self.jobname)) #like: #PBS -l nodes=node03:ppn=4 -> [("node03", 4)]
+		core_index_list = [match[0][len("node"):] for match in match_list]    # "03"
+		core_count_list = [match[1] for match in match_list]  # 4
 		self.cores = sum(core_count_list)
 		return core_index_list, core_count_list
 
+	def _grep_output(self):
+		"""Gets the name of the QE output file from the jobscript, e.g. 'H3S.scf.out' from '... <H3S.scf.in> H3S.scf.out'. Returns None if there is none."""
+		fin = open(self._path(self.jobname), "r"); file = fin.read(); fin.close()
+		match = re.search(r"-np\s+\$NPROCS\s+.*>\s*(\S+)\s*$", file, re.M)
+		return match.group(1) if match else None
+
+	def _err(self):
+		"""The err file of the job (its '#PBS -e' line, 'err' if none); any line in it is a failure."""
+		return read_err_file(self._path(self.jobname))
+
+	def _history_key(self):
+		"""Returns (job type, material, cores) for the runtime history, e.g. ("scf", "H3S", 16). The material is the prefix of the QE output, or the name of workdir."""
+		output = self._grep_output()
+		material = output.split(".")[0] if output else os.path.basename(os.path.abspath(self.workdir))
+		return re.sub(r"^job\.sh-?", "", self.jobname) or "job", material, self.cores
+
+	def _get_monitor(self):
+		"""Creates the monitor of the err file and the QE output of this job (see qemonitor.Monitor)."""
+		if self.monitor is None:
+			output = self._grep_output()
+			files = [self._path(self._err())] + ([self._path(output)] if output else [])
+			self.monitor = Monitor(files, err_files=[self._path(self._err())], **self.monitor_policy)
+		return self.monitor
+
+	@property
+	def key(self):
+		"""The name of the job in the metrics: 'workdir/jobname'."""
+		return os.path.join(os.path.abspath(self.workdir), self.jobname)
+
+	def _mark(self, phase, t=None, overwrite=True):
+		"""Records the time of a phase of the job in metrics (by the clock of the backend)."""
+		metrics.mark(self.key, phase, self.backend.time() if t is None else t, overwrite)
+
+	def _finish_time(self):
+		"""The time the job actually ended: from the backend if it knows, otherwise the last change of its outputs."""
+		t = self.backend.finish_time(self.jobid)
+		if t is not None: return t
+		files = [self._path(f) for f in [self._grep_output(), self._err(), "out", self._sentinel()] if f and os.path.isfile(self._path(f))]
+		return max([os.path.getmtime(f) for f in files]) if files else None
+
+	def _log(self, state, detail=""):
+		"""Writes a state change into the journal (if any)."""
+		if self.journal: self.journal.write(self.workdir, self.jobname, state, self.jobid, detail)
+
+	def _last_record(self):
+		"""Returns the last journal record of this job, or None."""
+		return self.journal.last(self.workdir, self.jobname) if self.journal else None
+
+	def _reattach(self, record):
+		"""Reattaches to a job submitted before a restart. Returns "running" if it is still in the cluster, "done" if it finished with 'JOB DONE' in its output and an empty err file, and False otherwise (the job should be run again)."""
+		self.jobid = record["jobid"]; self.time_submit = record["time"]
+		self._grep_job_core()
+		if not self.is_done():
+			print(f"Reattached to job {self.jobid} ({self.jobname})."); return "running"
+		output = self._grep_output(); err = self._path(self._err())
+		if output and os.path.isfile(self._path(output)) and "JOB DONE" in open(self._path(output), "r").read() and not (os.path.isfile(err) and open(err, "r").read().strip()):
+			return "done"
+		self.jobid = ""; return False
+
+	def delete(self):
+		"""Deletes the submitted job from the queue ('qdel' on PBS)."""
+		if self.jobid: self.backend.delete(self.jobid)
+
 	def _get_nodesdict(self):
-		"""Gets the general nodes usage information from the system by the command 'pbsnodes -a'. Organized them in nodesdict by several parameters: total (total cores in a node), remain (remaining cores in a node), users (user names and their jobids in a node)"""
-		nodes_info_str = sub.check_output("pbsnodes -a", shell=True).decode("utf-8")
-		nodeslist = re.findall(r"node\d+.*\n(?:     \w+\s*=\s*.*\n)*", nodes_info_str)
-		nodesdict = {}
-		for node in nodeslist:
-			name = re.match(r"(node\d+).*", node).group(1)
-			total = int(re.search(r"np = (\d+)", node).group(1))
-			search = re.search(r"     jobs = (.*)", node)
-			if not search: remain = total; users = set()
-			else: 
-				remain = total - (search.group(1).count(",") + 1)
-				users = set(re.findall(r"\d+/(\d+).*?[,$]", search.group(0)))
-			nodesdict[name] = {"total": total, "remain": remain, "users": users}
+		"""Gets the general nodes usage information from the backend ('pbsnodes -a' on PBS; see backend.Backend.nodes) and subtracts the cores reserved by this process. Down nodes have no remaining cores."""
+		nodesdict = self.backend.nodes()
+		for name in nodesdict:
+			if nodesdict[name]["remain"] == "--": nodesdict[name]["remain"] = 0
+		for jobid, node_cores in Job.reserved.items(): # cores taken by our own jobs which pbsnodes does not show yet
+			for name, cores in node_cores.items():
+				if name in nodesdict and jobid not in nodesdict[name]["users"]:
+					nodesdict[name]["remain"] = max(0, nodesdict[name]["remain"] - cores)
 		return nodesdict
 
 	def _check_run(self):
@@ -109,46 +217,46 @@ class Job:
 		return True
 
 	def select_node(self, ppn, core_container_list):
-		"""Automatically selescts nodes and cores for the users. Gets ppn (self.cores) and arranges them into each node in core_container_list. Returns false when the ppn exceeds the total remaining cores of the system.
+		"""Automatically selescts nodes and cores for the users. Gets ppn (self.cores) and arranges them into the nodes of core_container_list by nodepack.place_jobs (fewest nodes first, then the tightest fit). Returns false when the ppn exceeds the total remaining cores of the system.
 		ppn: self.cores
 		core_container_list: The list of [node_name, node_remaining_cores] sorted by remaining cores.
 		"""
-		core_current_list = core_container_list; ppn_left = ppn
-		select_node_list = []
-		while ppn_left > 0:
-			# print("len", len(core_current_list))
-			for i in range(len(core_current_list)):
-				volume = core_current_list[i][1]
-				if ppn_left <= volume:
-					select_node_list.append([core_current_list[i][0], ppn_left])
-					volume -= ppn_left; ppn_left = 0
-					break
-				elif i == len(core_current_list)-1:
-					select_node_list.append(core_current_list[i])
-					ppn_left -= volume; core_current_list.pop(-1)
-				# else:
-				# 	continue
-			# print("ppn_left", ppn_left); print(core_current_list)
-			if core_current_list == []:
-				# print("ppn > total remaining cores in the server; exiting...")
-				return False
-		return select_node_list
-
-	def modify_cores(self):  # this should modify self.jobname's PBS -l line
-		"""Gets select_node_list from the function 'select_node' and modifies the jobscript (self.jobname) with the list. Returns false when it receives the false condition from select_node(ppn, core_container_list)"""
-		ppn = self.cores; nodesdict = self._get_nodesdict()
-		core_container_list = [[name, nodesdict[name]["remain"]] for name in nodesdict if nodesdict[name]["remain"] != 0]
-		core_container_list.sort(key=lambda s: s[1]); # pprint(core_container_list)
-		select_node_list = self.select_node(ppn, core_container_list); # pprint(select_node_list)
+		free = {name: remain for name, remain in core_container_list}
+		return place_jobs({self.jobname: ppn}, free)[self.jobname]
+
+	def modify_cores(self, select_node_list=None):  # this should modify self.jobname's PBS -l line
+		"""Gets select_node_list from the function 'select_node' (if not given) and modifies the jobscript (self.jobname) with the list. Returns false when it receives the false condition from select_node(ppn, core_container_list)"""
+		if select_node_list is None:
+			ppn = self.cores; nodesdict = self._get_nodesdict()
+			core_container_list = [[name, nodesdict[name]["remain"]] for name in nodesdict if nodesdict[name]["remain"] != 0]
+			core_container_list.sort(key=lambda s: s[1]); # pprint(core_container_list)
+			select_node_list = self.select_node(ppn, core_container_list); # pprint(select_node_list)
 		if not select_node_list: return False
-		node_str = "+".join(["{}:ppn={}".format(select_node_list[i][0], select_node_list[i][1]) for i in range(len(select_node_list))])
-		filename = self.jobname; fin = open(filename, "r"); file = fin.read(); fin.close()
-		file = re.sub(r"(#PBS\s+-l\s+nodes=).*", r"\1{}".format(node_str), file)
-		tempname = "oooo"; fout = open(tempname, 'w'); fout.write(file); fout.close()
+		filename = self._path(self.jobname); fin = open(filename, "r"); file = fin.read(); fin.close()
+		file = re.sub(r"(#PBS\s+-l\s+nodes=).*", r"\1{}".format(node_str(select_node_list)), file)
+		tempname = self._path("oooo"); fout = open(tempname, 'w'); fout.write(file); fout.close()
 		os.rename(tempname, filename)
 		print(f"Successfully modify ppn of {self.jobname}")
 		return True
 
+	@staticmethod
+	def place_pending(jobs):
+		"""Places several jobs that are ready at the same time together (see nodepack.place_jobs) and modifies their jobscripts. The chosen cores are reserved for each job until it is submitted, so other batches cannot take them."""
+		if not jobs: return
+		with node_lock:
+			cores = {}
+			for job in jobs:
+				record = job._last_record()
+				if record and record["state"] in ["done", "submitted", "running"]: continue # skipped or reattached by Job.run()
+				job._grep_job_core(); cores[id(job)] = job.cores
+			nodesdict = jobs[0]._get_nodesdict()
+			free = {name: nodesdict[name]["remain"] for name in nodesdict if nodesdict[name]["remain"] != "--"}
+			placement = place_jobs(cores, free)
+			for job in jobs:
+				select_node_list = placement.get(id(job))
+				if select_node_list and job.modify_cores(select_node_list):
+					Job.reserved[("pending", id(job))] = {name: count for name, count in select_node_list}
+
 	def _check_and_modify(self):
 		"""Executes _check_run() to see if the job is ready to run. If not, modifies the jobscript (self.jobname) with modify_cores(). If unsuccuessful (ppn exceeds the total remaining cores in system), sleeps for one minute and tries again (for at most ten times), killing the job after that. """
 		if self._check_run(): return True
@@ -158,68 +266,220 @@ class Job:
 				if self.modify_cores():
 					return True
 				else:
-					sleep(60); count += 1
+					self.backend.sleep(60); count += 1
 			print("ppn > total remaining cores in the server; exiting..."); return self.kill()
 
+	def _check_and_submit(self):
+		"""Same as _check_and_modify() (but with self.submit_tries tries) followed by submit(), but each try is done under node_lock so that concurrent batches never select the same free cores. The lock is released while sleeping."""
+		for count in range(self.submit_tries):
+			with node_lock:
+				Job.reserved.pop(("pending", id(self)), None) # cores kept by place_pending() are now used by this job
+				if self._check_run() or self.modify_cores():
+					self.submit(); return True
+			self.backend.sleep(60)
+		print("ppn > total remaining cores in the server; exiting..."); return self.kill()
+
+	def _sentinel(self):
+		"""The file written by the epilogue of the job when it ends: 'jobid exit_code resources_used'."""
+		return f".{self.jobname}.done"
+
+	def _write_epilogue(self):
+		"""Writes the epilogue '.<jobname>.epilogue' which writes the sentinel, removes the sentinel of the last run, and returns the absolute path of the epilogue. The jobscript is not changed (the sentinel line of older versions is removed from it)."""
+		filename = self._path(self.jobname); fin = open(filename, "r"); file = fin.read(); fin.close()
+		if "# multibatch sentinel" in file:
+			fout = open(filename, "w"); fout.write(re.sub(r"^date > \S+ # multibatch sentinel\n?", "", file, flags=re.M)); fout.close()
+		if os.path.isfile(self._path(self._sentinel())): os.remove(self._path(self._sentinel()))
+		epilogue = os.path.abspath(self._path(f".{self.jobname}.epilogue"))
+		fout = open(epilogue, "w")
+		fout.write(f"#!/bin/sh\n## written by multibatch; PBS runs it when {self.jobname} ends ($1: jobid, $7: resources used, $10: exit code)\necho \"$1 ${{10}} $7\" > '{os.path.abspath(self._path(self._sentinel()))}'\n"); fout.close()
+		os.chmod(epilogue, 0o700) # PBS refuses an epilogue which others can write
+		return epilogue
+
 	def submit(self):
-		"""Submits a job and gets its jobid."""
-		job_echo = sub.check_output("qsub {}".format(self.jobname), shell=True).decode("utf-8")
-		job_echo = re.sub(r"\n", r"", job_echo)
-		# print(job_echo, end = "; "); print("job '{}' running".format(self.jobname))
-		self.jobid = re.search(r"(\d+)", job_echo).group(1)
-		print(f"{job_echo}; job '{self.jobname}' is running.")
+		"""Submits a job with its epilogue (see _write_epilogue) and gets its jobid. The cores of the job are reserved until the job is done."""
+		epilogue = self._write_epilogue()
+		self.jobid = self.backend.submit(self.jobname, self.workdir, epilogue); self.time_submit = self.backend.time(); self.time_started = None
+		self._mark("submitted", self.time_submit)
+		self._log("submitted")
+		core_index_list, core_count_list = self._grep_job_core()
+		Job.reserved[self.jobid] = {f"node{core_index_list[i]}": core_count_list[i] for i in range(len(core_index_list))}
+		print(f"{self.jobid}; job '{self.jobname}' is running.")
+
+	def release(self):
+		"""Releases the cores reserved by submit()."""
+		with node_lock:
+			Job.reserved.pop(self.jobid, None)
 
 	def wait(self):
-		"""When job is running, checks for every self.runtime and kills the job if err occurs. If nothing bad happens, keeps waiting until the job is finished (self.is_done() == True) and returns true."""
-		print("->", end = " "); sleep(6)
-		while True:
-			if self.is_done(): 
-				if not self.is_err(): return self.kill()
-				else: 
+		"""When job is running, waits for changes of its 'err', its QE output and its sentinel (see fswatch.Watcher), and kills the job if err occurs. The scheduler is asked as soon as the sentinel appears (every 5 seconds until the job has left the queue, since PBS copies err back only then), otherwise every minute while the job is queued, and then only as a slow fallback around the estimated end (predicted from the runtime history and counted from the start of the job; see runtimes.next_poll). If nothing bad happens, records its runtime (without the queue wait; see _runtime) and returns true."""
+		key = self._history_key(); eta = history.predict(*key)
+		print("->", end = " "); self.backend.sleep(6)
+		output = self._grep_output()
+		watcher = Watcher(self.workdir, [self._err(), self._sentinel()] + ([output] if output else []), scale=1/self.backend.speedup)
+		next_check = self.backend.time()
+		try:
+			while True:
+				now = self.backend.time()
+				ended = os.path.isfile(self._path(self._sentinel()))
+				if ended or now >= next_check:
+					done = self.is_done()
+					if ended: next_check = now + 5
+					elif self.time_started is None: next_check = now + 60 # queued; asks until it starts
+					else: next_check = now + 4 * next_poll(now - self.time_started, eta, max_interval=max(60, self.runtime)) # slow fallback
+				else: done = False
+				if not self.is_err(final=done): return self.kill()
+				if done:
+					runtime = self._runtime()
+					if runtime is not None: history.record(*key, runtime)
 					print("{} success".format(self.jobname)); return True
-			if not self.is_err(): return self.kill()
-			sleep(self.runtime)
+				if self.time_started is None:
+					print("\r-> {}: queued {}  ".format(self.jobname, timedelta(seconds=int(now - self.time_submit))), end = "", flush=True)
+				else:
+					elapsed = now - self.time_started
+					if eta is None: eta_str = "unknown"
+					elif eta > elapsed: eta_str = str(timedelta(seconds=int(eta - elapsed)))
+					else: eta_str = "overdue"
+					print("\r-> {}: running {}, ETA {}  ".format(self.jobname, timedelta(seconds=int(elapsed)), eta_str), end = "", flush=True)
+				watcher.wait(max(1, next_check - now)) # returns early when err/output/sentinel changes
+				metrics.poll(self.key, self.backend.time() - now)
+		finally:
+			watcher.close()
 
 	def is_done(self):
-		"""Checks if self.jobid is still in the nodesdict. If yes, meaning that the job is still running, returns false. Else, returns true."""
-		core_index_list, core_count_list = self._grep_job_core()
-		nodesdict = self._get_nodesdict()
-		done_flag = True
-		for i in range(len(core_index_list)):
-			core_index = core_index_list[i]
-			# s = sub.check_output("qinfo | grep node{}".format(core_index), shell=True).decode("utf-8")
-			if self.jobid in nodesdict[f"node{core_index}"]["users"]:
-				done_flag = False; break
-		if not done_flag:
-			print(".", end = "", flush=True); return False
-		else:
-			print(" {} submitted by twchang is done.".format(self.jobname)); return True
+		"""Asks the backend whether self.jobid is still queued or running (on PBS: its job_state in 'qstat -f'; see backend.PBSBackend.status). If yes, returns false. Else, returns true."""
+		status = self.backend.status(self.jobid)
+		if status == "running":
+			self._mark("started", overwrite=False)
+			if self.time_started is None: self.time_started = self.backend.time()
+		if status != "done": return False
+		return self._done(self.backend.time())
+
+	def _runtime(self):
+		"""The time the job actually ran, without its queue wait: the walltime written into the sentinel by the epilogue, otherwise from when the backend first reported it running to its end. None if unknown."""
+		try:
+			fin = open(self._path(self._sentinel()), "r"); walltime = re.search(r"walltime=(\d+):(\d+):(\d+)", fin.read()); fin.close()
+		except OSError: walltime = None
+		if walltime: return 3600 * int(walltime.group(1)) + 60 * int(walltime.group(2)) + int(walltime.group(3))
+		finished = self._finish_time()
+		return finished - self.time_started if self.time_started is not None and finished is not None else None
 
-	def is_err(self):
-		"""Checks if there are any err messages in the err file and returns false when err happens; returns true if no err messages."""
-		if "err" not in os.listdir():
-			print("No 'err' file.\nBATCH STOPPED")
+	def _done(self, now):
+		"""Records the end of the job (noticed at now) and returns true."""
+		finished = self._finish_time()
+		self._mark("started", finished, overwrite=False) if finished is not None else 0
+		self._mark("finished", min(now, finished) if finished is not None else now); self._mark("detected", now)
+		print("\n{} submitted by twchang is done.".format(self.jobname)); return True
+
+	def is_err(self, final: bool=False):
+		"""Checks the new lines of the err file and the QE output (see qemonitor.Monitor) and returns false when err happens; returns true if no err messages. The job is deleted by 'qdel' if the monitor policy says abort. final: the job has ended, so a last line without a newline counts too."""
+		if not os.path.isfile(self._path(self._err())):
+			print(f"No '{self._err()}' file.\nBATCH STOPPED")
 			return False
-		else:
-			errfile = open("err", "r").read()
-			if errfile != "":
-				print("Process {} failed.\nBATCH STOPPED".format(self.jobname))
-				print("errfile:\n{}".format(errfile))
-				return False
-			else:
-				return True
+		monitor = self._get_monitor(); reason = monitor.check(final)
+		if not reason: return True
+		if not monitor.abort:
+			print("\nWarning, {}: {}".format(self.jobname, reason)); return True
+		print("\nProcess {} failed: {}\nBATCH STOPPED".format(self.jobname, reason))
+		self.delete(); return False
 
 	def run(self):
 		"""Runs all the processes for the job. Returns false when things get wrong in any process. Returns True when all processes finish successfully.
-		Please refer to the functions stated above.
+		Please refer to the functions stated above. With a journal, a finished job (last state "done"; see Journal.invalidate) is skipped and a submitted job is reattached instead of submitted again.
 		"""
-		self.preprocess()
-		if not self._check_and_modify(): return False
-		self.submit()
-		if not self.wait(): return False
-		self.postprocess()
+		record = self._last_record(); attached = False
+		self._mark("ready"); metrics.parents(self.key, [parent.key for parent in self.parents])
+		if record and record["state"] == "done":
+			print(f"Job {self.jobname} already done; skipped."); return True
+		if record and record["state"] in ["submitted", "running"] and record["jobid"]:
+			attached = self._reattach(record)
+			if attached == "done":
+				self._log("done", "finished while the batch was not running"); self.postprocess(); return True
+		if not attached:
+			self.preprocess(); self._log("preprocessed"); self._mark("preprocessed")
+			if not self._check_and_submit():
+				self._log("failed", "cannot be submitted"); self._mark("failed"); return False
+		self._log("running")
+		try:
+			if not self.wait():
+				self._log("failed", self.monitor.reason if self.monitor else ""); self._mark("failed"); return False
+		finally:
+			self.release()
+		self._log("done")
+		self.postprocess(); self._mark("postprocessed")
 		return True
 
+class Bundle(Job):
+	"""Runs many small jobs inside one submitted allocation on a single node (the tasks are started on the mother node). Each task (a Job) is run in its own workdir by the body of its jobscript, at most max_cores cores at a time; its stderr goes to its own 'err' and the exit code of its QE program to '.<jobname>.status'. After the allocation ends, the status of each task is reported back to it. Without workdir, the bundle jobscript is written into a temporary directory which is removed after the run."""
+	def __init__(self, tasks: list, max_cores: int=16, runtime: int=10, workdir: str=None, backend=None):
+		self.tasks = tasks
+		self.tempdir = None if workdir else tempfile.mkdtemp(prefix=".bundle-", dir=tasks[0].workdir)
+		super().__init__("job.sh-bundle", 0, runtime, {}, self._preprocess_tasks, lambda: 0, [], workdir=workdir or self.tempdir, backend=backend or tasks[0].backend)
+		for task in self.tasks: task._grep_job_core()
+		self.ppn = min(max(max_cores, *[task.cores for task in self.tasks]), sum(task.cores for task in self.tasks))
+		self.parallel = max(1, self.ppn // max(task.cores for task in self.tasks)) ## tasks run at the same time
+
+	def _history_key(self):
+		return "bundle", "bundle", self.cores
+
+	def select_node(self, ppn, core_container_list):
+		"""Selects a single node with at least ppn free cores (the tightest fit), since all the tasks run on the mother node. Returns false if there is none."""
+		fits = [[name, remain] for name, remain in core_container_list if remain >= ppn]
+		return [[min(fits, key=lambda s: s[1])[0], ppn]] if fits else False
+
+	@staticmethod
+	def _body(task):
+		"""Gets the commands of a jobscript (after 'cd $PBS_O_WORKDIR', or all the lines that are not comments)."""
+		fin = open(task._path(task.jobname), "r"); file = fin.read(); fin.close()
+		match = re.search(r"cd\s+\$PBS_O_WORKDIR\s*\n(.*)", file, re.S)
+		if match: return match.group(1)
+		return "\n".join([line for line in file.split("\n") if not line.startswith("#")])
+
+	def _task_script(self, task):
+		"""The script of a task: its body in its workdir, stderr appended to its err file, and the exit code of its program lines ('... pw.x <in> out'; the last line of the body if there is none) written into '.<jobname>.status'. The exit code of the whole body would be that of its last line, e.g. 'echo "Job Ended at `date`"'."""
+		body, marked = re.subn(r"^(.*\w+\.x[^<\n]*<\s*\S+\s*>\s*\S+.*)$", r"\1 || status=$?", self._body(task).rstrip("\n"), flags=re.M)
+		return f"cd '{os.path.abspath(task.workdir)}'\nNPROCS={task.cores}\nstatus=0\n{{\n{body}\n}} 2>> {task._err()}\n" + ("" if marked else "status=$?\n") + f"echo $status > .{task.jobname}.status\n"
+
+	def _preprocess_tasks(self):
+		"""Preprocesses the tasks and writes the task scripts and the bundle jobscript."""
+		lines = []
+		for i, task in enumerate(self.tasks):
+			task.preprocess(); task._log("preprocessed")
+			status = task._path(f".{task.jobname}.status")
+			if os.path.isfile(status): os.remove(status)
+			taskname = self._path(f"task{i:03d}.sh")
+			fout = open(taskname, "w"); fout.write(self._task_script(task)); fout.close()
+			lines.append(f"#BUNDLE-TASK {os.path.abspath(task.workdir)} {task.jobname}")
+		task_list = "\n".join([f"task{i:03d}.sh" for i in range(len(self.tasks))])
+		node = read_nodes_line(self.tasks[0]._path(self.tasks[0].jobname))
+		fout = open(self._path(self.jobname), "w")
+		fout.write("#!/bin/sh\n#PBS -N bundle\n#PBS -e err\n#PBS -o out\n#PBS -q batch\n")
+		fout.write(f"#PBS -l nodes={node[0][0] if node else 'node01'}:ppn={self.ppn}\n")
+		fout.write("\n".join(lines) + f"\ncd $PBS_O_WORKDIR\nprintf '{task_list}\\n' | xargs -P {self.parallel} -n 1 sh\n"); fout.close()
+		open(self._path("err"), "w").close()
+
+	def task_status(self, task):
+		"""Returns True if the program of the task exited with 0 and, as in Job.wait, its err file and QE output show no failure (see Job.is_err)."""
+		try:
+			fin = open(task._path(f".{task.jobname}.status"), "r"); code = fin.read().strip(); fin.close()
+		except OSError: return False
+		return code == "0" and task.is_err(final=True)
+
+	def run(self):
+		"""Runs the bundle as one job, then reports each task: writes its journal and runs its postprocess if it succeeded. Returns {task: True/False}."""
+		print("Bundling {} into one allocation of {} cores.".format(", ".join([task.jobname for task in self.tasks]), self.ppn))
+		try: Job.run(self)
+		finally:
+			if self.tempdir: shutil.rmtree(self.tempdir, ignore_errors=True)
+		results = {}
+		for task in self.tasks:
+			results[task] = self.task_status(task)
+			if results[task]:
+				task._log("done", f"in bundle {self.jobid}"); task.postprocess()
+				print(f"{task.jobname} ({task.workdir}) success")
+			else:
+				task._log("failed", f"in bundle {self.jobid}"); print(f"{task.jobname} ({task.workdir}) failed")
+		return results
+
 class Batch: # is literally just a list of jobs
 	def __init__(self, jobs: list):
 		self.jobs = jobs if type(jobs) == list else [jobs]
@@ -229,3 +489,156 @@ class Batch: # is literally just a list of jobs
 		for job in self.jobs:
 			if not job.run(): return False
 		return True
+
+class MultiBatch:
+	"""Runs several independent batches at the same time from a thread pool. Jobs inside each batch are still executed in order."""
+	def __init__(self, batches: list, max_workers: int=4):
+		self.batches = batches if type(batches) == list else [batches]
+		self.max_workers = max_workers
+
+	@staticmethod
+	def _run_batch(batch):
+		"""Runs a batch; an exception in one batch is reported and counted as a failure so the other batches keep running."""
+		try:
+			return batch.run()
+		except Exception as e:
+			print(f"Batch failed with {type(e).__name__}: {e}"); return False
+
+	def run(self):
+		"""Runs all the batches and returns the list of their results (True/False) in the same order as self.batches."""
+		with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+			return list(pool.map(self._run_batch, self.batches))
+
+class DagBatch:
+	"""Runs jobs by their dependencies (Job.parents) instead of a fixed order. Each job is submitted as soon as all its parents succeed; the jobs depending on a failed job are skipped."""
+	def __init__(self, jobs: list, max_workers: int=8, bundle_cores: int=0, bundle_max_cores: int=16):
+		self.jobs = jobs if type(jobs) == list else [jobs]
+		self.max_workers = max_workers
+		self.bundle_cores = bundle_cores ## jobs with at most this many cores which become ready together are run in one Bundle; 0 turns it off
+		self.bundle_max_cores = bundle_max_cores ## cores of the allocation of a Bundle
+		self.retry = 60 ## seconds between the checks of the jobs held by _admit()
+		self.rejected = [] ## jobs which _admit() will never start (e.g. larger than the cluster); they fail
+		for job in self.jobs:
+			for parent in job.parents:
+				if parent not in self.jobs: raise ValueError(f"Parent '{parent.jobname}' of '{job.jobname}' is not in the batch.")
+		self._check_cycle()
+
+	def _check_cycle(self):
+		"""Raises ValueError if the dependencies contain a cycle."""
+		state = {} # job -> 1 (visiting) / 2 (checked)
+		def visit(job):
+			if state.get(job) == 1: raise ValueError(f"Cyclic dependency at '{job.jobname}'.")
+			if state.get(job) == 2: return
+			state[job] = 1
+			for parent in job.parents: visit(parent)
+			state[job] = 2
+		for job in self.jobs: visit(job)
+
+	def _bundled(self, ready):
+		"""Chooses the ready jobs to be run in one Bundle: small jobs which are not finished or running according to the journal. Returns [] if fewer than two."""
+		if not self.bundle_cores: return []
+		small = []
+		for job in ready:
+			record = job._last_record()
+			if record and record["state"] in ["done", "submitted", "running"]: continue
+			job._grep_job_core()
+			if job.cores <= self.bundle_cores: small.append(job)
+		return small if len(small) > 1 else []
+
+	def _run_bundle(self, jobs):
+		"""Runs a Bundle of jobs on at most bundle_max_cores cores; an exception counts as a failure of all of them."""
+		try:
+			return Bundle(jobs, max_cores=self.bundle_max_cores).run()
+		except Exception as e:
+			print(f"Bundle failed with {type(e).__name__}: {e}"); return {job: False for job in jobs}
+
+	def _admit(self, queue):
+		"""Returns the jobs of queue (ready jobs, in order) to be started now; the others wait, except those added to self.rejected, which fail. All of them by default."""
+		return list(queue)
+
+	def _report(self, status):
+		"""Called after jobs are started or finished; status: {job: None/"ready"/"running"/True/False}."""
+		pass
+
+	def run(self):
+		"""Runs all the jobs. Returns false when any job fails (or is skipped because of a failed parent)."""
+		status = {job: None for job in self.jobs} # None: waiting, "ready": waiting for _admit(), "running", True: success, False: failed/skipped
+		self.running = {} ## {future: [jobs]}
+		queue = []
+		with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+			while True:
+				changed = True
+				while changed: # repeat so that skipping propagates through the whole graph
+					changed = False
+					for job in self.jobs:
+						if status[job] is not None: continue
+						if any(status[parent] is False for parent in job.parents):
+							print(f"Job {job.jobname} skipped since its parent failed."); status[job] = False; changed = True
+						elif all(status[parent] is True for parent in job.parents):
+							status[job] = "ready"; queue.append(job)
+				ready = self._admit(queue)
+				rejected = [job for job in queue if job in self.rejected]
+				for job in rejected: status[job] = False
+				queue = [job for job in queue if job not in ready and job not in rejected]
+				for job in ready: status[job] = "running"
+				small = self._bundled(ready)
+				ready = [job for job in ready if job not in small]
+				if len(ready) > 1: Job.place_pending(ready) # jobs released together are placed together
+				for job in ready: self.running[pool.submit(MultiBatch._run_batch, job)] = [job]
+				if small: self.running[pool.submit(self._run_bundle, small)] = small
+				if ready or small: self._report(status)
+				if not self.running and not queue:
+					if rejected: continue # skip the children of the rejected jobs first
+					break
+				if not self.running: # nothing admitted; wait for free cores
+					self.jobs[0].backend.sleep(self.retry); continue
+				done, _ = wait(self.running, timeout=self.retry / self.jobs[0].backend.speedup if queue else None, return_when=FIRST_COMPLETED)
+				for future in done:
+					jobs = self.running.pop(future); result = future.result()
+					for job in jobs: status[job] = bool(result[job]) if type(result) == dict else bool(result)
+				if done: self._report(status)
+		return all(status[job] is True for job in self.jobs)
+
+class Campaign(DagBatch):
+	"""Runs the job graphs of many directories (job.workdir) as one DagBatch under a global budget: at most max_cores cores and max_jobs jobs at a time (0: no limit), and never more cores than the cluster has free (a job needing more cores than the whole cluster fails at once). Ready jobs are admitted by fair share, i.e. first from the directory using the fewest cores. The progress of every directory is printed in one table."""
+	def __init__(self, jobs: list, max_cores: int=0, max_jobs: int=0, max_workers: int=64, bundle_cores: int=0, bundle_max_cores: int=16, retry: float=60):
+		super().__init__(jobs, max_workers=max_workers, bundle_cores=bundle_cores, bundle_max_cores=min(bundle_max_cores, max_cores) if max_cores else bundle_max_cores)
+		self.max_cores = max_cores
+		self.max_jobs = max_jobs
+		self.retry = retry ## seconds between the checks of the budget while ready jobs wait
+		self.workdirs = list(dict.fromkeys(job.workdir for job in self.jobs))
+
+	def _cores(self, job):
+		"""The cores of the job from its jobscript; no cores if it is already finished or running according to the journal."""
+		record = job._last_record()
+		if record and record["state"] in ["done", "submitted", "running"]: return 0
+		job._grep_job_core(); return max(1, job.cores)
+
+	def _admit(self, queue):
+		used = {workdir: 0 for workdir in self.workdirs}; count = 0
+		for jobs in self.running.values():
+			for job in jobs: used[job.workdir] += job.cores
+			count += 1
+		total = sum(used.values())
+		nodesdict = self.jobs[0]._get_nodesdict() if queue else {}
+		free = sum(nodesdict[name]["remain"] for name in nodesdict)
+		capacity = sum(nodesdict[name]["total"] for name in nodesdict) # down nodes included; they may come back
+		admitted = []
+		for job in sorted(queue, key=lambda job: used[job.workdir]): # fair share; stable, so the order of each directory is kept
+			cores = self._cores(job)
+			if cores > capacity:
+				print(f"Job {job.jobname} ({job.workdir}) needs {cores} cores but the cluster has only {capacity}; failed."); self.rejected.append(job); continue
+			if cores and self.max_jobs and count >= self.max_jobs: continue
+			if cores > free: continue # the cluster is full; wait instead of letting the job give up
+			if cores and self.max_cores and total + cores > self.max_cores and (self.running or admitted): continue # a job larger than the budget still runs alone
+			admitted.append(job); used[job.workdir] += cores; total += cores; free -= cores; count += 1 if cores else 0
+		return admitted
+
+	def _report(self, status):
+		"""Prints the progress of each directory: done, failed, running, ready, waiting, and the cores in use."""
+		print("{:<32}{:>6}{:>8}{:>9}{:>7}{:>9}{:>7}".format("directory", "done", "failed", "running", "ready", "waiting", "cores"))
+		for workdir in self.workdirs:
+			jobs = [job for job in self.jobs if job.workdir == workdir]
+			states = [status[job] for job in jobs]
+			cores = sum(job.cores for future_jobs in self.running.values() for job in future_jobs if job.workdir == workdir)
+			print("{:<32}{:>6}{:>8}{:>9}{:>7}{:>9}{:>7}".format(workdir[-32:], states.count(True), states.count(False), states.count("running"), states.count("ready"), states.count(None), cores))
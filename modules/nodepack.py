@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module places the cores of several pending jobs on the nodes of the cluster at once. It tries to put every job on as few nodes as possible and to leave as few partly-used nodes as possible.
+Usage:
+
+from nodepack import place_jobs, node_str
+
+1. Prepare the cores of the pending jobs and the remaining cores of the nodes:
+	jobs = {"job.sh-ph": 24, "job.sh-nscf": 8, "job.sh-dos": 1}
+	free = {"node01": 8, "node02": 16, "node05": 16}
+
+2. placement = place_jobs(jobs, free)
+	placement["job.sh-ph"] -> [["node02", 16], ["node01", 8]]; False if the job cannot be placed now.
+	node_str(placement["job.sh-ph"]) -> "node02:ppn=16+node01:ppn=8", the string after '#PBS -l nodes='.
+
+3. Jobs are placed by best-fit-decreasing (the better of it and the one-job greedy policy is kept). When the cluster has only a few free nodes and jobs (<= exact_limit), a small exhaustive search is used instead.
+
+4. Type 'python nodepack.py' to benchmark the placement against the greedy one-job-at-a-time policy on synthetic cluster states.
+"""
+from itertools import combinations
+import random, time
+
+def node_str(select_node_list):
+	"""Joins [[node_name, cores], ...] into the '#PBS -l nodes=' string."""
+	return "+".join(["{}:ppn={}".format(node, cores) for node, cores in select_node_list])
+
+def greedy(ppn, free):
+	"""The original one-job policy of Job.select_node: the smallest node that fits the rest of the job, otherwise all of the largest node. Returns [[node_name, cores], ...] or False. free is not modified."""
+	core_current_list = sorted([[name, free[name]] for name in free if free[name] > 0], key=lambda s: s[1])
+	ppn_left = ppn; select_node_list = []
+	while ppn_left > 0:
+		if core_current_list == []: return False
+		for i in range(len(core_current_list)):
+			if ppn_left <= core_current_list[i][1]:
+				select_node_list.append([core_current_list[i][0], ppn_left]); ppn_left = 0; break
+		else:
+			name, volume = core_current_list.pop(-1)
+			select_node_list.append([name, volume]); ppn_left -= volume
+	return select_node_list
+
+def _best_fit(ppn, free):
+	"""Places one job on the fewest nodes: the smallest node that fits the whole job; otherwise the largest nodes, with the last part on the smallest node that fits it. Returns [[node_name, cores], ...] or False."""
+	nodes = sorted([name for name in free if free[name] > 0], key=lambda name: (free[name], name))
+	if sum(free[name] for name in nodes) < ppn: return False
+	select_node_list = []; ppn_left = ppn
+	while ppn_left > 0:
+		fit = [name for name in nodes if free[name] >= ppn_left]
+		name = fit[0] if fit else nodes[-1]
+		cores = min(ppn_left, free[name])
+		select_node_list.append([name, cores]); ppn_left -= cores; nodes.remove(name)
+	return select_node_list
+
+def _splits(ppn, free):
+	"""All placements of one job on minimal sets of nodes (removing any node of the set would not fit the job). The last node of each set takes the rest of the job."""
+	nodes = [name for name in free if free[name] > 0]
+	for k in range(1, len(nodes)+1):
+		for subset in combinations(nodes, k):
+			total = sum(free[name] for name in subset)
+			if total < ppn or total - min(free[name] for name in subset) >= ppn: continue
+			subset = sorted(subset, key=lambda name: -free[name])
+			for last in set(subset):
+				rest = [name for name in subset if name != last]
+				select_node_list = [[name, free[name]] for name in rest]
+				select_node_list.append([last, ppn - sum(free[name] for name in rest)])
+				yield select_node_list
+
+def cost(placement, free):
+	"""Scores a placement as (unplaced jobs, node spanning, fragments); smaller is better. Node spanning counts the extra nodes used by split jobs; fragments are the used nodes which still have cores left."""
+	unplaced = sum(1 for nodes in placement.values() if not nodes)
+	spanning = sum(len(nodes) - 1 for nodes in placement.values() if nodes)
+	left = dict(free); used = set()
+	for nodes in placement.values():
+		for name, cores in (nodes or []):
+			left[name] -= cores; used.add(name)
+	fragments = sum(1 for name in used if left[name] > 0)
+	return unplaced, spanning, fragments
+
+def _exact(order, jobs, free):
+	"""Branch-and-bound over the minimal placements of each job in order. Returns the placement with the smallest cost()."""
+	best = {"cost": None, "placement": None}
+	def search(i, left, placement):
+		partial = cost(placement, free)
+		if best["cost"] is not None and partial[:2] > best["cost"][:2]: return
+		if i == len(order):
+			if best["cost"] is None or partial < best["cost"]:
+				best["cost"] = partial; best["placement"] = dict(placement)
+			return
+		job = order[i]; options = list(_splits(jobs[job], left)) + [False]
+		for nodes in options:
+			new_left = dict(left)
+			for name, cores in (nodes or []): new_left[name] -= cores
+			placement[job] = nodes
+			search(i+1, new_left, placement)
+		del placement[job]
+	search(0, dict(free), {})
+	return best["placement"]
+
+def place_jobs(jobs: dict, free: dict, exact_limit: int=6):
+	"""Places all the pending jobs together.
+	jobs: dict, {jobname: cores needed}
+	free: dict, {node_name: remaining cores}
+	exact_limit: int, uses the exhaustive search when the number of free nodes and jobs are both <= exact_limit.
+	Returns {jobname: [[node_name, cores], ...] or False}.
+	"""
+	order = sorted(jobs, key=lambda job: -jobs[job]) # decreasing
+	if len([name for name in free if free[name] > 0]) <= exact_limit and len(jobs) <= exact_limit:
+		return _exact(order, jobs, free)
+	## best-fit-decreasing fills the nodes tightly but may leave small jobs out, so the increasing order and the original policy are also tried
+	candidates = [_place_in_order(order, jobs, free, _best_fit), _place_in_order(order[::-1], jobs, free, _best_fit), _place_in_order(list(jobs), jobs, free, greedy)]
+	return min(candidates, key=lambda placement: cost(placement, free))
+
+def _place_in_order(order, jobs, free, policy):
+	"""Places the jobs one by one in order with a one-job policy (_best_fit or greedy)."""
+	left = dict(free); placement = {}
+	for job in order:
+		nodes = policy(jobs[job], left)
+		for name, cores in (nodes or []): left[name] -= cores
+		placement[job] = nodes
+	return placement
+
+def benchmark(n_states: int=200, n_nodes: int=12, seed: int=0):
+	"""Compares greedy and place_jobs on random cluster states (nodes of 8/16/32 cores, partly used) and pending jobs (1 to 32 cores). Prints the average cost and time of each policy."""
+	rng = random.Random(seed)
+	states = []
+	for _ in range(n_states):
+		free = {}
+		for i in range(n_nodes):
+			total = rng.choice([8, 16, 32])
+			free[f"node{i+1:02d}"] = rng.choice([0, total, rng.randint(0, total)])
+		jobs = {f"job{j}": rng.choice([1, 1, 4, 8, 12, 16, 24, 32]) for j in range(rng.randint(2, 8))}
+		states.append((jobs, free))
+	for label, policy in [("greedy", lambda jobs, free: _place_in_order(list(jobs), jobs, free, greedy)), ("nodepack", place_jobs)]:
+		total = [0, 0, 0]; start = time.perf_counter()
+		for jobs, free in states:
+			total = [a + b for a, b in zip(total, cost(policy(jobs, free), free))]
+		elapsed = time.perf_counter() - start
+		print("{:>8}: unplaced {:6.3f}, node spanning {:6.3f}, fragments {:6.3f} (per state); {:8.3f} ms per state".format(label, *[t/n_states for t in total], elapsed/n_states*1000))
+
+if __name__ == "__main__":
+	for n_nodes in [4, 12, 48]:
+		print(f"--- {n_nodes} nodes ---")
+		benchmark(n_nodes=n_nodes)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module parses the output of 'pbsnodes -a' (Torque) into node records in a single pass, and keeps a short-lived snapshot of it, so that the jobs polled in the same cycle share one call of 'pbsnodes -a'.
+Usage:
+
+from pbsnodes import parse, Snapshot
+
+1. nodes = parse(nodes_info_str) # {node_name: Node}, nodes_info_str: the outcome string of 'pbsnodes -a'
+2. nodes["node05"].np, .used, .free, .jobids, .state, .properties, .down
+3. nodesdict = {name: node.to_dict() for name, node in nodes.items()} # the nodesdict of jobop and multibatch: {"total", "remain" (free cores or "--" if down), "users" (jobids)}
+4. S = Snapshot(ttl=5); S.nodes() # runs 'pbsnodes -a' at most once every ttl seconds; S.invalidate() after qsub/qdel
+5. Type 'python pbsnodes.py [dump files]' to compare the speed with the old regex parser on captured (or synthetic) 'pbsnodes -a' dumps; "differ" counts the nodes where the old parser missed the last job.
+"""
+from threading import Lock
+import subprocess as sub
+import time
+
+down_states = ("down", "offline", "unknown")
+
+class Node:
+	"""A node of 'pbsnodes -a'."""
+	__slots__ = ("name", "state", "np", "used", "jobids", "properties")
+	def __init__(self, name: str):
+		self.name = name
+		self.state = []      ## e.g. ["free"], ["job-exclusive"], ["down", "offline"]
+		self.np = 0          ## total cores
+		self.used = 0        ## cores taken by jobs
+		self.jobids = set()  ## {"12345", ...}, without the server name
+		self.properties = [] ## e.g. ["bread"]
+
+	@property
+	def down(self) -> bool:
+		return any(state in down_states for state in self.state)
+
+	@property
+	def free(self) -> int:
+		return max(0, self.np - self.used)
+
+	def to_dict(self):
+		"""Returns the nodesdict entry: {"total": cores, "remain": free cores or "--" (down), "users": set of jobids}."""
+		return {"total": self.np, "remain": "--" if self.down else self.free, "users": set(self.jobids)}
+
+	def __repr__(self):
+		return f"Node({self.name}, {','.join(self.state)}, {self.used}/{self.np}, jobs={sorted(self.jobids)})"
+
+def _add_jobs(node, value):
+	"""Reads 'jobs = 0/123.server, 1-3/124.server'; each core (or range of cores) is one entry."""
+	entries = value.split(",")
+	if "-" not in value: # one core per entry (the common case)
+		node.used += len(entries)
+		node.jobids.update(entry.partition("/")[2].partition(".")[0] for entry in entries)
+		return
+	for entry in entries:
+		cores, slash, jobid = entry.strip().partition("/")
+		if not slash: continue
+		for part in cores.split("+"): # 'a-b' is a range of cores
+			first, dash, last = part.partition("-")
+			node.used += int(last) - int(first) + 1 if dash and first.isdigit() and last.isdigit() else 1
+		node.jobids.add(jobid.split(".", 1)[0])
+
+def parse(nodes_info_str: str):
+	"""Returns {node_name: Node} from the outcome string of 'pbsnodes -a'."""
+	nodes = {}; node = None
+	for line in nodes_info_str.splitlines():
+		if not line.strip(): continue
+		if not line[0].isspace(): # the name of a node starts a record
+			node = nodes[line.strip()] = Node(line.strip()); continue
+		if node is None: continue
+		key, sep, value = line.partition("=")
+		if not sep: continue
+		key = key.strip(); value = value.strip()
+		if key == "state": node.state = value.split(",")
+		elif key == "np": node.np = int(value)
+		elif key == "jobs": _add_jobs(node, value)
+		elif key == "properties": node.properties = value.split(",") if value else []
+	return nodes
+
+def _run(command):
+	return sub.check_output(command, shell=True).decode("utf-8")
+
+class Snapshot:
+	"""The nodes of 'pbsnodes -a', refreshed at most once every ttl seconds. Thread-safe: concurrent callers wait for the same call."""
+	def __init__(self, command: str="pbsnodes -a", ttl: float=5.0, run=_run):
+		self.command = command
+		self.ttl = ttl
+		self.run = run ## run(command) -> the outcome string
+		self.lock = Lock()
+		self.time = None
+		self.cache = {}
+
+	def nodes(self):
+		"""Returns {node_name: Node}; do not modify the records."""
+		with self.lock:
+			if self.time is None or time.monotonic() - self.time > self.ttl:
+				self.cache = parse(self.run(self.command)); self.time = time.monotonic()
+			return self.cache
+
+	def nodesdict(self):
+		"""Returns a new nodesdict, which the caller may modify."""
+		return {name: node.to_dict() for name, node in self.nodes().items()}
+
+	def invalidate(self):
+		"""Makes the next call run 'pbsnodes -a' again."""
+		with self.lock: self.time = None
+
+def _old_parse(nodes_info_str):
+	"""The regex parser used before, for the benchmark."""
+	import re
+	nodeslist = re.findall(r"node\d+.*\n(?:     \w+\s*=\s*.*\n)*", nodes_info_str)
+	nodesdict = {}
+	for node in nodeslist:
+		name = re.match(r"(node\d+).*", node).group(1)
+		total = int(re.search(r"np = (\d+)", node).group(1))
+		search = re.search(r"     jobs = (.*)", node)
+		if not search: remain = total; users = set()
+		else:
+			remain = total - (search.group(1).count(",") + 1)
+			users = set(re.findall(r"\d+/(\d+).*?[,$]", search.group(0)))
+		if re.search(r"state\s*=\s*down", node): remain = "--"
+		nodesdict[name] = {"total": total, "remain": remain, "users": users}
+	return nodesdict
+
+def synthetic_dump(n_nodes: int=2000, np: int=32, seed: int=0):
+	"""Returns a 'pbsnodes -a' dump of n_nodes nodes with random jobs and states."""
+	import random
+	rng = random.Random(seed); lines = []; jobid = 100000
+	for i in range(n_nodes):
+		state = rng.choice(["free", "free", "job-exclusive", "down", "down,offline"])
+		cores = [] if state.startswith("down") else list(range(rng.randint(0, np)))
+		jobs = []
+		while cores:
+			take = cores[:rng.randint(1, 16)]; cores = cores[len(take):]; jobid += 1
+			jobs += [f"{core}/{jobid}.breadserver" for core in take]
+		lines += [f"node{i+1:02d}", f"     state = {state}", "     power_state = Running", f"     np = {np}", "     properties = bread", "     ntype = cluster"]
+		lines += [f"     jobs = {', '.join(jobs)}"] if jobs else []
+		lines += [f"     status = rectime=1700000000,jobs={' '.join(sorted(set(j.split('/')[1] for j in jobs)))},state=free,netload=1", "     mom_service_port = 15002", "     mom_manager_port = 15003", ""]
+	return "\n".join(lines) + "\n"
+
+def benchmark(dumps, repeat: int=5):
+	"""Times the old regex parser and parse() on each dump, and counts the nodes where they disagree."""
+	from timeit import timeit
+	print("{:<28}{:>7}{:>12}{:>12}{:>10}".format("dump", "nodes", "old (ms)", "new (ms)", "differ"))
+	for name, text in dumps:
+		old = timeit(lambda: _old_parse(text), number=repeat) / repeat * 1000
+		new = timeit(lambda: parse(text), number=repeat) / repeat * 1000
+		old_dict = _old_parse(text); new_dict = {name: node.to_dict() for name, node in parse(text).items()}
+		differ = sum(old_dict.get(node) != new_dict[node] for node in new_dict)
+		print("{:<28}{:>7}{:>12.2f}{:>12.2f}{:>10}".format(name[-28:], len(new_dict), old, new, differ))
+
+if __name__ == "__main__":
+	import sys
+	if len(sys.argv) > 1:
+		dumps = [(filename, open(filename, "r").read()) for filename in sys.argv[1:]]
+	else:
+		dumps = [(f"synthetic {n} nodes", synthetic_dump(n)) for n in [12, 200, 2000, 20000]]
+	benchmark(dumps)
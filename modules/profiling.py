@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module records, on demand, the wall time of the stages of a program (parse, transform, write, subprocess, sleep) and optionally a cProfile and tracemalloc capture, into a JSON file. Nothing is recorded or patched unless the environment variable PYF_PROFILE is set, so span() costs one function call when disabled.
+Usage:
+
+from profiling import span
+
+1. with span("parse"): ... # a stage; a span inside another is recorded as "parse/read"
+2. PYF_PROFILE=prof.json python normbandos.py (or 'pyf.py --profile prof.json normbandos') writes prof.json at exit: {"program", "argv", "wall", "spans": {"parse": {"count", "seconds", "max_seconds"}, ...}}
+3. PYF_PROFILE_CPROFILE=1 also writes 'prof.json.prof' of the main thread ('python -m pstats prof.json.prof'); PYF_PROFILE_MEMORY=1 adds {"memory": {"current", "peak", "top"}} from tracemalloc (slower).
+4. A program started by the profiled one writes 'prof.json.<pid>'.
+5. When enabled, subprocess.run/call/check_call/check_output, os.system and time.sleep are recorded as the "subprocess" and "sleep" spans of every program, without changing the program. Names bound before this module is imported (e.g. 'from time import sleep') are not patched.
+"""
+from threading import Lock, local
+from contextlib import contextmanager, nullcontext
+import os, sys, time, json, atexit
+
+_null = nullcontext()
+
+class Profile:
+	def __init__(self, filename: str, cprofile: bool=False, memory: bool=False):
+		self.filename = filename
+		self.lock = Lock()
+		self.local = local() ## the stack of open spans of each thread
+		self.spans = {} ## {"parse/read": [count, seconds, max seconds]}
+		self.start = time.perf_counter()
+		self.memory = memory
+		self.profiler = None
+		if memory:
+			import tracemalloc; tracemalloc.start()
+		if cprofile:
+			import cProfile; self.profiler = cProfile.Profile(); self.profiler.enable()
+
+	@contextmanager
+	def span(self, name: str):
+		"""Records the wall time of the block as name (below the spans open in this thread)."""
+		stack = self.local.__dict__.setdefault("stack", [])
+		stack.append(name); key = "/".join(stack); start = time.perf_counter()
+		try: yield
+		finally:
+			elapsed = time.perf_counter() - start; stack.pop()
+			with self.lock:
+				record = self.spans.setdefault(key, [0, 0.0, 0.0])
+				record[0] += 1; record[1] += elapsed; record[2] = max(record[2], elapsed)
+
+	def _wrap(self, name, function):
+		"""Returns function recorded as the span name; a call inside the same span (e.g. check_output -> run) is not recorded twice."""
+		def wrapper(*args, **kwargs):
+			stack = self.local.__dict__.get("stack")
+			if stack and stack[-1] == name: return function(*args, **kwargs)
+			with self.span(name): return function(*args, **kwargs)
+		wrapper.__wrapped__ = function
+		return wrapper
+
+	def patch(self):
+		"""Records the calls of subprocess, os.system and time.sleep."""
+		import subprocess
+		for attr in ["run", "call", "check_call", "check_output"]:
+			setattr(subprocess, attr, self._wrap("subprocess", getattr(subprocess, attr)))
+		os.system = self._wrap("subprocess", os.system)
+		time.sleep = self._wrap("sleep", time.sleep)
+
+	def summary(self):
+		"""Returns the profile as a dict (for JSON)."""
+		with self.lock:
+			summary = {"program": os.path.basename(sys.argv[0]), "argv": sys.argv[1:], "pid": os.getpid(), "wall": time.perf_counter() - self.start,
+				"spans": {key: {"count": c[0], "seconds": c[1], "max_seconds": c[2]} for key, c in sorted(self.spans.items())}}
+		if self.memory:
+			import tracemalloc
+			current, peak = tracemalloc.get_traced_memory()
+			top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+			summary["memory"] = {"current": current, "peak": peak, "top": [{"line": str(stat.traceback), "bytes": stat.size, "count": stat.count} for stat in top]}
+		if self.profiler: summary["cprofile"] = self.filename + ".prof"
+		return summary
+
+	def write(self):
+		"""Writes the JSON file (and the cProfile stats)."""
+		if self.profiler:
+			self.profiler.disable(); self.profiler.dump_stats(self.filename + ".prof")
+		fout = open(self.filename, "w"); json.dump(self.summary(), fout, indent=1); fout.close()
+
+def enable(filename: str, cprofile: bool=False, memory: bool=False):
+	"""Starts profiling into filename (also done at import if PYF_PROFILE is set); the file is written at exit."""
+	global profile
+	if profile: return profile
+	profile = Profile(filename, cprofile, memory); profile.patch()
+	atexit.register(profile.write)
+	return profile
+
+def span(name: str):
+	"""A context manager recording the block as the stage name; does nothing unless profiling is enabled."""
+	return profile.span(name) if profile else _null
+
+profile = None
+if os.environ.get("PYF_PROFILE"):
+	filename = os.environ["PYF_PROFILE"]
+	if os.environ.setdefault("PYF_PROFILE_PID", str(os.getpid())) != str(os.getpid()): filename += f".{os.getpid()}" # a program started by the profiled one (e.g. modparam.py by workparam.py)
+	enable(filename, os.environ.get("PYF_PROFILE_CPROFILE", "") not in ["", "0"], os.environ.get("PYF_PROFILE_MEMORY", "") not in ["", "0"])
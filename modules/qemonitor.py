@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module watches the 'err' file and the Quantum Espresso output of a running job. The files are read incrementally from the last byte offset, so each check only costs the new lines.
+Usage:
+
+from qemonitor import Monitor
+
+1. M = Monitor(["err", "H3S.scf.out"], err_files=["err"])
+2. reason = M.check() # "" if nothing bad happens; otherwise the reason why the job should be stopped. M.check(final=True) when the job has ended also checks the last lines without a newline.
+3. Policy (keyword arguments of Monitor):
+	abort: bool, whether a detected failure should stop the job (multibatch kills it by 'qdel'); if False, the reason is only reported once.
+	patterns: list of regex, failure messages in the outputs; default: fatal_patterns.
+	scf_patience: int, stops the job when the scf accuracy (pw.x) or |ddv_scf|^2 (ph.x) is not lower than its best value for this many iterations; 0 turns it off.
+"""
+import re, os
+
+fatal_patterns = [r"convergence NOT achieved", r"No convergence has been achieved", r"Error in routine"]
+accuracy_pattern = re.compile(r"(?:estimated scf accuracy\s*<|\|ddv_scf\|\^2\s*=)\s*([\d.]+(?:[EeDd][+\-]?\d+)?)")
+cycle_pattern = re.compile(r"Self-consistent Calculation|Representation #\s*\d+|Calculation of q\s*=") # a new scf cycle starts
+
+class Tail:
+	"""Reads the lines appended to a file since the last call."""
+	def __init__(self, filename: str):
+		self.filename = filename
+		self.offset = 0
+		self.partial = b"" ## the last line which is not finished yet
+
+	def read(self):
+		"""Returns the list of new complete lines. Starts over if the file was truncated (e.g. the err file is cleared)."""
+		try: size = os.path.getsize(self.filename)
+		except OSError: return []
+		if size < self.offset: self.offset = 0; self.partial = b""
+		if size == self.offset: return []
+		with open(self.filename, "rb") as fin:
+			fin.seek(self.offset); chunk = fin.read(size - self.offset)
+		self.offset += len(chunk)
+		lines = (self.partial + chunk).split(b"\n")
+		self.partial = lines.pop(-1)
+		return [line.decode("utf-8", "replace") for line in lines]
+
+	def flush(self):
+		"""Returns the last line without a newline (as a list of at most one line) and forgets it; for when the file will not grow any more."""
+		line = self.partial; self.partial = b""
+		return [line.decode("utf-8", "replace")] if line else []
+
+class Monitor:
+	def __init__(self, files: list, err_files: list=["err"], abort: bool=True, patterns: list=fatal_patterns, scf_patience: int=20):
+		self.tails = {f: Tail(f) for f in files}
+		self.err_files = err_files ## any output in these files is a failure
+		self.abort = abort
+		self.patterns = [re.compile(p) for p in patterns]
+		self.scf_patience = scf_patience
+		self.best_accuracy = None; self.stalled = 0
+		self.reason = ""
+
+	def _check_accuracy(self, line):
+		"""Counts the scf iterations whose accuracy is not better than the best one of the current cycle."""
+		if cycle_pattern.search(line): self.best_accuracy = None; self.stalled = 0; return ""
+		match = accuracy_pattern.search(line)
+		if not match or not self.scf_patience: return ""
+		accuracy = float(re.sub(r"[Dd]", "E", match.group(1)))
+		if self.best_accuracy is None or accuracy < self.best_accuracy:
+			self.best_accuracy = accuracy; self.stalled = 0
+		else: self.stalled += 1
+		if self.stalled >= self.scf_patience:
+			return f"scf accuracy has not decreased for {self.stalled} iterations (best: {self.best_accuracy:.3e})"
+		return ""
+
+	def check(self, final: bool=False):
+		"""Reads the new lines of all the files and returns the reason of failure ("" if none). A reason is returned only once when abort is False. final: the job has ended, so the last lines without a newline are checked too."""
+		if self.reason: return self.reason if self.abort else ""
+		for filename, tail in self.tails.items():
+			for line in tail.read() + (tail.flush() if final else []):
+				if filename in self.err_files and line.strip():
+					self.reason = f"'{os.path.basename(filename)}': {line.strip()}"
+				for pattern in self.patterns:
+					if pattern.search(line): self.reason = f"'{os.path.basename(filename)}': {line.strip()}"
+				self.reason = self.reason or self._check_accuracy(line)
+				if self.reason: return self.reason
+		return ""
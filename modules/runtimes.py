@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module records the actual runtimes of finished jobs and predicts the runtimes of new ones, so that multibatch polls a job around its expected end instead of every fixed 'runtime'.
+Usage:
+
+from runtimes import RuntimeHistory, next_poll
+
+1. H = RuntimeHistory() # records are kept in '~/.multibatch_runtimes.json'
+2. H.record("scf", "H3S", 16, 532.0) # job type, material, cores, seconds
+3. eta = H.predict("scf", "H3S", 32) # seconds, or None if there is no record of this job type
+4. sleep(next_poll(elapsed, eta)) # short polls near the estimated end, longer polls far from it
+"""
+from threading import Lock
+import json, os
+
+history_file = os.path.join(os.path.expanduser("~"), ".multibatch_runtimes.json")
+
+def _median(values):
+	values = sorted(values); n = len(values)
+	return values[n//2] if n % 2 else 0.5 * (values[n//2-1] + values[n//2])
+
+class RuntimeHistory:
+	def __init__(self, filename: str=history_file, keep: int=20):
+		self.filename = filename
+		self.keep = keep ## number of records kept for each (job type, material, cores)
+		self.lock = Lock()
+		try:
+			fin = open(self.filename, "r"); self.records = json.load(fin); fin.close()
+		except (OSError, ValueError):
+			self.records = {} ## {"scf/H3S/16": [532.0, 540.3, ...]}
+
+	def record(self, jobtype: str, material: str, cores: int, seconds: float):
+		"""Adds a runtime and writes the history file."""
+		with self.lock:
+			key = f"{jobtype}/{material}/{cores}"
+			self.records[key] = (self.records.get(key, []) + [round(seconds, 1)])[-self.keep:]
+			tempname = self.filename + ".tmp"; fout = open(tempname, "w"); json.dump(self.records, fout, indent=1); fout.close()
+			os.replace(tempname, self.filename)
+
+	def predict(self, jobtype: str, material: str, cores: int):
+		"""Predicts the runtime (seconds) of a job from the median of the records. Falls back to the same job type and material with other cores (scaled by cores), and then to the same job type of other materials. Returns None if there is no record."""
+		with self.lock:
+			same = self.records.get(f"{jobtype}/{material}/{cores}")
+			if same: return _median(same)
+			for prefix in [f"{jobtype}/{material}/", f"{jobtype}/"]:
+				scaled = []
+				for key, values in self.records.items():
+					if key.startswith(prefix):
+						scaled += [value * int(key.split("/")[-1]) / cores for value in values] # ideal parallel scaling
+				if scaled: return _median(scaled)
+		return None
+
+def next_poll(elapsed: float, eta, min_interval: float=5, max_interval: float=600):
+	"""Returns the seconds until the next poll: half of the time left before eta; after eta (or without eta) a quarter of the time elapsed (or overdue), so the polls back off. Limited to [min_interval, max_interval]."""
+	if eta is None: interval = elapsed / 4
+	elif elapsed < eta: interval = (eta - elapsed) / 2
+	else: interval = (elapsed - eta) / 4
+	return min(max_interval, max(min_interval, interval))
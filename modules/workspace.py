@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+## authors: Tim
+"""This module keeps an index (SQLite) of the calculation directories (those with 'job.sh-*') under the working directories: the location of their 'modparam.py', their atoms, stages and last-known state. The index is updated by directory mtimes, so workparam, hellowork and qebatch look up the tree in milliseconds instead of walking it.
+Usage:
+
+from workspace import Workspace
+
+1. W = Workspace() # the index is kept in '~/.qe_workspace.db'
+2. W.update("/data2/twchang/qe") -> number of calculation directories; only the directories whose mtime changed are listed again, and only the calculations whose job scripts, outputs or '.qebatch.db' changed are read again.
+3. W.calcs(pattern="*/H3S/*", state="done") -> [{"path", "atoms", "stages", "modparam", "state", "done"}, ...] (pattern: glob on the path; state: "new", "partial", "running", "failed" or "done")
+4. W.get("/data2/twchang/qe/H3S/ph") -> the record of one calculation, or None.
+5. W.modparam("/data2/twchang/qe/H3S/ph/tmp") -> the 'modparam.py' in the directory or its nearest parent, from the index (None if not indexed).
+6. Type 'python workspace.py dir' to compare a full update with an incremental one.
+
+The state is read from the journal ('.qebatch.db') and the ends of the QE outputs: "running" if a stage is submitted or running, "failed" if a stage failed, "done" if every stage has 'JOB DONE.', "partial" if some have, and "new" otherwise. An output archived by file_manipulation/archive.py ('H3S.scf.out.gz', '.zst') is read in place of the output.
+"""
+from fnmatch import fnmatch
+import json, os, re, time, gzip
+from journal import Journal
+from dirindex import DirIndex, subtree
+try: import zstandard # pip install zstandard; only to read the '.zst' archives
+except ImportError: zstandard = None
+
+index_file = os.path.join(os.path.expanduser("~"), ".qe_workspace.db")
+prune = ("*.save", "_ph*", ".*") ## dirs which are never searched (QE scratch, hidden dirs)
+mpirun_line = r"(\w+\.x)[^<\n]*<\s*(\S+)\s*>\s*(\S+)" ## '... pw.x <H3S.scf.in> H3S.scf.out' -> program, input, output
+archive_suffixes = (".gz", ".zst", ".tar.gz", ".tar.zst") ## of the files and dirs compressed by file_manipulation/archive.py
+
+def _mtime(path):
+	try: return os.stat(path).st_mtime_ns
+	except OSError: return 0
+
+def archived(path: str):
+	"""Returns path if it exists, otherwise its archive by archive.py ('path.gz', 'path.tar.gz', '.zst'; the mtime of the original is kept), or None."""
+	if os.path.exists(path): return path
+	return next((path + suffix for suffix in archive_suffixes if os.path.exists(path + suffix)), None)
+
+def _tail(filename, size=4096):
+	"""The last size bytes of a file; an archive ('.gz', '.zst') is decompressed in chunks up to its end."""
+	if filename.endswith((".gz", ".zst")):
+		if filename.endswith(".zst") and zstandard is None: return b""
+		fin = gzip.open(filename, "rb") if filename.endswith(".gz") else zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True)
+		tail = b""
+		with fin:
+			for chunk in iter(lambda: fin.read(1 << 20), b""): tail = (tail + chunk)[-size:]
+		return tail
+	with open(filename, "rb") as fin:
+		fin.seek(max(0, os.path.getsize(filename) - size)); return fin.read()
+
+def job_done(filename: str):
+	"""Whether a QE output (or its archive, see archived) ends with 'JOB DONE.' (only the end of the file is read)."""
+	filename = archived(filename)
+	if not filename: return False
+	try: return b"JOB DONE." in _tail(filename)
+	except (OSError, EOFError): return False
+
+def read_stages(path: str, stages: list):
+	"""Returns (atoms, {stage: [program, input, output]}) from the mpirun lines of the job scripts; atoms is the prefix of the first input ('H3S' of 'H3S.scf.in')."""
+	atoms = None; files = {}
+	for stage in stages:
+		try: fin = open(os.path.join(path, stage), "r"); text = fin.read(); fin.close()
+		except OSError: continue
+		match = re.search(mpirun_line, text)
+		if not match: continue
+		files[stage] = list(match.groups()); atoms = atoms or match.group(2).split(".")[0]
+	return atoms, files
+
+def read_state(path: str, stages: list, files: dict):
+	"""Returns (state, number of finished stages) of a calculation."""
+	journal = os.path.join(path, ".qebatch.db"); states = []
+	if os.path.isfile(journal):
+		J = Journal(journal); states = [(J.last(path, stage) or {}).get("state") for stage in stages]
+	done = sum(stage in files and (archived(os.path.join(path, files[stage][2])) is not None if files[stage][0] == "plotband.x" else job_done(os.path.join(path, files[stage][2]))) for stage in stages)
+	if any(state in ["submitted", "running"] for state in states): return "running", done
+	if "failed" in states: return "failed", done
+	return ("done" if done == len(stages) else "partial" if done else "new"), done
+
+class Workspace(DirIndex):
+	"""The calculation directories with their stages and state; see dirindex.DirIndex for the scan."""
+	schema = ["CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER, modparam INTEGER, stages TEXT)",
+		"CREATE TABLE IF NOT EXISTS calcs (path TEXT PRIMARY KEY, atoms TEXT, stages TEXT, files TEXT, modparam TEXT, state TEXT, done INTEGER, stamp INTEGER, updated REAL)",
+		"CREATE INDEX IF NOT EXISTS parent_index ON dirs (parent)"]
+	columns = ("modparam", "stages")
+	tables = ("dirs", "calcs")
+	prune = prune
+	counters = ("listed", "reused", "read") ## also the calculations read again by the last update
+
+	def __init__(self, filename: str=index_file):
+		super().__init__(filename)
+
+	def _context(self, root, full):
+		"""The indexed directories under root (see DirIndex._context) and their calc rows: context["calcs"] = {path: calc row}."""
+		context = super()._context(root, full); where, params = subtree(root)
+		with self.lock, self._connect() as db:
+			calcs = db.execute(f"SELECT path, atoms, stages, files, modparam, state, done, stamp FROM calcs WHERE {where}", params).fetchall()
+		context["calcs"] = {row[0]: row for row in calcs}; return context
+
+	def _summarize(self, path, entries):
+		"""Returns (has modparam.py, [stages]) of a listed directory."""
+		modparam = False; stages = []
+		for entry in entries:
+			try:
+				if entry.name == "modparam.py": modparam = True
+				elif entry.name.startswith("job.sh-") and entry.is_file(): stages.append(entry.name)
+			except OSError: pass
+		return modparam, sorted(stages)
+
+	def _reuse(self, values):
+		return bool(values[0]), json.loads(values[1])
+
+	def _inherit(self, path, info, modparam):
+		"""The 'modparam.py' of path, or of its nearest parent."""
+		return os.path.join(path, "modparam.py") if info[0] else modparam
+
+	def _calc(self, path, stages, modparam, mtime, calcs, full):
+		"""Returns the calc row of path; it is read again only if the directory, a job script, an output or the journal is newer than the last update."""
+		row = calcs.get(path)
+		files = json.loads(row[3]) if row and row[2] == json.dumps(stages) else None
+		stamp = max([mtime, _mtime(os.path.join(path, ".qebatch.db"))] + [_mtime(os.path.join(path, stage)) for stage in stages] + [_mtime(archived(os.path.join(path, f[2])) or path) for f in (files or {}).values()])
+		if not full and row and files is not None and row[7] == stamp and row[4] == modparam: return row
+		self._count("read")
+		atoms, files = read_stages(path, stages)
+		stamp = max([stamp] + [_mtime(archived(os.path.join(path, f[2])) or path) for f in files.values()])
+		state, done = read_state(path, stages, files)
+		return (path, atoms, json.dumps(stages), json.dumps(files), modparam, state, done, stamp)
+
+	def _row(self, path, parent, mtime, info, modparam, results, context, out):
+		"""Appends the row of path to out["dirs"], and its calc row (see _calc) to out["calcs"] if it has stages."""
+		has_modparam, stages = info
+		out["dirs"].append((path, parent, mtime, int(has_modparam), json.dumps(stages)))
+		if stages: out["calcs"].append(self._calc(path, stages, modparam, mtime, context["calcs"], context["full"]))
+
+	def update(self, root: str, full: bool=False, workers: int=16):
+		"""Updates the index of root and returns the number of calculation directories under it. The sub-directories of root are scanned at the same time by a thread pool. full: list and read everything again."""
+		root = os.path.abspath(root)
+		modparam = self.modparam(os.path.dirname(root)) if root != "/" else None
+		result, out = self._scan(root, full, workers, modparam); now = time.time()
+		self._store(root, {"dirs": (("path", "parent", "mtime", "modparam", "stages"), out["dirs"]),
+			"calcs": (("path", "atoms", "stages", "files", "modparam", "state", "done", "stamp", "updated"), [row + (now,) for row in out["calcs"]])})
+		return len(out["calcs"])
+
+	@staticmethod
+	def _record(row):
+		path, atoms, stages, modparam, state, done = row
+		return {"path": path, "atoms": atoms, "stages": json.loads(stages), "modparam": modparam, "state": state, "done": done}
+
+	def calcs(self, root: str="/", pattern: str=None, state: str=None, atoms: str=None):
+		"""Returns the records of the calculations under root, sorted by path; pattern: glob on the path, state/atoms: only these."""
+		where, params = subtree(os.path.abspath(root))
+		if state: where += " AND state = ?"; params += (state,)
+		if atoms: where += " AND atoms = ?"; params += (atoms,)
+		with self.lock, self._connect() as db:
+			rows = db.execute(f"SELECT path, atoms, stages, modparam, state, done FROM calcs WHERE {where} ORDER BY path", params).fetchall()
+		return [self._record(row) for row in rows if not pattern or fnmatch(row[0], pattern)]
+
+	def get(self, path: str):
+		"""Returns the record of the calculation in path, or None."""
+		with self.lock, self._connect() as db:
+			row = db.execute("SELECT path, atoms, stages, modparam, state, done FROM calcs WHERE path = ?", (os.path.abspath(path),)).fetchone()
+		return self._record(row) if row else None
+
+	def modparam(self, path: str):
+		"""Returns the 'modparam.py' in path or its nearest indexed parent, or None."""
+		path = os.path.abspath(path); parents = [path]
+		while os.path.dirname(parents[-1]) != parents[-1]: parents.append(os.path.dirname(parents[-1]))
+		with self.lock, self._connect() as db:
+			row = db.execute(f"SELECT path FROM dirs WHERE modparam = 1 AND path IN ({', '.join('?' * len(parents))}) ORDER BY length(path) DESC LIMIT 1", parents).fetchone()
+		return os.path.join(row[0], "modparam.py") if row else None
+
+if __name__ == "__main__":
+	import sys, tempfile
+	root = sys.argv[1] if len(sys.argv) > 1 else "."
+	W = Workspace(os.path.join(tempfile.mkdtemp(), "workspace.db"))
+	for label, full in [("full update", True), ("incremental update", False)]:
+		start = time.perf_counter(); n = W.update(root, full=full); elapsed = time.perf_counter() - start
+		print(f"{label}: {n} calculations in {elapsed:.3f} s ({W.stats['listed']} directories listed, {W.stats['reused']} from the index, {W.stats['read']} calculations read)")
+	start = time.perf_counter(); records = W.calcs(root); W.modparam(root); elapsed = time.perf_counter() - start
+	print(f"query: {len(records)} calculations in {elapsed*1000:.2f} ms")
+	for record in records[:20]:
+		print("{:<8}{:>3}/{:<3}{:<8} {}".format(record["state"], record["done"], len(record["stages"]), record["atoms"] or "", record["path"]))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+## authors: Tim
+"""
+This program runs all the programs of this repository from one command: 'pyf.py clean tmp', 'pyf.py qebatch -c H3S/*', 'pyf.py normbandos', ...
+1. The program is loaded only when its subcommand is called, and runs in the same interpreter, so the other programs (and their numpy, sqlite3, ...) are never imported. 'modules' and the folder of the program are put on the path, so the subcommands work from any directory.
+2. Type 'pyf.py' to list the subcommands, and 'pyf.py clean -h' for the help of a program; the programs without command line options print their usage instead of starting.
+3. Type 'pyf.py install ~/bin' to link all the programs and modules (and pyf.py) into one dir, which is how they are used on the cluster ('/home/twchang/bin'). This is the supported installation; the repository is not a pip package.
+4. Type 'pyf.py --profile prof.json normbandos' to write the stage times (parse, transform, write, subprocess, sleep) of the program into prof.json (see modules/profiling.py); '--cprofile' and '--memory' add a cProfile and a tracemalloc capture. This is the same as setting PYF_PROFILE=prof.json.
+5. Type 'pyf.py startup' to measure the startup time of 'pyf.py <subcommand> -h' of every subcommand (the median of 5 runs, and the time above a bare 'python -c pass'); it exits with 1 if any is above '--budget' ms. Nothing else checks the budget, so run it after adding imports.
+"""
+import os, sys
+
+root = os.path.dirname(os.path.realpath(__file__)) # also through the link made by install
+commands = {                 # folder              program
+	"clean"      : ("file_manipulation", "clean.py"),
+	"archive"    : ("file_manipulation", "archive.py"),
+	"hellowork"  : ("file_manipulation", "hellowork.py"),
+	"workparam"  : ("file_manipulation", "workparam.py"),
+	"jobop"      : ("job_queuing",       "jobop.py"),
+	"qebatch"    : ("job_queuing",       "qebatch.py"),
+	"qepar"      : ("job_queuing",       "qepar.py"),
+	"normbandos" : ("data_processing",   "normbandos.py"),
+	"maxmin"     : ("data_processing",   "check_maxmin.py"),
+	"thermal"    : ("data_processing",   "thermal_ph.py"),
+	"transbasis" : ("data_processing",   "transbasis.py"),
+	"phdisp"     : ("data_processing",   "phdisp.py"),
+	"eliashberg" : ("data_processing",   "eliashberg.py"),
+}
+
+def program_path(command: str):
+	folder, program = commands[command]
+	return os.path.join(root, folder, program)
+
+def usage(filename: str):
+	"""Returns the first line of the docstring of a program (without importing it)."""
+	import ast
+	doc = ast.get_docstring(ast.parse(open(filename, "r").read())) or ""
+	return doc.strip().split("\n")[0]
+
+def run(command: str, argv: list):
+	"""Runs the program of command as '__main__' in this interpreter with argv (runpy is not used; it imports pkgutil and more)."""
+	filename = program_path(command)
+	source = open(filename, "r").read()
+	if {"-h", "--help"} & set(argv) and "argparse" not in source: # no options: print its usage instead of starting it
+		import ast
+		print(f"usage: pyf.py {command}\n\n" + (ast.get_docstring(ast.parse(source)) or "").strip()); return
+	sys.path[:0] = [os.path.dirname(filename), os.path.join(root, "modules")]
+	sys.argv = [filename] + argv
+	exec(compile(source, filename, "exec"), {"__name__": "__main__", "__file__": filename, "__builtins__": __builtins__})
+
+def install(bindir: str):
+	"""Links the programs, the modules and pyf.py into bindir."""
+	os.makedirs(bindir, exist_ok=True)
+	modules = [os.path.join(root, "modules", f) for f in sorted(os.listdir(os.path.join(root, "modules"))) if f.endswith(".py")]
+	for filename in [program_path(command) for command in commands] + modules + [os.path.abspath(__file__)]:
+		link = os.path.join(bindir, os.path.basename(filename))
+		if os.path.islink(link): os.remove(link)
+		if os.path.exists(link): print(f"{link} exists and is not a link; skipped."); continue
+		os.symlink(filename, link)
+	print(f"{len(commands) + len(modules) + 1} files linked into {bindir}.")
+
+def startup(budget: float, repeat: int=5):
+	"""Prints the startup time of 'pyf.py <command> -h' of every command; returns False if any is above budget (ms)."""
+	import subprocess as sub, time, statistics
+	def timing(argv):
+		times = []
+		for i in range(repeat):
+			start = time.perf_counter(); sub.run(argv, stdout=sub.DEVNULL, stderr=sub.DEVNULL, cwd=root); times.append((time.perf_counter() - start) * 1000)
+		return statistics.median(times)
+	base = timing([sys.executable, "-c", "pass"]); good = True
+	print("{:<14}{:>10}{:>12}".format("subcommand", "ms", "above base")); print("{:<14}{:>10.1f}{:>12}".format("python", base, ""))
+	for command in commands:
+		ms = timing([sys.executable, os.path.abspath(__file__), command, "-h"]); good = good and ms - base <= budget
+		print("{:<14}{:>10.1f}{:>12.1f}{}".format(command, ms, ms - base, "  <- above budget" if ms - base > budget else ""))
+	return good
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2 or sys.argv[1] in ["-h", "--help"]:
+		print("usage: pyf.py <subcommand> [options]   (pyf.py <subcommand> -h for its help)\n\nsubcommands:")
+		[print(f"  {command:<12}{usage(program_path(command))}") for command in commands]
+		print(f"  {'install':<12}Links all the programs and modules into a dir: 'pyf.py install ~/bin'.")
+		print(f"  {'startup':<12}Measures the startup time of every subcommand: 'pyf.py startup [--budget 150]'.")
+		print("\noptions before the subcommand:\n  --profile FILE  write the stage times into FILE (with --cprofile, --memory)")
+		exit(0)
+	options = {"--cprofile": "PYF_PROFILE_CPROFILE", "--memory": "PYF_PROFILE_MEMORY"}
+	while len(sys.argv) > 2 and sys.argv[1] in ["--profile"] + list(options):
+		if sys.argv[1] == "--profile": os.environ["PYF_PROFILE"] = os.path.abspath(sys.argv.pop(2)) # the programs may chdir
+		else: os.environ[options[sys.argv[1]]] = "1"
+		sys.argv.pop(1)
+	if len(sys.argv) < 2: print("usage: pyf.py [--profile FILE] <subcommand> [options]"); exit(1)
+	if os.environ.get("PYF_PROFILE"): sys.path.insert(0, os.path.join(root, "modules")); import profiling # enabled before the program imports sleep, system, ...
+	command, argv = sys.argv[1], sys.argv[2:]
+	if command == "install":
+		if len(argv) != 1: print("usage: pyf.py install dir"); exit(1)
+		install(os.path.expanduser(argv[0]))
+	elif command == "startup":
+		budget = float(argv[argv.index("--budget") + 1]) if "--budget" in argv else 150
+		exit(0 if startup(budget) else 1)
+	elif command in commands: run(command, argv)
+	else: print(f"Unknown subcommand '{command}'; type 'pyf.py' for the list."); exit(1)